@@ -1,19 +1,99 @@
-from flask import Flask, render_template, request, jsonify, send_file, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, send_file, send_from_directory, stream_with_context
 import os
 import json
 from pathlib import Path
 import threading
 import time
-from page_cloner import WebsiteCloner
+import uuid
+from page_cloner import WebsiteCloner, CaptureCancelled
+from capture_queue import CaptureQueue, QueueFullError
+from capture_batch import CaptureBatch, parse_url_list
+from capture_progress import ProgressBroker, FINISHED_STATUSES
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
+app.config['CAPTURE_WORKERS'] = int(os.environ.get('CAPTURE_WORKERS', 2))
+app.config['CAPTURE_QUEUE_DEPTH'] = int(os.environ.get('CAPTURE_QUEUE_DEPTH', 20))
+app.config['HTML_ENGINE'] = os.environ.get('HTML_ENGINE', 'soup')
+# 'sync' runs each capture on a browser thread; 'async' runs all captures on
+# one event loop sharing a browser and connection pool
+app.config['CAPTURE_ENGINE'] = os.environ.get('CAPTURE_ENGINE', 'sync')
+# Bytes of finished ZIP exports kept for repeat downloads (0 disables the cache)
+app.config['ZIP_CACHE_MAX_BYTES'] = int(os.environ.get('ZIP_CACHE_MAX_BYTES', 0))
+# Screenshot format ('png', 'jpeg' or 'webp'), lossy quality and maximum
+# height in pixels (unset keeps the whole page, up to the format's limit)
+app.config['SCREENSHOT_FORMAT'] = os.environ.get('SCREENSHOT_FORMAT', 'png')
+app.config['SCREENSHOT_QUALITY'] = int(os.environ.get('SCREENSHOT_QUALITY', 80))
+app.config['SCREENSHOT_MAX_HEIGHT'] = int(os.environ.get('SCREENSHOT_MAX_HEIGHT', 0)) or None
+# Captures never change once written, so browsers may cache their images
+app.config['IMAGE_CACHE_SECONDS'] = int(os.environ.get('IMAGE_CACHE_SECONDS', 86400))
+# Batch scheduling: captures at once, captures at once per domain and
+# minimum seconds between captures of one domain
+app.config['BATCH_CONCURRENCY'] = int(os.environ.get('BATCH_CONCURRENCY', app.config['CAPTURE_WORKERS']))
+app.config['BATCH_PER_DOMAIN'] = int(os.environ.get('BATCH_PER_DOMAIN', 1))
+app.config['BATCH_DOMAIN_DELAY'] = float(os.environ.get('BATCH_DOMAIN_DELAY', 2.0))
+# Batches running at once; further batch requests get a 429
+app.config['MAX_ACTIVE_BATCHES'] = int(os.environ.get('MAX_ACTIVE_BATCHES', 2))
 
-# Global variables for progress tracking
-capture_progress = {}
+# Seconds finished captures stay visible to progress clients, and how
+# often they are evicted
+app.config['PROGRESS_RETENTION'] = int(os.environ.get('PROGRESS_RETENTION', 300))
+app.config['PROGRESS_EVICT_INTERVAL'] = int(os.environ.get('PROGRESS_EVICT_INTERVAL', 60))
+# Seconds between keep-alive comments on idle progress streams
+app.config['PROGRESS_KEEPALIVE'] = int(os.environ.get('PROGRESS_KEEPALIVE', 15))
+
+# Progress of queued, running and recently finished captures
+progress_broker = ProgressBroker(max_age=app.config['PROGRESS_RETENTION'])
 capture_lock = threading.Lock()
 
-cloner = WebsiteCloner()
+# Running and recently finished batches by id
+capture_batches = {}
+
+if app.config['CAPTURE_ENGINE'] == 'async':
+    # Queue workers only wait on the event loop, so they are cheap threads
+    from async_cloner import AsyncWebsiteCloner
+    cloner_class = AsyncWebsiteCloner
+else:
+    cloner_class = WebsiteCloner
+cloner = cloner_class(max_browser_contexts=app.config['CAPTURE_WORKERS'],
+                      html_engine=app.config['HTML_ENGINE'],
+                      zip_cache_max_bytes=app.config['ZIP_CACHE_MAX_BYTES'],
+                      screenshot_format=app.config['SCREENSHOT_FORMAT'],
+                      screenshot_quality=app.config['SCREENSHOT_QUALITY'],
+                      screenshot_max_height=app.config['SCREENSHOT_MAX_HEIGHT'])
+
+def run_capture_job(thread_id, job, cancel_event):
+    """Run one queued capture, publishing its progress"""
+    details = {'url': job['url'], 'stage': 'start', 'percent': 0}
+    
+    def progress_callback(message, capture_details):
+        details.update(capture_details)
+        progress_broker.publish(thread_id, 'in_progress', message, **details)
+    
+    # Every job still waiting has moved up one place
+    publish_queue_positions()
+    
+    try:
+        result = cloner.capture_page(job['url'], progress_callback, cancel_event, job['baseline'])
+        details.update(stage='completed', percent=100)
+        progress_broker.publish(thread_id, 'completed', 'Capture completed successfully!', result=result, **details)
+    except CaptureCancelled:
+        progress_broker.publish(thread_id, 'cancelled', 'Capture cancelled', **details)
+    except Exception as e:
+        progress_broker.publish(thread_id, 'error', f'Error: {str(e)}', **details)
+
+def publish_queue_positions():
+    """Push the current queue position of every waiting capture"""
+    for thread_id, progress in progress_broker.jobs(status='queued').items():
+        position = capture_queue.position(thread_id)
+        if position is not None and position != progress.get('queue_position'):
+            progress_broker.publish(thread_id, 'queued', f'Waiting in queue (position {position})...',
+                                    if_status='queued', url=progress.get('url'), stage='queued', percent=0,
+                                    queue_position=position)
+
+capture_queue = CaptureQueue(run_capture_job,
+                             workers=app.config['CAPTURE_WORKERS'],
+                             max_depth=app.config['CAPTURE_QUEUE_DEPTH'])
 
 @app.route('/')
 def index():
@@ -23,73 +103,218 @@ def index():
 
 @app.route('/api/capture', methods=['POST'])
 def capture_website():
-    """Start website capture"""
+    """Start website capture
+    
+    For an incremental recapture pass "baseline" (a capture folder name), or
+    "incremental": true to use the latest completed capture of the URL.
+    """
     data = request.get_json()
     url = data.get('url')
     
     if not url:
         return jsonify({'error': 'URL is required'}), 400
     
-    # Start capture in background thread
-    thread_id = str(int(time.time() * 1000))
-    
-    def capture_with_progress():
-        def progress_callback(message):
-            with capture_lock:
-                capture_progress[thread_id] = {
-                    'status': 'in_progress',
-                    'message': message,
-                    'timestamp': time.time()
-                }
-        
-        try:
-            result = cloner.capture_page(url, progress_callback)
-            with capture_lock:
-                capture_progress[thread_id] = {
-                    'status': 'completed',
-                    'message': 'Capture completed successfully!',
-                    'result': result,
-                    'timestamp': time.time()
-                }
-        except Exception as e:
-            with capture_lock:
-                capture_progress[thread_id] = {
-                    'status': 'error',
-                    'message': f'Error: {str(e)}',
-                    'timestamp': time.time()
-                }
-    
-    thread = threading.Thread(target=capture_with_progress)
-    thread.start()
-    
-    return jsonify({'thread_id': thread_id})
+    baseline = data.get('baseline')
+    if baseline is not None and not isinstance(baseline, str):
+        return jsonify({'error': 'baseline must be a capture folder name'}), 400
+    if baseline and not cloner.is_baseline(baseline):
+        return jsonify({'error': 'Baseline capture not found'}), 404
+    if not baseline and data.get('incremental'):
+        baseline = cloner.find_baseline(url)
+    
+    # Queue the capture for the worker pool
+    thread_id = uuid.uuid4().hex
+    progress_broker.publish(thread_id, 'queued', 'Waiting in queue...', url=url, stage='queued', percent=0)
+    
+    try:
+        capture_queue.submit(thread_id, {'url': url, 'baseline': baseline})
+    except QueueFullError as e:
+        progress_broker.discard(thread_id)
+        return jsonify({'error': str(e)}), 429
+    
+    position = capture_queue.position(thread_id)
+    if position is not None:
+        # Unless a worker has already picked it up
+        progress_broker.publish(thread_id, 'queued', f'Waiting in queue (position {position})...',
+                                if_status='queued', url=url, stage='queued', percent=0, queue_position=position)
+    
+    return jsonify({'thread_id': thread_id, 'queue_position': position, 'baseline': baseline})
 
-@app.route('/api/progress/<thread_id>')
-def get_progress(thread_id):
-    """Get capture progress"""
+@app.route('/api/cancel/<thread_id>', methods=['POST'])
+def cancel_capture(thread_id):
+    """Cancel a queued or running capture"""
+    cancelled = capture_queue.cancel(thread_id)
+    if cancelled is None:
+        return jsonify({'error': 'Capture not found or already finished'}), 404
+    
+    if cancelled == 'queued':
+        progress = progress_broker.get(thread_id) or {}
+        progress_broker.publish(thread_id, 'cancelled', 'Capture cancelled', url=progress.get('url'),
+                                stage='queued', percent=0)
+        publish_queue_positions()
+    
+    return jsonify({'message': f'Cancelled {cancelled} capture'})
+
+@app.route('/api/batch', methods=['POST'])
+def start_batch():
+    """Start capturing a list of URLs
+    
+    Accepts a JSON body {"urls": [...]} or an uploaded URL list file
+    (one URL per line, or a JSON list) in the "file" field. With
+    "incremental" set, each URL is recaptured against its latest capture.
+    """
+    try:
+        upload = request.files.get('file')
+        if upload:
+            urls = parse_url_list(upload.read().decode('utf-8'))
+            incremental = request.form.get('incremental') in ('1', 'true')
+        else:
+            data = request.get_json(silent=True) or {}
+            if not isinstance(data.get('urls', []), list):
+                return jsonify({'error': '"urls" must be a list of URLs'}), 400
+            urls = parse_url_list(json.dumps(data.get('urls', [])))
+            incremental = bool(data.get('incremental'))
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({'error': f'Invalid URL list: {e}'}), 400
+    
+    if not urls:
+        return jsonify({'error': 'At least one URL is required'}), 400
+    
+    batch = CaptureBatch(cloner, urls,
+                         max_concurrent=app.config['BATCH_CONCURRENCY'],
+                         per_domain=app.config['BATCH_PER_DOMAIN'],
+                         domain_delay=app.config['BATCH_DOMAIN_DELAY'],
+                         incremental=incremental)
+    with capture_lock:
+        # Every batch runs its own capture threads, so only a few may run at once
+        active = sum(1 for running in capture_batches.values() if not running.finished)
+        if active >= app.config['MAX_ACTIVE_BATCHES']:
+            return jsonify({'error': f'{active} batches are already running; try again later'}), 429
+        capture_batches[batch.batch_id] = batch
+    batch.start()
+    
+    return jsonify({'batch_id': batch.batch_id, 'urls': len(urls)})
+
+@app.route('/api/batch/<batch_id>')
+def get_batch(batch_id):
+    """Batch progress, or the summary report of a finished batch"""
     with capture_lock:
-        progress = capture_progress.get(thread_id, {
-            'status': 'not_found',
-            'message': 'Capture not found'
-        })
+        batch = capture_batches.get(batch_id)
+    if batch is not None:
+        return jsonify(batch.report())
     
-    # Clean up old progress entries
-    current_time = time.time()
+    # Finished batches are only kept on disk
+    report_path = cloner.base_dir / ".batches" / f"{batch_id}.json"
+    if not batch_id.isalnum() or not report_path.exists():
+        return jsonify({'error': 'Batch not found'}), 404
+    with open(report_path, 'r') as f:
+        return jsonify(json.load(f))
+
+@app.route('/api/batch/<batch_id>/cancel', methods=['POST'])
+def cancel_batch(batch_id):
+    """Cancel the pending and running captures of a batch"""
     with capture_lock:
-        keys_to_remove = [
-            key for key, value in capture_progress.items()
-            if current_time - value.get('timestamp', 0) > 300  # 5 minutes
-        ]
-        for key in keys_to_remove:
-            del capture_progress[key]
+        batch = capture_batches.get(batch_id)
+    if batch is None or batch.finished:
+        return jsonify({'error': 'Batch not found or already finished'}), 404
     
+    batch.cancel()
+    return jsonify({'message': 'Batch cancelled'})
+
+@app.route('/api/progress/<thread_id>')
+def get_progress(thread_id):
+    """Get capture progress"""
+    progress = progress_broker.get(thread_id) or {
+        'status': 'not_found',
+        'message': 'Capture not found'
+    }
     return jsonify(progress)
 
+@app.route('/api/progress/<thread_id>/stream')
+def stream_progress(thread_id):
+    """Server-Sent Events stream of one capture's progress
+    
+    Each event carries the same fields as /api/progress/<thread_id>. The
+    stream ends after the capture finishes.
+    """
+    if progress_broker.get(thread_id) is None:
+        return jsonify({'error': 'Capture not found'}), 404
+    return progress_stream_response(progress_broker.subscribe(thread_id), stop_when_finished=True)
+
+@app.route('/api/progress/stream')
+def stream_all_progress():
+    """Server-Sent Events stream of the progress of every capture
+    
+    Starts with the current progress of every known capture; each event
+    has its thread_id.
+    """
+    return progress_stream_response(progress_broker.subscribe())
+
+def progress_stream_response(subscription, stop_when_finished=False):
+    """Stream a progress subscription as Server-Sent Events"""
+    def events():
+        try:
+            yield "retry: 2000\n\n"
+            while True:
+                updates = subscription.wait(app.config['PROGRESS_KEEPALIVE'])
+                if not updates:
+                    # Lets proxies and the server notice closed connections
+                    yield ": keep-alive\n\n"
+                    continue
+                for thread_id, progress in updates:
+                    yield f"event: progress\ndata: {json.dumps(dict(progress, thread_id=thread_id))}\n\n"
+                    if stop_when_finished and progress['status'] in FINISHED_STATUSES:
+                        return
+        finally:
+            subscription.close()
+    
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def evict_finished_jobs():
+    """Forget finished captures and batches on a timer instead of on every request"""
+    while True:
+        time.sleep(app.config['PROGRESS_EVICT_INTERVAL'])
+        progress_broker.evict()
+        
+        # Finished batch reports stay available from disk
+        with capture_lock:
+            finished_batches = [key for key, batch in capture_batches.items() if batch.finished]
+            for key in finished_batches:
+                del capture_batches[key]
+
+threading.Thread(target=evict_finished_jobs, name="progress-evictor", daemon=True).start()
+
+@app.route('/api/metrics')
+def get_metrics():
+    """Stage timing percentiles of recent captures and queue depth in Prometheus text format"""
+    queue_stats = capture_queue.stats()
+    gauges = {
+        'capture_queue_jobs': ("Captures waiting in or running from the queue", queue_stats),
+        'progress_streams': ("Open progress streams", progress_broker.subscriber_count())
+    }
+    return Response(cloner.metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/captures')
 def get_captures():
-    """Get all captures"""
-    captures = cloner.get_all_captures()
-    return jsonify(captures)
+    """Get captures, optionally filtered and paginated
+    
+    Query parameters: domain, since, until, status, limit, offset.
+    The total number of matches is returned in the X-Total-Count header.
+    """
+    filters = {
+        'domain': request.args.get('domain'),
+        'since': request.args.get('since'),
+        'until': request.args.get('until'),
+        'status': request.args.get('status', 'completed')
+    }
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', 0, type=int)
+    
+    captures = cloner.get_all_captures(limit=limit, offset=offset, **filters)
+    response = jsonify(captures)
+    response.headers['X-Total-Count'] = str(cloner.count_captures(**filters))
+    return response
 
 @app.route('/view/<folder_name>')
 def view_capture(folder_name):
@@ -134,17 +359,34 @@ def serve_captured_file(folder_name, filename):
     if not capture_dir.exists():
         return "Capture not found", 404
     
+    # Analysis packages are only built when first asked for
+    if filename.startswith('analysis-package/'):
+        cloner.ensure_analysis_package(folder_name)
+    
     return send_from_directory(capture_dir, filename)
 
+@app.route('/api/analysis/<folder_name>')
+def get_analysis_package(folder_name):
+    """Asset inventory of a capture's analysis package, creating the package if needed"""
+    try:
+        analysis_dir = cloner.ensure_analysis_package(folder_name)
+    except FileNotFoundError:
+        return jsonify({'error': 'Capture not found'}), 404
+    
+    inventory_path = analysis_dir / "asset-inventory.json"
+    if not inventory_path.exists():
+        return jsonify({'error': 'Analysis package could not be created'}), 500
+    with open(inventory_path, 'r') as f:
+        return jsonify(json.load(f))
+
 @app.route('/_next/static/chunks/<path:filename>')
 def serve_nextjs_chunks(filename):
     """Serve Next.js JavaScript chunks from the most recent capture"""
-    captures = cloner.get_all_captures()
-    if not captures:
+    # Use the most recent capture
+    latest_capture = cloner.get_latest_capture()
+    if not latest_capture:
         return "No captures available", 404
     
-    # Use the most recent capture
-    latest_capture = captures[0]
     folder_name = latest_capture['folder_name']
     capture_dir = cloner.base_dir / folder_name
     
@@ -158,12 +400,11 @@ def serve_nextjs_chunks(filename):
 @app.route('/_next/static/css/<path:filename>')
 def serve_nextjs_css(filename):
     """Serve Next.js CSS files from the most recent capture"""
-    captures = cloner.get_all_captures()
-    if not captures:
+    # Use the most recent capture
+    latest_capture = cloner.get_latest_capture()
+    if not latest_capture:
         return "No captures available", 404
     
-    # Use the most recent capture
-    latest_capture = captures[0]
     folder_name = latest_capture['folder_name']
     capture_dir = cloner.base_dir / folder_name
     
@@ -177,12 +418,11 @@ def serve_nextjs_css(filename):
 @app.route('/_next/static/media/<path:filename>')
 def serve_nextjs_media(filename):
     """Serve Next.js media files from the most recent capture"""
-    captures = cloner.get_all_captures()
-    if not captures:
+    # Use the most recent capture
+    latest_capture = cloner.get_latest_capture()
+    if not latest_capture:
         return "No captures available", 404
     
-    # Use the most recent capture
-    latest_capture = captures[0]
     folder_name = latest_capture['folder_name']
     capture_dir = cloner.base_dir / folder_name
     
@@ -205,21 +445,25 @@ def serve_nextjs_media(filename):
 
 @app.route('/download/<folder_name>')
 def download_capture(folder_name):
-    """Download capture as ZIP"""
+    """Download capture as ZIP, streamed while it is generated"""
     try:
-        zip_path = cloner.create_zip(folder_name)
-        return send_file(zip_path, as_attachment=True, download_name=f"{folder_name}.zip")
+        archive, chunks = cloner.export_zip(folder_name)
+    except FileNotFoundError:
+        return "Capture not found", 404
     except Exception as e:
         return f"Error creating ZIP: {str(e)}", 500
+    
+    if archive is not None:
+        return send_file(archive, mimetype='application/zip', as_attachment=True,
+                         download_name=f"{folder_name}.zip")
+    return Response(stream_with_context(chunks), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="{folder_name}.zip"'})
 
 @app.route('/api/delete/<folder_name>', methods=['DELETE'])
 def delete_capture(folder_name):
     """Delete a capture"""
     try:
-        capture_dir = cloner.base_dir / folder_name
-        if capture_dir.exists():
-            import shutil
-            shutil.rmtree(capture_dir)
+        if cloner.delete_capture(folder_name):
             return jsonify({'message': 'Capture deleted successfully'})
         else:
             return jsonify({'error': 'Capture not found'}), 404
@@ -229,13 +473,24 @@ def delete_capture(folder_name):
 @app.route('/screenshot/<folder_name>')
 def get_screenshot(folder_name):
     """Get screenshot of capture"""
-    capture_dir = cloner.base_dir / folder_name
-    screenshot_path = capture_dir / "screenshot.png"
+    screenshot_path = None
+    if not folder_name.startswith('.'):
+        screenshot_path = cloner.find_screenshot(cloner.base_dir / folder_name)
     
-    if not screenshot_path.exists():
+    if screenshot_path is None:
         return "Screenshot not found", 404
     
-    return send_file(screenshot_path, mimetype='image/png')
+    return send_file(screenshot_path, max_age=app.config['IMAGE_CACHE_SECONDS'])
+
+@app.route('/thumbnail/<folder_name>')
+def get_thumbnail(folder_name):
+    """Get the dashboard thumbnail of a capture"""
+    try:
+        thumbnail_path = cloner.ensure_thumbnail(folder_name)
+    except FileNotFoundError:
+        return "Thumbnail not found", 404
+    
+    return send_file(thumbnail_path, mimetype='image/jpeg', max_age=app.config['IMAGE_CACHE_SECONDS'])
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
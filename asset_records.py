@@ -0,0 +1,73 @@
+class AssetRecord:
+    """Compact, serializable record of one asset reference.
+
+    Records never hold parse-tree objects. The referencing element is
+    identified by element_id, an index into the capture's ElementTable, so
+    records can be persisted or sent to other processes while the tree is
+    discarded.
+
+    attribute names what to rewrite on the element: an attribute such as
+    'src', 'href', 'srcset' or 'data-src'; 'style' for url()s in an inline
+    style attribute; or None for url()s in the text of a <style> element.
+    """
+
+    __slots__ = ('url', 'original_url', 'canonical_url', 'kind', 'attribute', 'element_id',
+                 'stylesheet', 'local_path', 'size', 'content_hash', 'status')
+
+    def __init__(self, url, original_url, kind, attribute=None, element_id=None, stylesheet=None,
+                 canonical_url=None, local_path=None, size=None, content_hash=None, status='pending'):
+        self.url = url
+        self.original_url = original_url
+        self.canonical_url = canonical_url
+        self.kind = kind
+        self.attribute = attribute
+        self.element_id = element_id
+        self.stylesheet = stylesheet
+        self.local_path = local_path
+        self.size = size
+        self.content_hash = content_hash
+        self.status = status
+
+    def to_dict(self):
+        """Plain dict for JSON serialization"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a record from to_dict() output"""
+        return cls(**{name: data.get(name) for name in cls.__slots__ if name in data})
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        for name in self.__slots__:
+            setattr(self, name, state.get(name))
+
+    def __repr__(self):
+        return f"AssetRecord({self.kind}, {self.url!r}, {self.status})"
+
+
+class ElementTable:
+    """Side table mapping element ids used by AssetRecords to parse-tree elements"""
+
+    def __init__(self):
+        self._elements = []
+        self._ids = {}
+
+    def add(self, element):
+        """Get the id for an element, registering it on first sight"""
+        key = id(element)
+        if key not in self._ids:
+            self._ids[key] = len(self._elements)
+            self._elements.append(element)
+        return self._ids[key]
+
+    def get(self, element_id):
+        """Element for an id, or None"""
+        if element_id is None:
+            return None
+        return self._elements[element_id]
+
+    def __len__(self):
+        return len(self._elements)
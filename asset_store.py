@@ -0,0 +1,109 @@
+import os
+import hashlib
+import shutil
+import threading
+import uuid
+from pathlib import Path
+
+
+class AssetStore:
+    """Content-addressed blob store shared by all captures.
+
+    Blobs are stored under their SHA-256 digest and hard-linked into each
+    capture's assets/ tree. The hard-link count doubles as the reference
+    count: a blob whose only remaining link is the store itself is no longer
+    used by any capture and can be freed.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.tmp_dir = self.root / "tmp"
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        # Guards the window between adding a blob and linking it, so a
+        # concurrent release never frees a blob that is about to be used
+        self._lock = threading.Lock()
+
+    def blob_path(self, digest):
+        """Get the path of the blob for a digest"""
+        return self.root / digest[:2] / digest
+
+    def new_temp_path(self):
+        """Get a fresh temporary path inside the store (same filesystem as the blobs)"""
+        return self.tmp_dir / uuid.uuid4().hex
+
+    def hash_file(self, path):
+        """Compute the SHA-256 digest of a file without loading it into memory"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def store(self, temp_path, dest_path, digest=None):
+        """Move a downloaded temp file into the store and link it to dest_path.
+
+        Returns the blob digest. If the content is already stored the temp
+        file is discarded and the existing blob is reused.
+        """
+        if digest is None:
+            digest = self.hash_file(temp_path)
+
+        blob = self.blob_path(digest)
+        with self._lock:
+            if blob.exists():
+                os.unlink(temp_path)
+            else:
+                blob.parent.mkdir(exist_ok=True)
+                os.replace(temp_path, blob)
+            self._link(blob, Path(dest_path))
+
+        return digest
+
+    def link(self, digest, dest_path):
+        """Link an existing blob into a capture. Returns False if the blob is gone"""
+        blob = self.blob_path(digest)
+        with self._lock:
+            if not blob.exists():
+                return False
+            self._link(blob, Path(dest_path))
+        return True
+
+    def _link(self, blob, dest_path):
+        """Hard-link a blob into a capture, copying if hard links are unavailable"""
+        try:
+            os.link(blob, dest_path)
+        except OSError:
+            # Copies don't count as references; the capture owns its own file
+            shutil.copy2(blob, dest_path)
+
+    def ref_count(self, digest):
+        """Number of captures (or cache entries) currently linking to a blob"""
+        blob = self.blob_path(digest)
+        if not blob.exists():
+            return 0
+        return blob.stat().st_nlink - 1
+
+    def release(self, digests):
+        """Free blobs from digests that are no longer referenced by any capture"""
+        freed = 0
+        with self._lock:
+            for digest in set(digests):
+                blob = self.blob_path(digest)
+                try:
+                    stat = blob.stat()
+                except FileNotFoundError:
+                    continue
+                if stat.st_nlink <= 1:
+                    blob.unlink()
+                    freed += stat.st_size
+        return freed
+
+    def collect_garbage(self):
+        """Free every unreferenced blob in the store"""
+        digests = [
+            blob.name
+            for prefix in self.root.iterdir()
+            if prefix.is_dir() and prefix != self.tmp_dir
+            for blob in prefix.iterdir()
+        ]
+        return self.release(digests)
@@ -0,0 +1,585 @@
+import asyncio
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urldefrag
+import aiohttp
+from browser_pool import AsyncBrowserPool
+from asset_records import ElementTable
+from html_document import parse_html
+from screenshots import PAGE_SIZE_SCRIPT
+from page_cloner import (WebsiteCloner, DownloadBudget, DownloadState, DownloadStats, StageTimings, CaptureProgress,
+                         CaptureCancelled, MUTATION_OBSERVER_SCRIPT, SETTLE_STATE_SCRIPT, SETTLE_STEPS)
+
+
+# Response bytes collected on the event loop before each write to disk
+WRITE_BATCH_BYTES = 1024 * 1024
+
+
+class AsyncDownloadState(DownloadState):
+    """Download state shared by every download stage of one async capture
+
+    The asyncio counterpart of DownloadState: slots bounds the capture's
+    concurrent downloads, every URL gets an asyncio completion event and
+    prefetches run as tasks. Its bookkeeping is only touched from the event
+    loop thread; file and blob store work goes through run_io.
+    """
+
+    def __init__(self, max_downloads, budget, asset_store, fetch, run_io, cancel_event=None):
+        super().__init__(None, budget, asset_store, fetch, cancel_event)
+        self.slots = asyncio.Semaphore(max_downloads)
+        self._run_io = run_io
+        self._prefetch_running = set()
+
+    def started(self, canonical_url):
+        """Register a download and return the event set when it finishes"""
+        return self._finished.setdefault(canonical_url, asyncio.Event())
+
+    async def wait_for(self, canonical_url):
+        """Wait until a registered download of the URL has finished"""
+        event = self._finished.get(canonical_url)
+        if event is not None:
+            await event.wait()
+
+    def prefetch(self, canonical_url, url):
+        """Start fetching an asset into a temp link in the blob store"""
+        if not self._claim_prefetch(canonical_url):
+            return
+        temp_path = self.asset_store.new_temp_path()
+        task = asyncio.ensure_future(self._run_prefetch(canonical_url, url, temp_path))
+        self._prefetched[canonical_url] = (task, temp_path)
+
+    async def _run_prefetch(self, canonical_url, url, temp_path):
+        async with self.slots:
+            self._prefetch_running.add(canonical_url)
+            return await self._fetch(url, temp_path, self.budget)
+
+    def take_prefetch(self, canonical_url):
+        """Claim a started prefetch as (task, temp_path), or None
+
+        A prefetch still waiting for a download slot is cancelled instead,
+        so a download never blocks on a job queued behind it.
+        """
+        prefetched = self._prefetched.pop(canonical_url, None)
+        if prefetched is not None and canonical_url not in self._prefetch_running:
+            prefetched[0].cancel()
+            return None
+        return prefetched
+
+    async def close(self):
+        """Drop recorded bodies and prefetches nobody used"""
+        self._closed = True
+        unused = [(canonical_url, task, temp_path) for canonical_url, (task, temp_path) in self._prefetched.items()]
+        self._prefetched.clear()
+        for canonical_url, task, _ in unused:
+            if canonical_url not in self._prefetch_running:
+                task.cancel()
+        await asyncio.gather(*(task for _, task, _ in unused), return_exceptions=True)
+
+        results = [task.result() for _, task, _ in unused if not task.cancelled() and task.exception() is None]
+        await self._run_io(self._discard, results, [temp_path for _, _, temp_path in unused])
+
+
+class AsyncWebsiteCloner(WebsiteCloner):
+    """WebsiteCloner running captures as coroutines on one asyncio event loop
+
+    Captures share one browser (through AsyncBrowserPool) and one aiohttp
+    connection pool, so many can run at once without a thread per browser
+    or per download. CPU-bound stages - parsing, discovery, rewriting and
+    stylesheet processing - run in the loop's default thread executor.
+    Blocking disk, SQLite and blob store calls go to a separate pool of
+    io_workers threads, so a slow write never stalls the shared loop.
+
+    The loop runs on a background thread. submit() may be called from any
+    thread and returns a concurrent.futures.Future; capture_page() keeps
+    the blocking interface of WebsiteCloner.
+    """
+
+    def __init__(self, *args, max_connections=100, io_workers=16, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.browser_pool = AsyncBrowserPool(max_contexts=self.browser_pool.max_contexts,
+                                             max_uses=self.browser_pool.max_uses)
+
+        # Shared by all captures; limit_per_host replaces the per-host semaphores
+        self.max_connections = max_connections
+        self._http_session = None
+        self._io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="capture-io")
+
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
+
+    def start(self):
+        """Start the event loop thread if needed and return the loop"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, name="capture-loop",
+                                                     daemon=True)
+                self._loop_thread.start()
+            return self._loop
+
+    def submit(self, url, progress_callback=None, cancel_event=None, baseline=None):
+        """Schedule a capture on the event loop and return a Future for its folder name"""
+        return asyncio.run_coroutine_threadsafe(
+            self.capture_page_async(url, progress_callback, cancel_event, baseline), self.start()
+        )
+
+    def capture_page(self, url, progress_callback=None, cancel_event=None, baseline=None):
+        """Run a capture on the event loop and wait for it"""
+        return self.submit(url, progress_callback, cancel_event, baseline).result()
+
+    def close(self):
+        """Close the browser and connection pool and stop the event loop"""
+        with self._loop_lock:
+            loop, thread = self._loop, self._loop_thread
+            self._loop = self._loop_thread = None
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self.aclose(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+            self._io_executor.shutdown(wait=True)
+        self._close_js_executor()
+
+    async def aclose(self):
+        """Close the shared browser and connection pool"""
+        if self._http_session is not None:
+            await self._http_session.close()
+            self._http_session = None
+        await self.browser_pool.close()
+
+    async def _run_io(self, fn, *args):
+        """Run blocking disk, SQLite or blob store work on the I/O pool"""
+        return await asyncio.get_running_loop().run_in_executor(self._io_executor, fn, *args)
+
+    def _get_http_session(self):
+        """Shared aiohttp session, created on first use inside the loop"""
+        if self._http_session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_connections,
+                                             limit_per_host=self.max_downloads_per_host)
+            self._http_session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=10),
+                headers={'User-Agent': self.session.headers['User-Agent']}
+            )
+        return self._http_session
+
+    async def capture_page_async(self, url, progress_callback=None, cancel_event=None, baseline=None):
+        """Main capture coroutine, with the same semantics as capture_page"""
+        progress = CaptureProgress(progress_callback, cancel_event)
+        report_progress = progress.update
+
+        def log_progress(message, stage=None):
+            report_progress(message, stage)
+            print(message)
+
+        loop = asyncio.get_running_loop()
+        capture_dir = None
+        state = None
+        load_task = None
+        timings = StageTimings()
+        try:
+            log_progress("🚀 Starting capture...", 'start')
+            capture_dir = await self._run_io(self._start_capture, url)
+
+            # Downloads can start while the page is still loading
+            state = self._new_async_download_state(cancel_event)
+            baseline_records = {}
+            if baseline:
+                log_progress("♻️ Loading baseline capture...", 'baseline')
+                baseline_records = await self._run_io(self._apply_baseline, state, baseline)
+
+            # The HTML arrives through page_ready while the browser goes on
+            # to take the screenshot. The browser stage gives up after
+            # browser_timeout seconds, as in capture_page.
+            log_progress("🌐 Acquiring browser...", 'browser')
+            page_ready = loop.create_future()
+            load_task = asyncio.ensure_future(
+                self._load_page_async(url, capture_dir, log_progress, page_ready, state, timings)
+            )
+            await asyncio.wait([page_ready, load_task], timeout=self.browser_timeout,
+                               return_when=asyncio.FIRST_COMPLETED)
+            if not page_ready.done():
+                if not load_task.done():
+                    load_task.cancel()
+                    raise TimeoutError(f"No page from the browser after {self.browser_timeout}s")
+                await load_task
+            html_content, final_url, state.browser_assets = page_ready.result()
+
+            # Parse HTML with the configured engine
+            # The event loop is shared with other captures, so stages only
+            # count the CPU time of the work they hand to the executor
+            with timings.stage('parse', track_cpu=False):
+                document = await loop.run_in_executor(None, timings.cpu_timed('parse', parse_html), html_content,
+                                                      self.html_engine)
+
+            # Track assets
+            assets = self._new_asset_lists()
+
+            # Find all assets
+            log_progress("🔍 Discovering assets...", 'discover')
+            with timings.stage('discover', track_cpu=False):
+                elements = ElementTable()
+                asset_index = await loop.run_in_executor(None, timings.cpu_timed('discover', self._discover_assets),
+                                                         document, final_url, assets, elements)
+
+            css_index, other_index = self._split_download_stages(asset_index, state)
+
+            async def stylesheet_stage():
+                with timings.stage('stylesheets', track_cpu=False) as stage:
+                    stats = await self._download_assets_async(assets, capture_dir, report_progress, css_index, state)
+                    css_stats = await self._process_stylesheets_async(assets, capture_dir, asset_index,
+                                                                      report_progress, state)
+                    for key, value in css_stats.items():
+                        stats[key] += value
+                    stage['bytes'] = stats['bytes']
+                    return stats
+
+            # Download assets
+            log_progress("⬇️ Downloading assets...", 'download')
+            css_task = asyncio.ensure_future(stylesheet_stage())
+            try:
+                with timings.stage('download', track_cpu=False) as stage:
+                    download_stats = await self._download_assets_async(assets, capture_dir, report_progress,
+                                                                       other_index, state)
+                    stage['bytes'] = download_stats['bytes']
+                log_progress("🎨 Processing stylesheets...", 'stylesheets')
+                for key, value in (await css_task).items():
+                    download_stats[key] += value
+            finally:
+                if not css_task.done():
+                    css_task.cancel()
+                    await asyncio.gather(css_task, return_exceptions=True)
+
+            # Rewrite HTML
+            log_progress("✏️ Rewriting HTML...", 'rewrite')
+            with timings.stage('rewrite', track_cpu=False):
+                url_index = self._build_url_index(assets, final_url)
+                await loop.run_in_executor(None, timings.cpu_timed('rewrite', self._rewrite_html), document, assets,
+                                           elements, capture_dir, url_index)
+
+            modified_js_files = []
+            if self.patch_js_loaders:
+                log_progress("🧩 Patching JavaScript image loaders...", 'patch_js')
+                with timings.stage('patch_js', track_cpu=False):
+                    modified_js_files = await loop.run_in_executor(
+                        None, timings.cpu_timed('patch_js', self._modify_nextjs_loader_in_js_files), assets,
+                        capture_dir, url_index, timings
+                    )
+
+            # The screenshot has been running alongside everything above
+            screenshot_tiles, truncated = await asyncio.wait_for(load_task, self.browser_timeout)
+            await self._finish_capture_stages_async(state, load_task)
+
+            with timings.stage('screenshot_encode', track_cpu=False):
+                screenshot = await loop.run_in_executor(None, timings.cpu_timed('screenshot_encode',
+                                                                                self._save_screenshot),
+                                                        capture_dir, screenshot_tiles, truncated)
+
+            # Save metadata
+            await self._run_io(self._save_capture, capture_dir, url, final_url, assets, asset_index,
+                               download_stats, modified_js_files, timings, baseline, baseline_records, screenshot,
+                               state.assumed_unchanged)
+
+            log_progress("✅ Capture completed successfully!", 'completed')
+            return capture_dir.name
+
+        except (CaptureCancelled, asyncio.CancelledError):
+            print(f"🛑 Capture of {url} cancelled")
+            await self._finish_capture_stages_async(state, load_task)
+            if capture_dir is not None:
+                await self._run_io(self.delete_capture, capture_dir.name)
+            raise
+
+        except Exception as e:
+            message = f"❌ Error: {str(e)}"
+            progress.report(message, 'error')
+            print(message)
+            await self._finish_capture_stages_async(state, load_task)
+            if capture_dir is not None:
+                await self._run_io(self.catalog.set_status, capture_dir.name, 'error')
+            raise
+
+    async def _finish_capture_stages_async(self, state, load_task):
+        """Wait for the browser stage and release the download state"""
+        if load_task is not None:
+            await asyncio.wait([load_task], timeout=self.browser_timeout)
+            if not load_task.done():
+                load_task.cancel()
+                await asyncio.wait([load_task])
+        if state is not None:
+            await state.close()
+
+    def _new_async_download_state(self, cancel_event=None):
+        """Fresh download state for one async capture"""
+        return AsyncDownloadState(self.max_download_workers, DownloadBudget(self.capture_byte_budget),
+                                  self.asset_store, self._fetch_asset_async, self._run_io, cancel_event)
+
+    async def _wait_for_settle_async(self, page, network, max_wait_ms, on_poll=None):
+        """Wait until the network, DOM and visible images are quiet, at most max_wait_ms"""
+        loop = asyncio.get_running_loop()
+        if not self.adaptive_settle:
+            await page.wait_for_timeout(max_wait_ms)
+            if on_poll:
+                await on_poll()
+            return
+
+        deadline = loop.time() + max_wait_ms / 1000
+        while loop.time() < deadline:
+            if on_poll:
+                await on_poll()
+            if self._is_settled(network, await page.evaluate(SETTLE_STATE_SCRIPT)):
+                return
+
+            await page.wait_for_timeout(100)
+
+    async def _collect_browser_assets_async(self, responses, browser_assets, network=None):
+        """Write recorded response bodies to temp files keyed by canonical URL"""
+        for canonical_url, response in self._take_recordable(responses, browser_assets, network):
+            try:
+                await self._run_io(self._save_browser_body, canonical_url, await response.body(), browser_assets)
+            except Exception as e:
+                # Bodies can be evicted from the browser's buffer; they will be refetched
+                print(f"Warning: Could not record browser response for {response.url}: {e}")
+
+        return browser_assets
+
+    async def _load_page_async(self, url, capture_dir, log_progress, page_ready=None, state=None, timings=None):
+        """Load and settle the page in a pooled browser context
+
+        Same stages and result as _load_page; the HTML is set on page_ready
+        before the screenshot is taken.
+        """
+        if timings is None:
+            timings = StageTimings()
+
+        browser_requested = time.monotonic()
+        async with self.browser_pool.context() as context:
+            # Waiting for a pooled browser, launching it if needed
+            timings.record('browser', browser_requested)
+            page = await context.new_page()
+            network = self._watch_requests(page)
+            await page.add_init_script(MUTATION_OBSERVER_SCRIPT)
+            prefetch = None
+            if state is not None:
+                prefetch = lambda asset_url: state.prefetch(self.canonicalize_asset_url(asset_url, asset_url),
+                                                            asset_url)
+            responses = self._record_responses(page, prefetch)
+            browser_assets = {}
+            collect_bodies = lambda: self._collect_browser_assets_async(responses, browser_assets, network)
+
+            # Set realistic viewport
+            await page.set_viewport_size({"width": 1920, "height": 1080})
+
+            log_progress("📄 Loading page...", 'load')
+            with timings.stage('load', track_cpu=False):
+                response = await page.goto(url, wait_until="networkidle", timeout=30000)
+
+                if not response.ok:
+                    raise Exception(f"Failed to load page: {response.status}")
+
+            # Wait for dynamic content and trigger lazy loading
+            with timings.stage('settle', track_cpu=False):
+                for message, script, max_wait_ms in SETTLE_STEPS:
+                    if message:
+                        log_progress(message, 'settle')
+                    if script:
+                        await page.evaluate(script)
+                    await self._wait_for_settle_async(page, network, max_wait_ms, collect_bodies)
+
+            # Get final HTML
+            log_progress("🔍 Extracting HTML...", 'extract')
+            with timings.stage('extract', track_cpu=False) as stage:
+                html_content = await page.content()
+                final_url = page.url
+                await self._collect_browser_assets_async(responses, browser_assets)
+                stage['bytes'] = self._browser_bytes(html_content, browser_assets)
+
+            # Hand the page over before the screenshot so processing can start
+            if page_ready is not None:
+                page_ready.set_result((html_content, final_url, browser_assets))
+
+            log_progress("📸 Taking screenshot...", 'screenshot')
+            with timings.stage('screenshot', track_cpu=False) as stage:
+                clips, truncated = self._screenshot_clips(await page.evaluate(PAGE_SIZE_SCRIPT))
+                tiles = [await page.screenshot(full_page=True, clip=clip) for clip in clips]
+                stage['bytes'] = sum(len(tile) for tile in tiles)
+
+        return tiles, truncated
+
+    async def _fetch_asset_async(self, url, filepath, budget=None):
+        """Download a single asset into the blob store and link it at filepath
+
+        Returns (digest, bytes_transferred, truncated).
+        """
+        session = self._get_http_session()
+        cached = await self._run_io(self.http_cache.lookup, url)
+
+        response = await session.get(url, headers=self.http_cache.conditional_headers(cached))
+        try:
+            if response.status == 304 and cached:
+                # Unchanged since the last capture - reuse the cached body
+                if await self._run_io(self.asset_store.link, cached['digest'], filepath):
+                    await self._run_io(self.http_cache.touch, url)
+                    return cached['digest'], 0, False
+
+                # Cached body disappeared; fall back to a full fetch
+                await self._run_io(self.http_cache.invalidate, url)
+                response.release()
+                response = await session.get(url)
+
+            response.raise_for_status()
+            self._check_content_length(response.headers)
+
+            digest, size, truncated = await self._stream_to_store_async(response, filepath, budget)
+        finally:
+            response.release()
+
+        # Truncated bodies must never be served as the full resource later
+        if not truncated:
+            await self._run_io(self.http_cache.update, url, response, digest, size)
+        return digest, size, truncated
+
+    async def _stream_to_store_async(self, response, filepath, budget=None):
+        """Stream a response body to a temp file, then move it into the blob store
+
+        Chunks are collected on the loop and written and hashed in batches
+        of WRITE_BATCH_BYTES on the I/O pool. As in _stream_to_store, the
+        bytes reserved from budget are given back if no blob gets stored.
+        """
+        temp_path = self.asset_store.new_temp_path()
+        hasher = hashlib.sha256()
+        size = 0
+        truncated = False
+
+        try:
+            f = await self._run_io(open, temp_path, 'wb')
+            try:
+                pending = []
+                pending_size = 0
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    chunk, truncated = self._limit_chunk(chunk, size, budget)
+                    pending.append(chunk)
+                    pending_size += len(chunk)
+                    size += len(chunk)
+
+                    if pending_size >= WRITE_BATCH_BYTES:
+                        await self._run_io(self._write_hashed, f, hasher, b''.join(pending))
+                        pending = []
+                        pending_size = 0
+                    if truncated:
+                        break
+
+                if pending:
+                    await self._run_io(self._write_hashed, f, hasher, b''.join(pending))
+            finally:
+                await self._run_io(f.close)
+
+            digest = hasher.hexdigest()
+            await self._run_io(self.asset_store.store, temp_path, filepath, digest)
+        except BaseException:
+            if budget is not None:
+                budget.release(size)
+            raise
+        finally:
+            await self._run_io(self._remove_temp, temp_path)
+
+        return digest, size, truncated
+
+    def _write_hashed(self, f, hasher, data):
+        f.write(data)
+        hasher.update(data)
+
+    def _remove_temp(self, temp_path):
+        if temp_path.exists():
+            temp_path.unlink()
+
+    async def _link_prefetched_async(self, prefetched, filepath, budget=None):
+        """Link a finished prefetch at filepath; see _link_prefetched
+
+        The task is awaited on the loop; once it is done, reading its result
+        on the I/O pool is safe.
+        """
+        await asyncio.wait([prefetched[0]])
+        return await self._run_io(self._link_prefetched, prefetched, filepath, budget)
+
+    async def _obtain_asset_async(self, state, canonical_url, fetch_url, filepath):
+        """Store an asset at filepath from the cheapest source that has it; see _obtain_asset"""
+        content_hash, source = await self._run_io(self._reuse_local_copy, state, canonical_url, fetch_url, filepath)
+        if content_hash is not None:
+            return content_hash, 0, False, source
+        prefetched = state.take_prefetch(canonical_url)
+        if prefetched is not None:
+            content_hash, size, truncated = await self._link_prefetched_async(prefetched, filepath, state.budget)
+            if content_hash is not None:
+                return content_hash, size, truncated, 'prefetched'
+        content_hash, size, truncated = await self._fetch_asset_async(fetch_url, filepath, state.budget)
+        return content_hash, size, truncated, None
+
+    async def _download_assets_async(self, assets, capture_dir, progress_callback, asset_index, state):
+        """Download all assets in asset_index concurrently, fetching each unique URL once"""
+        jobs = self._plan_downloads(asset_index, capture_dir, state)
+        stats = DownloadStats(len(jobs))
+
+        async def download_job(asset_type, canonical_url, references, filename, finished):
+            async with state.slots:
+                # Jobs still waiting for a slot when the capture is cancelled never fetch
+                if state.cancelled():
+                    finished.set()
+                    raise CaptureCancelled("Capture cancelled")
+                stats.start()
+
+                # Fetch the URL as the page spelled it; the canonical form is only a key
+                fetch_url = urldefrag(references[0][1].url)[0]
+                filepath = capture_dir / "assets" / asset_type / filename
+                try:
+                    content_hash, size, truncated, source = await self._obtain_asset_async(
+                        state, canonical_url, fetch_url, filepath)
+                    stored_size = (await self._run_io(filepath.stat)).st_size
+                    snapshot = self._finish_download(references, stats, f"assets/{asset_type}/{filename}",
+                                                     content_hash, stored_size, size, truncated, source)
+                except Exception as e:
+                    snapshot = self._fail_download(references, stats, fetch_url, e)
+                finished.set()
+                self._report_download_progress(progress_callback, stats, snapshot)
+
+        self._report_download_progress(progress_callback, stats, stats.snapshot())
+
+        # Let every job finish before reporting a failure such as a cancellation
+        results = await asyncio.gather(*(download_job(*job) for job in jobs), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        return stats.summary()
+
+    async def _process_stylesheets_async(self, assets, capture_dir, asset_index, progress_callback, state):
+        """Rewrite url() and @import references in downloaded stylesheets; see _process_stylesheets"""
+        loop = asyncio.get_running_loop()
+        stats = {}
+        processed = set()
+
+        while True:
+            parsed, new_assets, new_index = await loop.run_in_executor(
+                None, self._parse_pending_stylesheets, assets, capture_dir, asset_index, processed
+            )
+            if not parsed:
+                break
+
+            if new_index:
+                new_stats = await self._download_assets_async(new_assets, capture_dir, progress_callback,
+                                                              new_index, state)
+                for key, value in new_stats.items():
+                    stats[key] = stats.get(key, 0) + value
+                for asset_type, asset_list in new_assets.items():
+                    assets[asset_type].extend(asset_list)
+
+            for sheet in parsed:
+                for ref_url in sheet[-1]:
+                    if ref_url:
+                        await state.wait_for(ref_url)
+                await loop.run_in_executor(None, self._rewrite_stylesheet, sheet, asset_index)
+
+        return stats
@@ -0,0 +1,229 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from playwright.async_api import async_playwright
+from playwright.sync_api import sync_playwright
+
+
+class BrowserPool:
+    """Long-lived pool of Chromium browsers handing out isolated contexts.
+
+    Playwright's sync API binds every object to the thread that created it,
+    so each pooled browser lives on its own worker thread. Callers submit a
+    function that receives a fresh browser context; it runs on a browser
+    thread and its result (or exception) is returned to the caller. The
+    number of workers bounds the number of concurrent contexts. Browsers
+    are health-checked before each use and recycled after max_uses.
+    """
+
+    def __init__(self, max_contexts=2, max_uses=50, headless=True):
+        self.max_contexts = max_contexts
+        self.max_uses = max_uses
+        self.headless = headless
+
+        self._tasks = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def run(self, fn):
+        """Run fn(context) on a pooled browser and return its result"""
+        return self.submit(fn).result()
+
+    def submit(self, fn):
+        """Queue fn(context) for a pooled browser and return a Future for its result"""
+        self._ensure_started()
+        future = Future()
+        self._tasks.put((fn, future))
+        return future
+
+    def _ensure_started(self):
+        """Start the browser worker threads on first use"""
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.max_contexts):
+                worker = threading.Thread(target=self._worker_loop, name=f"browser-pool-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _worker_loop(self):
+        """Own one browser and serve capture tasks with it
+
+        If Playwright fails to start or dies, or a browser fails to launch,
+        the next queued task fails with that error and the worker starts
+        Playwright again, so callers never wait on a worker that is gone.
+        """
+        stopped = False
+        while not stopped:
+            try:
+                with sync_playwright() as p:
+                    stopped = self._serve(p)
+            except Exception as e:
+                print(f"Warning: Browser worker failed: {e}")
+                if not stopped:
+                    stopped = self._fail_next_task(e)
+
+    def _serve(self, p):
+        """Run queued tasks on this worker's browser
+
+        Returns True once told to stop, or False after a failed browser
+        launch so the worker restarts Playwright.
+        """
+        browser = None
+        uses = 0
+        try:
+            while True:
+                task = self._tasks.get()
+                if task is None:
+                    return True
+
+                fn, future = task
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                # Health check and recycling
+                if browser is None or not browser.is_connected() or uses >= self.max_uses:
+                    self._close_browser(browser)
+                    browser = None
+                    try:
+                        browser = p.chromium.launch(headless=self.headless)
+                    except Exception as e:
+                        # Usually the Playwright driver itself has died
+                        print(f"Warning: Browser launch failed: {e}")
+                        future.set_exception(e)
+                        return False
+                    uses = 0
+                uses += 1
+
+                try:
+                    context = browser.new_context()
+                    try:
+                        future.set_result(fn(context))
+                    finally:
+                        context.close()
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+        finally:
+            self._close_browser(browser)
+
+    def _fail_next_task(self, error):
+        """Fail the next queued task with error; returns True if told to stop instead"""
+        task = self._tasks.get()
+        if task is None:
+            return True
+        _, future = task
+        if future.set_running_or_notify_cancel():
+            future.set_exception(error)
+        return False
+
+    def _close_browser(self, browser):
+        """Close a browser, ignoring errors from one that already died"""
+        if browser is None:
+            return
+        try:
+            browser.close()
+        except Exception as e:
+            print(f"Warning: Failed to close browser: {e}")
+
+    def close(self):
+        """Stop all browser workers and close their browsers"""
+        with self._lock:
+            workers = self._workers
+            self._workers = []
+        for _ in workers:
+            self._tasks.put(None)
+        for worker in workers:
+            worker.join()
+
+
+class AsyncBrowserPool:
+    """Shared Chromium browser for captures running on one asyncio event loop.
+
+    With the async API a single browser serves many contexts concurrently,
+    so no worker threads are needed; max_contexts bounds how many are open
+    at once. The browser is replaced when it disconnects or after max_uses
+    contexts, and a replaced browser is closed once its last context ends.
+    """
+
+    def __init__(self, max_contexts=4, max_uses=50, headless=True):
+        self.max_contexts = max_contexts
+        self.max_uses = max_uses
+        self.headless = headless
+
+        self._playwright = None
+        self._browser = None
+        self._uses = 0
+        self._open_contexts = {}
+        self._semaphore = None
+        self._lock = None
+
+    @asynccontextmanager
+    async def context(self):
+        """Open a fresh browser context for the enclosed block"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_contexts)
+            self._lock = asyncio.Lock()
+
+        async with self._semaphore:
+            browser = await self._acquire_browser()
+            try:
+                context = await browser.new_context()
+                try:
+                    yield context
+                finally:
+                    try:
+                        await context.close()
+                    except Exception as e:
+                        print(f"Warning: Failed to close browser context: {e}")
+            finally:
+                await self._release_browser(browser)
+
+    async def _acquire_browser(self):
+        """Current browser, launching or replacing it as needed"""
+        async with self._lock:
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+
+            # Health check and recycling
+            if self._browser is None or not self._browser.is_connected() or self._uses >= self.max_uses:
+                retired = self._browser
+                self._browser = await self._playwright.chromium.launch(headless=self.headless)
+                self._uses = 0
+                if retired is not None and not self._open_contexts.get(retired):
+                    self._open_contexts.pop(retired, None)
+                    await self._close_browser(retired)
+
+            self._uses += 1
+            self._open_contexts[self._browser] = self._open_contexts.get(self._browser, 0) + 1
+            return self._browser
+
+    async def _release_browser(self, browser):
+        """Close a replaced browser once its last context is done"""
+        async with self._lock:
+            self._open_contexts[browser] -= 1
+            if browser is not self._browser and not self._open_contexts[browser]:
+                del self._open_contexts[browser]
+                await self._close_browser(browser)
+
+    async def _close_browser(self, browser):
+        """Close a browser, ignoring errors from one that already died"""
+        try:
+            await browser.close()
+        except Exception as e:
+            print(f"Warning: Failed to close browser: {e}")
+
+    async def close(self):
+        """Close all browsers and stop Playwright"""
+        browsers = set(self._open_contexts)
+        if self._browser is not None:
+            browsers.add(self._browser)
+        for browser in browsers:
+            await self._close_browser(browser)
+        self._open_contexts.clear()
+        self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
@@ -0,0 +1,291 @@
+import argparse
+import json
+import threading
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import urlparse
+from page_cloner import CaptureCancelled
+
+
+def parse_url_list(text):
+    """URLs from a JSON list, a JSON object with a "urls" list, or one URL per line
+
+    Blank lines and lines starting with # are ignored and duplicates are
+    dropped, keeping the first occurrence.
+    """
+    stripped = text.strip()
+    if stripped.startswith(('[', '{')):
+        data = json.loads(stripped)
+        urls = data.get('urls', []) if isinstance(data, dict) else data
+    else:
+        urls = [line for line in stripped.splitlines() if not line.strip().startswith('#')]
+
+    seen = set()
+    result = []
+    for url in urls:
+        url = str(url).strip()
+        if url and url not in seen:
+            seen.add(url)
+            result.append(url)
+    return result
+
+
+def load_url_list(path):
+    """Read a URL list file; see parse_url_list for the accepted formats"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return parse_url_list(f.read())
+
+
+class CaptureBatch:
+    """Capture a list of URLs with global and per-domain limits.
+
+    At most max_concurrent captures run at once, at most per_domain of them
+    against the same domain, and captures of one domain start at least
+    domain_delay seconds apart. All captures go through the same cloner,
+    so the browser pool, HTTP cache and blob store are shared across the
+    batch. When the batch finishes a summary report with per-URL timing,
+    bytes and failures is written to report_path.
+
+    With incremental, each URL is recaptured against its latest completed
+    capture, so only changed assets are downloaded.
+    """
+
+    def __init__(self, cloner, urls, max_concurrent=4, per_domain=1, domain_delay=1.0, batch_id=None,
+                 report_path=None, incremental=False):
+        self.cloner = cloner
+        self.incremental = incremental
+        self.max_concurrent = max(1, max_concurrent)
+        self.per_domain = max(1, per_domain)
+        self.domain_delay = domain_delay
+        self.batch_id = batch_id or uuid.uuid4().hex
+        self.report_path = report_path or cloner.base_dir / ".batches" / f"{self.batch_id}.json"
+
+        self.created = datetime.now().isoformat()
+        self.finished = None
+        self.entries = [self._new_entry(url) for url in urls]
+
+        self._pending = [entry for entry in self.entries if entry['status'] == 'pending']
+        self._active = {}
+        self._last_start = {}
+        self._cancel_event = threading.Event()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def _new_entry(self, url):
+        """Per-URL result row; URLs that cannot be captured fail right away"""
+        parsed = urlparse(url)
+        entry = {
+            'url': url,
+            'domain': parsed.netloc.lower().replace('www.', ''),
+            'status': 'pending',
+            'message': None,
+            'folder_name': None,
+            'baseline': None,
+            'changed_assets': None,
+            'started': None,
+            'seconds': None,
+            'bytes': 0,
+            'assets': 0,
+            'failed_assets': 0,
+            'error': None
+        }
+        if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+            entry['status'] = 'error'
+            entry['error'] = 'Invalid URL'
+        return entry
+
+    def start(self):
+        """Run the batch on a background thread"""
+        self._thread = threading.Thread(target=self.run, name=f"capture-batch-{self.batch_id[:8]}", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        """Wait for a batch started with start() to finish"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def cancel(self):
+        """Stop scheduling new captures and cancel the running ones"""
+        with self._condition:
+            self._cancel_event.set()
+            for entry in self._pending:
+                entry['status'] = 'cancelled'
+            self._pending = []
+            self._condition.notify_all()
+
+    def run(self):
+        """Capture every URL and return the summary report"""
+        workers = [
+            threading.Thread(target=self._worker_loop, name=f"capture-batch-worker-{i}", daemon=True)
+            for i in range(min(self.max_concurrent, len(self._pending)))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        report = self.report()
+        report['finished'] = datetime.now().isoformat()
+        try:
+            self.report_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.report_path, 'w') as f:
+                json.dump(report, f, indent=2)
+        except Exception as e:
+            print(f"Warning: Failed to write batch report {self.report_path}: {e}")
+
+        # Only marked finished once the report is on disk
+        self.finished = report['finished']
+        return report
+
+    def report(self):
+        """Summary of the batch so far: settings, totals and one row per URL"""
+        with self._condition:
+            captures = [dict(entry) for entry in self.entries]
+
+        totals = {'urls': len(captures), 'bytes': 0, 'seconds': 0.0}
+        for status in ('pending', 'running', 'completed', 'error', 'cancelled'):
+            totals[status] = 0
+        for entry in captures:
+            totals[entry['status']] += 1
+            totals['bytes'] += entry['bytes']
+            totals['seconds'] += entry['seconds'] or 0.0
+        totals['seconds'] = round(totals['seconds'], 3)
+
+        return {
+            'batch_id': self.batch_id,
+            'created': self.created,
+            'finished': self.finished,
+            'settings': {
+                'max_concurrent': self.max_concurrent,
+                'per_domain': self.per_domain,
+                'domain_delay': self.domain_delay,
+                'incremental': self.incremental
+            },
+            'totals': totals,
+            'captures': captures
+        }
+
+    def _worker_loop(self):
+        """Capture URLs until none are left"""
+        while True:
+            entry = self._next_entry()
+            if entry is None:
+                return
+            try:
+                self._capture(entry)
+            finally:
+                with self._condition:
+                    self._active[entry['domain']] -= 1
+                    self._condition.notify_all()
+
+    def _next_entry(self):
+        """Take the first pending URL whose domain may start a capture now, waiting if needed"""
+        with self._condition:
+            while self._pending:
+                now = time.monotonic()
+                next_ready = None
+                for entry in self._pending:
+                    domain = entry['domain']
+                    if self._active.get(domain, 0) >= self.per_domain:
+                        continue
+                    ready_at = self._last_start.get(domain, now - self.domain_delay) + self.domain_delay
+                    if ready_at <= now:
+                        self._pending.remove(entry)
+                        self._active[domain] = self._active.get(domain, 0) + 1
+                        self._last_start[domain] = now
+                        entry['status'] = 'running'
+                        entry['started'] = datetime.now().isoformat()
+                        return entry
+                    next_ready = ready_at if next_ready is None else min(next_ready, ready_at)
+
+                # Every domain is busy or cooling down
+                self._condition.wait(None if next_ready is None else next_ready - now)
+        return None
+
+    def _capture(self, entry):
+        """Capture one URL and record its outcome on the entry"""
+        def progress_callback(message, details):
+            entry['message'] = message
+
+        start = time.monotonic()
+        try:
+            if self.incremental:
+                entry['baseline'] = self.cloner.find_baseline(entry['url'])
+            folder_name = self.cloner.capture_page(entry['url'], progress_callback, self._cancel_event,
+                                                   entry['baseline'])
+            entry['folder_name'] = folder_name
+            entry['status'] = 'completed'
+            self._add_capture_stats(entry, folder_name)
+        except CaptureCancelled:
+            entry['status'] = 'cancelled'
+        except Exception as e:
+            entry['status'] = 'error'
+            entry['error'] = str(e)
+        entry['seconds'] = round(time.monotonic() - start, 3)
+        entry['message'] = None
+        print(f"📦 Batch {self.batch_id[:8]}: {entry['url']} {entry['status']} in {entry['seconds']}s")
+
+    def _add_capture_stats(self, entry, folder_name):
+        """Copy byte and asset counts from a finished capture's metadata"""
+        try:
+            with open(self.cloner.base_dir / folder_name / "metadata.json", 'r') as f:
+                metadata = json.load(f)
+        except Exception as e:
+            print(f"Warning: Failed to read metadata for {folder_name}: {e}")
+            return
+        download_stats = metadata.get('download_stats', {})
+        entry['bytes'] = download_stats.get('bytes', 0)
+        entry['assets'] = metadata.get('unique_assets', 0)
+        entry['failed_assets'] = download_stats.get('failed', 0)
+        diff = metadata.get('diff')
+        if diff:
+            entry['changed_assets'] = len(diff['added']) + len(diff['removed']) + len(diff['changed'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture a list of URLs")
+    parser.add_argument('url_file', help="file with one URL per line, or a JSON list of URLs")
+    parser.add_argument('--base-dir', default="captured_sites", help="directory captures are written to")
+    parser.add_argument('--concurrency', type=int, default=4, help="captures running at once")
+    parser.add_argument('--per-domain', type=int, default=1, help="captures running at once per domain")
+    parser.add_argument('--domain-delay', type=float, default=1.0,
+                        help="minimum seconds between captures of one domain")
+    parser.add_argument('--engine', choices=('sync', 'async'), default='sync', help="capture engine")
+    parser.add_argument('--html-engine', choices=('soup', 'lxml'), default='soup', help="HTML engine")
+    parser.add_argument('--incremental', action='store_true',
+                        help="recapture each URL against its latest capture, fetching only changed assets")
+    parser.add_argument('--report', help="path of the summary report (default: <base-dir>/.batches/<id>.json)")
+    args = parser.parse_args()
+
+    urls = load_url_list(args.url_file)
+    if args.engine == 'async':
+        from async_cloner import AsyncWebsiteCloner
+        cloner_class = AsyncWebsiteCloner
+    else:
+        from page_cloner import WebsiteCloner
+        cloner_class = WebsiteCloner
+    cloner = cloner_class(base_dir=args.base_dir, max_browser_contexts=args.concurrency,
+                          html_engine=args.html_engine)
+
+    batch = CaptureBatch(cloner, urls, max_concurrent=args.concurrency, per_domain=args.per_domain,
+                         domain_delay=args.domain_delay, report_path=args.report, incremental=args.incremental)
+    print(f"🚀 Capturing {len(urls)} URLs (batch {batch.batch_id})")
+    batch.start()
+    try:
+        batch.wait()
+    except KeyboardInterrupt:
+        print("🛑 Cancelling batch...")
+        batch.cancel()
+        batch.wait()
+    finally:
+        cloner.close()
+
+    totals = batch.report()['totals']
+    print(f"✅ {totals['completed']} completed, {totals['error']} failed, {totals['cancelled']} cancelled, "
+          f"{totals['bytes']} bytes")
+    print(f"📄 Report written to {batch.report_path}")
+
+
+if __name__ == "__main__":
+    main()
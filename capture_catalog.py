@@ -0,0 +1,163 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+from pathlib import Path
+from urllib.parse import urlparse
+
+
+class CaptureCatalog:
+    """Persistent SQLite index of captures.
+
+    Replaces scanning every capture folder's metadata.json. Rows are
+    written when a capture starts, completes, fails or is deleted, and can
+    be queried by domain, capture time range and status.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS captures (
+                folder_name TEXT PRIMARY KEY,
+                domain TEXT,
+                original_url TEXT,
+                capture_time TEXT,
+                status TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                owner TEXT
+            )
+        """)
+        # Catalogs created before captures recorded their owner
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(captures)")}
+        if 'owner' not in columns:
+            self._db.execute("ALTER TABLE captures ADD COLUMN owner TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS captures_domain ON captures (domain, capture_time)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS captures_time ON captures (capture_time)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS captures_status ON captures (status, capture_time)")
+        self._db.commit()
+
+    def domain_for_url(self, url):
+        """Domain used for indexing, matching the capture folder naming"""
+        return urlparse(url or '').netloc.replace('www.', '')
+
+    def upsert(self, metadata, status='completed'):
+        """Insert or update the catalog row for a capture
+
+        Captures in progress record the host and process running them, so
+        another process sharing the catalog can tell a live capture from
+        one interrupted by a crash.
+        """
+        owner = f"{socket.gethostname()}:{os.getpid()}" if status == 'in_progress' else None
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO captures "
+                "(folder_name, domain, original_url, capture_time, status, metadata, owner) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (metadata['folder_name'], self.domain_for_url(metadata.get('original_url')),
+                 metadata.get('original_url'), metadata.get('capture_time', ''), status, json.dumps(metadata), owner)
+            )
+            self._db.commit()
+
+    def set_status(self, folder_name, status):
+        """Update the status of an existing capture"""
+        with self._lock:
+            self._db.execute("UPDATE captures SET status = ? WHERE folder_name = ?", (status, folder_name))
+            self._db.commit()
+
+    def remove(self, folder_name):
+        """Drop a capture from the catalog"""
+        with self._lock:
+            self._db.execute("DELETE FROM captures WHERE folder_name = ?", (folder_name,))
+            self._db.commit()
+
+    def _where(self, domain=None, since=None, until=None, status=None):
+        """Build the WHERE clause shared by query and count"""
+        clauses, params = [], []
+        if domain:
+            clauses.append("domain = ?")
+            params.append(domain.replace('www.', ''))
+        if since:
+            clauses.append("capture_time >= ?")
+            params.append(since)
+        if until:
+            clauses.append("capture_time <= ?")
+            params.append(until)
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def query(self, domain=None, since=None, until=None, status=None, limit=None, offset=0):
+        """Capture metadata matching the filters, newest first"""
+        where, params = self._where(domain, since, until, status)
+        sql = f"SELECT metadata FROM captures {where} ORDER BY capture_time DESC"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count(self, domain=None, since=None, until=None, status=None):
+        """Number of captures matching the filters"""
+        where, params = self._where(domain, since, until, status)
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM captures {where}", params).fetchone()[0]
+
+    def sync_with_disk(self, base_dir):
+        """Import capture folders missing from the catalog and drop vanished ones
+
+        Meant to run at startup: captures still marked in_progress whose
+        process is gone were interrupted by a crash or restart and are
+        marked as errors. Captures owned by a live process on this host,
+        such as the batch CLI, and those of other hosts are left alone.
+        """
+        base_dir = Path(base_dir)
+        with self._lock:
+            rows = self._db.execute("SELECT folder_name, owner FROM captures WHERE status = 'in_progress'").fetchall()
+            orphaned = [(folder_name,) for folder_name, owner in rows if not self._owner_alive(owner)]
+            self._db.executemany("UPDATE captures SET status = 'error' WHERE folder_name = ?", orphaned)
+            self._db.commit()
+            known = {row[0] for row in self._db.execute("SELECT folder_name FROM captures")}
+
+        on_disk = set()
+        for folder in base_dir.iterdir():
+            if not folder.is_dir() or folder.name.startswith('.'):
+                continue
+            on_disk.add(folder.name)
+            if folder.name in known:
+                continue
+
+            metadata_path = folder / "metadata.json"
+            if metadata_path.exists():
+                try:
+                    with open(metadata_path, 'r') as f:
+                        metadata = json.load(f)
+                    metadata.setdefault('folder_name', folder.name)
+                    self.upsert(metadata)
+                except Exception as e:
+                    print(f"Warning: Failed to index capture {folder.name}: {e}")
+
+        for folder_name in known - on_disk:
+            self.remove(folder_name)
+
+    def _owner_alive(self, owner):
+        """Whether the process recorded as a capture's owner may still be running"""
+        host, _, pid = (owner or '').rpartition(':')
+        if not pid.isdigit():
+            return False
+        if host != socket.gethostname():
+            # No way to check another host's processes
+            return True
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # Alive, but running as another user
+            return True
+        return True
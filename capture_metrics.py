@@ -0,0 +1,94 @@
+import math
+import threading
+from collections import deque
+
+
+METRIC_PREFIX = "website_cloner"
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+# Stage timing field -> (metric name, help text)
+STAGE_METRICS = {
+    'seconds': ('capture_stage_seconds', "Wall-clock seconds spent in each capture stage"),
+    'cpu_seconds': ('capture_stage_cpu_seconds', "CPU seconds spent in each capture stage"),
+    'process_cpu_seconds': ('capture_process_cpu_seconds', "Process CPU seconds while a capture ran"),
+    'bytes': ('capture_stage_bytes', "Bytes transferred in each capture stage"),
+    'rss_delta_bytes': ('capture_stage_rss_delta_bytes', "Change in process resident memory over each capture stage")
+}
+
+
+def _quantile(values, q):
+    """Nearest-rank quantile of sorted values"""
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CaptureMetrics:
+    """Stage timings of recent captures, rendered in the Prometheus text format.
+
+    Quantiles cover the last window captures of each stage; _sum and _count
+    cover every capture since the process started.
+    """
+
+    def __init__(self, window=500):
+        self.window = window
+        self._recent = {}
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage_timings):
+        """Add the stage timings of one capture, as written to metadata.json"""
+        with self._lock:
+            for stage, figures in stage_timings.items():
+                for field in STAGE_METRICS:
+                    value = figures.get(field)
+                    if value is None:
+                        continue
+                    key = (field, stage)
+                    if key not in self._recent:
+                        self._recent[key] = deque(maxlen=self.window)
+                    self._recent[key].append(value)
+                    total, count = self._totals.get(key, (0, 0))
+                    self._totals[key] = (total + value, count + 1)
+
+    def render(self, gauges=None):
+        """Prometheus text exposition of the recorded stages
+
+        gauges maps extra metric names to (help text, value) pairs, where
+        value is a number or a dict of numbers by state.
+        """
+        with self._lock:
+            recent = {key: sorted(values) for key, values in self._recent.items()}
+            totals = dict(self._totals)
+
+        lines = []
+        for field, (name, help_text) in STAGE_METRICS.items():
+            stages = sorted(stage for metric_field, stage in recent if metric_field == field)
+            if not stages:
+                continue
+            metric = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} summary")
+            for stage in stages:
+                values = recent[(field, stage)]
+                for q in QUANTILES:
+                    lines.append(f'{metric}{{stage="{stage}",quantile="{q}"}} '
+                                 f'{_format_value(_quantile(values, q))}')
+                total, count = totals[(field, stage)]
+                lines.append(f'{metric}_sum{{stage="{stage}"}} {_format_value(round(total, 3))}')
+                lines.append(f'{metric}_count{{stage="{stage}"}} {count}')
+
+        for name, (help_text, values) in (gauges or {}).items():
+            metric = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            if not isinstance(values, dict):
+                lines.append(f"{metric} {_format_value(values)}")
+                continue
+            for state, value in sorted(values.items()):
+                lines.append(f'{metric}{{state="{state}"}} {_format_value(value)}')
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,129 @@
+import threading
+import time
+
+
+FINISHED_STATUSES = ('completed', 'error', 'cancelled')
+
+
+class ProgressSubscription:
+    """Progress updates waiting to be sent to one client
+
+    Updates are coalesced per job: a client that falls behind only gets the
+    latest progress of each job, never a backlog.
+    """
+
+    def __init__(self, broker, job_id=None):
+        self.broker = broker
+        self.job_id = job_id
+        self._updates = {}
+        self._condition = threading.Condition()
+
+    def push(self, job_id, progress):
+        with self._condition:
+            self._updates[job_id] = progress
+            self._condition.notify()
+
+    def wait(self, timeout=None):
+        """Return pending (job_id, progress) pairs, waiting up to timeout for some"""
+        with self._condition:
+            if not self._updates:
+                self._condition.wait(timeout)
+            updates = list(self._updates.items())
+            self._updates = {}
+        return updates
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class ProgressBroker:
+    """Latest progress of every capture job, pushed to subscribers.
+
+    Publishing only touches the subscribers of that job and those watching
+    all jobs. Progress of finished jobs is kept for max_age seconds so late
+    clients still see the outcome; evict() drops older entries and is meant
+    to run on a background timer.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._jobs = {}
+        self._job_subscribers = {}
+        self._all_subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, job_id, status, message, if_status=None, **fields):
+        """Record a job's progress and push it to its subscribers
+
+        With if_status, nothing is published unless the job's current
+        status is if_status. Returns the published progress or None.
+        """
+        progress = dict(fields, status=status, message=message, timestamp=time.time())
+        with self._lock:
+            if if_status is not None and self._jobs.get(job_id, {}).get('status') != if_status:
+                return None
+            self._jobs[job_id] = progress
+            # Pushed under the lock so subscribers get updates in publish order
+            for subscription in self._job_subscribers.get(job_id, ()):
+                subscription.push(job_id, progress)
+            for subscription in self._all_subscribers:
+                subscription.push(job_id, progress)
+        return progress
+
+    def get(self, job_id):
+        """Latest progress of a job, or None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def discard(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def jobs(self, status=None):
+        """Latest progress of every job by id, optionally only those with status"""
+        with self._lock:
+            return {job_id: progress for job_id, progress in self._jobs.items()
+                    if status is None or progress['status'] == status}
+
+    def subscribe(self, job_id=None):
+        """Subscribe to one job, or to all jobs when job_id is None
+
+        The current progress is queued right away, so a new client starts
+        from the latest state.
+        """
+        subscription = ProgressSubscription(self, job_id)
+        with self._lock:
+            if job_id is None:
+                self._all_subscribers.add(subscription)
+                current = list(self._jobs.items())
+            else:
+                self._job_subscribers.setdefault(job_id, set()).add(subscription)
+                current = [(job_id, self._jobs[job_id])] if job_id in self._jobs else []
+            for current_id, progress in current:
+                subscription.push(current_id, progress)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription.job_id is None:
+                self._all_subscribers.discard(subscription)
+                return
+            subscribers = self._job_subscribers.get(subscription.job_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._job_subscribers[subscription.job_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._all_subscribers) + sum(len(subscribers) for subscribers in self._job_subscribers.values())
+
+    def evict(self):
+        """Drop finished jobs older than max_age; returns how many were removed"""
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            expired = [job_id for job_id, progress in self._jobs.items()
+                       if progress['status'] in FINISHED_STATUSES and progress['timestamp'] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
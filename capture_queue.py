@@ -0,0 +1,82 @@
+import threading
+from collections import deque
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at max_depth"""
+
+
+class CaptureQueue:
+    """Bounded FIFO job queue served by a fixed pool of worker threads.
+
+    Jobs are run as run_job(job_id, payload, cancel_event). Queued jobs can
+    be cancelled outright; running jobs are asked to stop through their
+    cancel_event, which the job is expected to check cooperatively.
+    """
+
+    def __init__(self, run_job, workers=2, max_depth=20):
+        self.run_job = run_job
+        self.max_depth = max_depth
+
+        self._pending = deque()
+        self._running = {}
+        self._condition = threading.Condition()
+
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"capture-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, job_id, payload):
+        """Queue a job, raising QueueFullError when the queue is full"""
+        with self._condition:
+            if len(self._pending) >= self.max_depth:
+                raise QueueFullError(f"Capture queue is full ({self.max_depth} jobs waiting)")
+            self._pending.append((job_id, payload))
+            self._condition.notify()
+
+    def position(self, job_id):
+        """1-based position of a queued job, or None if it is not waiting"""
+        with self._condition:
+            for index, (pending_id, _) in enumerate(self._pending):
+                if pending_id == job_id:
+                    return index + 1
+        return None
+
+    def cancel(self, job_id):
+        """Cancel a job. Returns 'queued', 'running' or None if unknown"""
+        with self._condition:
+            for entry in self._pending:
+                if entry[0] == job_id:
+                    self._pending.remove(entry)
+                    return 'queued'
+
+            cancel_event = self._running.get(job_id)
+            if cancel_event is not None:
+                cancel_event.set()
+                return 'running'
+        return None
+
+    def stats(self):
+        """Current queue depth and number of running jobs"""
+        with self._condition:
+            return {'queued': len(self._pending), 'running': len(self._running)}
+
+    def _worker_loop(self):
+        """Take jobs off the queue and run them one at a time"""
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                job_id, payload = self._pending.popleft()
+                cancel_event = threading.Event()
+                self._running[job_id] = cancel_event
+
+            try:
+                self.run_job(job_id, payload, cancel_event)
+            except Exception as e:
+                print(f"Warning: Capture job {job_id} failed: {e}")
+            finally:
+                with self._condition:
+                    self._running.pop(job_id, None)
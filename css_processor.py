@@ -0,0 +1,154 @@
+import re
+from collections import namedtuple
+
+
+# A URL reference inside CSS. start/end delimit the URL text itself (inside
+# any quotes), so rewriting preserves the surrounding syntax. url has CSS
+# escapes resolved; quote is the quote character around it, or '' for an
+# unquoted url().
+CssReference = namedtuple('CssReference', ['start', 'end', 'url', 'is_import', 'quote'])
+
+# Tokens that can start something interesting; everything else is skipped by
+# the regex engine, which keeps scanning linear even for large minified CSS
+_INTERESTING = re.compile(r'/\*|["\']|@import\b|(?<![\w-])url\(', re.IGNORECASE)
+_WHITESPACE = ' \t\r\n\f'
+_ESCAPE = re.compile(r'\\(?:([0-9a-fA-F]{1,6})[ \t\r\n\f]?|(\r\n|[\n\r\f])|(.)|$)', re.DOTALL)
+
+
+def _skip_whitespace(css, i):
+    """Index of the first non-whitespace character at or after i"""
+    n = len(css)
+    while i < n and css[i] in _WHITESPACE:
+        i += 1
+    return i
+
+
+def _string_end(css, i):
+    """Index just past the string token starting at i (css[i] is the quote)"""
+    quote = css[i]
+    n = len(css)
+    j = i + 1
+    while j < n:
+        c = css[j]
+        if c == '\\':
+            j += 2
+            continue
+        if c == quote:
+            return j + 1
+        if c == '\n':
+            # Unterminated string - CSS ends it at the newline
+            return j
+        j += 1
+    return n
+
+
+def _unescape(text):
+    """Resolve CSS escapes: hex code points, escaped characters and line continuations"""
+    if '\\' not in text:
+        return text
+
+    def replace(match):
+        hex_digits, newline, char = match.groups()
+        if hex_digits:
+            code_point = int(hex_digits, 16)
+            if code_point == 0 or code_point > 0x10FFFF or 0xD800 <= code_point <= 0xDFFF:
+                return '\ufffd'
+            return chr(code_point)
+        if newline:
+            return ''
+        return char or ''
+
+    return _ESCAPE.sub(replace, text)
+
+
+def _escape(url, quote):
+    """Escape a URL for use inside a CSS string delimited by quote"""
+    return (url.replace('\\', '\\\\').replace(quote, '\\' + quote)
+            .replace('\n', '\\a ').replace('\r', '\\d ').replace('\f', '\\c '))
+
+
+def _string_reference(css, k, is_import):
+    """Reference for the string token starting at k. Returns (reference, end index)"""
+    end = _string_end(css, k)
+    value_end = end - 1 if end > k + 1 and css[end - 1] == css[k] else end
+    return CssReference(k + 1, value_end, _unescape(css[k + 1:value_end]), is_import, css[k]), end
+
+
+def _read_url_function(css, i, is_import):
+    """Parse url(...) whose argument starts at i. Returns (reference, end index)"""
+    n = len(css)
+    k = _skip_whitespace(css, i)
+    if k < n and css[k] in '"\'':
+        reference, end = _string_reference(css, k, is_import)
+        close = css.find(')', end)
+        return reference, (n if close < 0 else close + 1)
+
+    # An unquoted URL ends at the first unescaped ')'
+    close = k
+    while close < n and css[close] != ')':
+        close += 2 if css[close] == '\\' else 1
+    close = min(close, n)
+    value_end = close
+    while value_end > k and css[value_end - 1] in _WHITESPACE and css[value_end - 2] != '\\':
+        value_end -= 1
+    reference = CssReference(k, value_end, _unescape(css[k:value_end]), is_import, '')
+    return reference, min(close + 1, n)
+
+
+def find_css_urls(css):
+    """Find every url(...) and @import target in a stylesheet, in order"""
+    references = []
+    n = len(css)
+    i = 0
+
+    while i < n:
+        match = _INTERESTING.search(css, i)
+        if not match:
+            break
+
+        token = match.group(0).lower()
+        start = match.start()
+
+        if token == '/*':
+            close = css.find('*/', start + 2)
+            i = n if close < 0 else close + 2
+        elif token in ('"', "'"):
+            # Strings outside url()/@import (e.g. content: "url(") are skipped whole
+            i = _string_end(css, start)
+        elif token == '@import':
+            k = _skip_whitespace(css, match.end())
+            if k < n and css[k] in '"\'':
+                reference, i = _string_reference(css, k, True)
+                references.append(reference)
+            elif css[k:k + 4].lower() == 'url(':
+                reference, i = _read_url_function(css, k + 4, True)
+                references.append(reference)
+            else:
+                i = k
+        else:
+            reference, i = _read_url_function(css, match.end(), False)
+            references.append(reference)
+
+    return references
+
+
+def rewrite_css_urls(css, references, replace):
+    """Rewrite references in one pass. replace(reference) returns a new URL or None
+
+    New URLs are always written as quoted strings, since local file names
+    may contain spaces or parentheses that would end an unquoted url().
+    """
+    pieces = []
+    last = 0
+    for reference in references:
+        new_url = replace(reference)
+        if new_url is None:
+            continue
+        pieces.append(css[last:reference.start])
+        if reference.quote:
+            pieces.append(_escape(new_url, reference.quote))
+        else:
+            pieces.append('"' + _escape(new_url, '"') + '"')
+        last = reference.end
+    pieces.append(css[last:])
+    return ''.join(pieces)
@@ -0,0 +1,140 @@
+import lxml.html
+from bs4 import BeautifulSoup
+
+
+class SoupDocument:
+    """Parsed page backed by BeautifulSoup.
+
+    Asset discovery and rewriting only go through the methods below, so
+    either document class can be used for a capture.
+    """
+
+    def __init__(self, html_content):
+        self.soup = BeautifulSoup(html_content, 'lxml')
+
+    def find_all(self, tag, attribute=None):
+        """Elements with the given tag name ('*' for any), optionally having attribute"""
+        name = True if tag == '*' else tag
+        if attribute:
+            return self.soup.find_all(name, attrs={attribute: True})
+        return self.soup.find_all(name)
+
+    def children(self, element, tag):
+        """Descendants of element with the given tag name"""
+        return element.find_all(tag)
+
+    def get(self, element, name):
+        """Attribute value as a string, or None"""
+        value = element.get(name)
+        if isinstance(value, list):
+            # Multi-valued attributes such as rel come back as token lists
+            return ' '.join(value)
+        return value
+
+    def set(self, element, name, value):
+        element[name] = value
+
+    def text(self, element):
+        """Text content of an element with a single text child, or None"""
+        return element.string
+
+    def set_text(self, element, text):
+        element.string = text
+
+    def tag_name(self, element):
+        return element.name
+
+    def add_to_head(self, markup, at_start=False):
+        """Insert an HTML fragment into <head>. Returns False if there is no head"""
+        head = self.soup.find('head')
+        if not head:
+            return False
+        fragment = BeautifulSoup(markup, 'html.parser')
+        if at_start:
+            head.insert(0, fragment)
+        else:
+            head.append(fragment)
+        return True
+
+    def serialize(self):
+        return str(self.soup)
+
+
+class LxmlDocument:
+    """Parsed page backed directly by an lxml tree.
+
+    Skips the BeautifulSoup object model entirely; the tree, queries and
+    serialization all stay in lxml's C code, which matters for multi-MB
+    pages.
+    """
+
+    def __init__(self, html_content):
+        # Parse from bytes so pages with an XML encoding declaration are accepted
+        parser = lxml.html.HTMLParser(encoding='utf-8')
+        data = html_content.encode('utf-8', errors='surrogateescape') or b'<html></html>'
+        self.root = lxml.html.document_fromstring(data, parser=parser)
+        # lxml invents an HTML 4 doctype for pages without one; only keep a real one
+        self.has_doctype = '<!doctype' in html_content[:1024].lower()
+
+    def find_all(self, tag, attribute=None):
+        """Elements with the given tag name ('*' for any), optionally having attribute"""
+        if attribute:
+            return self.root.xpath(f'//{tag}[@{attribute}]')
+        return self.root.xpath(f'//{tag}')
+
+    def children(self, element, tag):
+        """Descendants of element with the given tag name"""
+        return element.xpath(f'.//{tag}')
+
+    def get(self, element, name):
+        """Attribute value as a string, or None"""
+        return element.get(name)
+
+    def set(self, element, name, value):
+        element.set(name, value)
+
+    def text(self, element):
+        """Text content of an element with a single text child, or None"""
+        if len(element):
+            return None
+        return element.text
+
+    def set_text(self, element, text):
+        element.text = text
+
+    def tag_name(self, element):
+        return element.tag
+
+    def add_to_head(self, markup, at_start=False):
+        """Insert an HTML fragment into <head>. Returns False if there is no head"""
+        head = self.root.find('head')
+        if head is None:
+            return False
+        fragments = [fragment for fragment in lxml.html.fragments_fromstring(markup.strip())
+                     if not isinstance(fragment, str)]
+        for offset, fragment in enumerate(fragments):
+            if at_start:
+                head.insert(offset, fragment)
+            else:
+                head.append(fragment)
+        return True
+
+    def serialize(self):
+        if self.has_doctype:
+            return lxml.html.tostring(self.root.getroottree(), encoding='unicode')
+        return lxml.html.tostring(self.root, encoding='unicode')
+
+
+HTML_ENGINES = {
+    'soup': SoupDocument,
+    'lxml': LxmlDocument,
+}
+
+
+def parse_html(html_content, engine='soup'):
+    """Parse a page with the named engine ('soup' or 'lxml')"""
+    try:
+        document_class = HTML_ENGINES[engine]
+    except KeyError:
+        raise ValueError(f"Unknown HTML engine: {engine}")
+    return document_class(html_content)
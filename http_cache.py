@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class HttpCache:
+    """On-disk HTTP cache for asset fetches with conditional revalidation.
+
+    Entries are keyed by URL and remember the validators (ETag /
+    Last-Modified) of the last successful response. Bodies live in the
+    shared AssetStore; the cache keeps its own hard link to each blob so a
+    cached body survives the captures that downloaded it. The cache is
+    bounded by total body size and evicts least recently used entries.
+    """
+
+    def __init__(self, root, asset_store, max_bytes=512 * 1024 * 1024):
+        self.root = Path(root)
+        self.bodies_dir = self.root / "bodies"
+        self.bodies_dir.mkdir(parents=True, exist_ok=True)
+        self.asset_store = asset_store
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.root / "index.sqlite3"), check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self._db.commit()
+
+    def lookup(self, url):
+        """Get the cached entry for a URL, or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT etag, last_modified, digest, size FROM entries WHERE url = ?", (url,)
+            ).fetchone()
+        if not row:
+            return None
+        return {'etag': row[0], 'last_modified': row[1], 'digest': row[2], 'size': row[3]}
+
+    def conditional_headers(self, entry):
+        """Build If-None-Match / If-Modified-Since headers for a cached entry"""
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def is_cacheable(self, response):
+        """Only responses carrying validators can be revalidated later"""
+        cache_control = response.headers.get('Cache-Control', '').lower()
+        if 'no-store' in cache_control:
+            return False
+        return bool(response.headers.get('ETag') or response.headers.get('Last-Modified'))
+
+    def touch(self, url):
+        """Mark an entry as recently used after a successful revalidation"""
+        with self._lock:
+            self._db.execute("UPDATE entries SET last_used = ? WHERE url = ?", (time.time(), url))
+            self._db.commit()
+
+    def update(self, url, response, digest, size):
+        """Remember the validators and body of a fresh 200 response"""
+        if not self.is_cacheable(response):
+            return
+
+        with self._lock:
+            body_link = self.bodies_dir / digest
+            if not body_link.exists():
+                try:
+                    os.link(self.asset_store.blob_path(digest), body_link)
+                except OSError as e:
+                    print(f"Warning: Failed to cache {url}: {e}")
+                    return
+
+            previous = self._db.execute("SELECT digest FROM entries WHERE url = ?", (url,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (url, etag, last_modified, digest, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                 digest, size, time.time())
+            )
+            self._db.commit()
+
+            if previous and previous[0] != digest:
+                self._drop_body(previous[0])
+            self._evict()
+
+    def invalidate(self, url):
+        """Forget a URL, e.g. when its cached body is no longer available"""
+        with self._lock:
+            row = self._db.execute("SELECT digest FROM entries WHERE url = ?", (url,)).fetchone()
+            self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+            self._db.commit()
+            if row:
+                self._drop_body(row[0])
+
+    def _evict(self):
+        """Evict least recently used entries until the cache fits in max_bytes"""
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for url, digest, size in self._db.execute(
+            "SELECT url, digest, size FROM entries ORDER BY last_used ASC"
+        ).fetchall():
+            self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+            self._drop_body(digest)
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self._db.commit()
+
+    def _drop_body(self, digest):
+        """Release the cache's link to a blob once no entry uses it"""
+        in_use = self._db.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone()
+        if in_use:
+            return
+
+        body_link = self.bodies_dir / digest
+        if body_link.exists():
+            body_link.unlink()
+        self.asset_store.release([digest])
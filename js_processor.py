@@ -0,0 +1,85 @@
+import mmap
+import re
+import time
+
+
+# Signature of the Next.js Image loader; files without it are never decoded
+LOADER_MARKER = b'e.path+"?url="+encodeURIComponent(n)+"&w="+r+"&q="'
+
+# The whole loader function: function n(t){let{config:e,src:n,width:r,quality:i}=t;return e.path+"?url="+...}
+LOADER_PATTERN = re.compile(
+    r'function n\(t\)\{let\{config:e,src:n,width:r,quality:i\}=t;'
+    r'return e\.path\+"\?url="\+encodeURIComponent\(n\)\+"\&w="\+r\+"\&q="\+\(i\|\|75\)\}'
+)
+
+# Just its return statement, for builds where the function is shaped differently
+LOADER_RETURN_PATTERN = re.compile(
+    r'return e\.path\+"\?url="\+encodeURIComponent\(n\)\+"\&w="\+r\+"\&q="\+\(i\|\|75\)'
+)
+
+
+def contains_loader(path):
+    """Cheap check for the loader signature using a byte search over an mmap"""
+    with open(path, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return data.find(LOADER_MARKER) != -1
+        except ValueError:
+            # Empty files cannot be mapped
+            return False
+
+
+def patch_nextjs_loader(path, temp_path, url_mapping_js):
+    """Replace the Next.js Image loader in one JS file with a local lookup
+
+    Runs in a worker process. The patched script is written to temp_path;
+    returns 'function' or 'return' for the pattern that matched, or None
+    if the file was left alone.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        js_content = f.read()
+
+    replacement_function = f'''function n(t){{
+                                const imageMapping = {url_mapping_js};
+                                const originalSrc = t.src;
+
+                                // Return local path if we have a mapping
+                                if (imageMapping[originalSrc]) {{
+                                    console.log('🎯 Using local asset:', originalSrc, '->', imageMapping[originalSrc]);
+                                    return imageMapping[originalSrc];
+                                }}
+
+                                // For any other URLs, return as-is (don't create /_next/image URLs)
+                                return originalSrc;
+                            }}'''
+
+    # Replacements are passed as functions so backslashes in the mapping JSON are kept literally
+    modified_content, count = LOADER_PATTERN.subn(lambda match: replacement_function, js_content)
+    matched = 'function'
+    if not count:
+        replacement_return = f'''const imageMapping = {url_mapping_js};
+                                    const originalSrc = n;
+                                    if (imageMapping[originalSrc]) {{
+                                        console.log('🎯 Using local asset:', originalSrc, '->', imageMapping[originalSrc]);
+                                        return imageMapping[originalSrc];
+                                    }}
+                                    return originalSrc'''
+        modified_content, count = LOADER_RETURN_PATTERN.subn(lambda match: replacement_return, js_content)
+        matched = 'return'
+    if not count:
+        return None
+
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(modified_content)
+    return matched
+
+
+def patch_nextjs_loader_timed(path, temp_path, url_mapping_js):
+    """patch_nextjs_loader, also returning the CPU seconds the worker spent on it
+
+    Pool workers are long-lived, so their CPU time never shows up in the
+    parent's rusage; it is measured here and sent back with the result.
+    """
+    start_cpu = time.process_time()
+    matched = patch_nextjs_loader(path, temp_path, url_mapping_js)
+    return matched, time.process_time() - start_cpu
@@ -1,27 +1,593 @@
 import os
 import re
+import posixpath
 import requests
 import json
 import time
 from datetime import datetime
-from urllib.parse import urljoin, urlparse, quote, unquote, parse_qs
+from urllib.parse import urljoin, urlparse, urldefrag, quote
 from pathlib import Path
-from playwright.sync_api import sync_playwright
-from bs4 import BeautifulSoup
 import shutil
-import zipfile
 import html
+import hashlib
+import difflib
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from PIL import Image
+from asset_store import AssetStore
+from http_cache import HttpCache
+from browser_pool import BrowserPool
+from capture_catalog import CaptureCatalog
+from css_processor import find_css_urls, rewrite_css_urls
+from url_index import UrlIndex, canonicalize_url, unwrap_nextjs_image_url
+from asset_records import AssetRecord, ElementTable
+from html_document import parse_html
+from js_processor import contains_loader, patch_nextjs_loader_timed
+from zip_export import ZipCache, iter_zip, capture_content_hash
+from capture_metrics import CaptureMetrics
+from screenshots import (PAGE_SIZE_SCRIPT, SCREENSHOT_FORMATS, THUMBNAIL_NAME, screenshot_clips, save_screenshot,
+                         save_thumbnail)
+
+
+# Records the time of the last DOM mutation for readiness detection
+MUTATION_OBSERVER_SCRIPT = """
+    (() => {
+        window.__clonerLastMutation = performance.now();
+        new MutationObserver(() => {
+            window.__clonerLastMutation = performance.now();
+        }).observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    })();
+"""
+
+# Time since the last DOM mutation and number of visible images still loading
+SETTLE_STATE_SCRIPT = """
+    () => {
+        const pendingImages = Array.from(document.images).filter(img => {
+            if (img.complete || !(img.currentSrc || img.src)) return false;
+            // Off-screen lazy images will not load until scrolled into view
+            if (img.loading === 'lazy') {
+                const rect = img.getBoundingClientRect();
+                return rect.bottom > 0 && rect.top < window.innerHeight;
+            }
+            return true;
+        }).length;
+        return {
+            sinceMutation: performance.now() - (window.__clonerLastMutation || 0),
+            pendingImages: pendingImages
+        };
+    }
+"""
+
+# Scroll through the page to trigger lazy loading, then return to the top
+LAZY_SCROLL_SCRIPT = """
+    () => {
+        return new Promise((resolve) => {
+            let totalHeight = 0;
+            // Step by most of a viewport so every element still passes through view
+            let distance = Math.max(150, Math.floor(window.innerHeight * 0.75));
+            let timer = setInterval(() => {
+                let scrollHeight = document.body.scrollHeight;
+                window.scrollBy(0, distance);
+                totalHeight += distance;
+                if(totalHeight >= scrollHeight || totalHeight > 15000) {
+                    clearInterval(timer);
+                    window.scrollTo(0, 0);
+                    resolve();
+                }
+            }, 200);
+        });
+    }
+"""
+
+# Scroll to bottom (and later back to top) to trigger section-based content
+SCROLL_TO_BOTTOM_SCRIPT = """
+    () => {
+        window.scrollTo(0, document.body.scrollHeight);
+    }
+"""
+
+# Waits for dynamic content after the page loads, shared by both capture
+# engines: (progress message, script to run first, longest wait in ms)
+SETTLE_STEPS = [
+    ("⏳ Waiting for dynamic content...", None, 3000),
+    ("📜 Triggering lazy loading and dynamic content...", LAZY_SCROLL_SCRIPT, 2000),
+    ("⏳ Waiting for dynamic content to render...", None, 4000),
+    ("🎯 Triggering section-based content...", SCROLL_TO_BOTTOM_SCRIPT, 2000),
+    (None, "window.scrollTo(0, 0)", 2000),
+]
+
+
+class AssetTooLargeError(Exception):
+    """Raised when an asset exceeds the per-asset size cap or the capture byte budget"""
+
+
+class CaptureCancelled(Exception):
+    """Raised inside a capture once its cancel_event has been set"""
+
+
+class DownloadBudget:
+    """Byte budget shared by all concurrent downloads of one capture"""
+    
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+    
+    def reserve(self, size):
+        """Reserve up to size bytes and return how many were granted"""
+        with self._lock:
+            if self.limit is None:
+                granted = size
+            else:
+                granted = max(0, min(size, self.limit - self.used))
+            self.used += granted
+            return granted
+    
+    def release(self, size):
+        """Return bytes reserved by a download that was discarded"""
+        with self._lock:
+            self.used -= size
+
+
+class StageTimings:
+    """Wall-clock, CPU and memory figures for each capture stage
+    
+    Stages can overlap, so each records when it started relative to the
+    capture as well as how long it ran. cpu_seconds is the CPU time of the
+    thread that ran the stage, plus any work reported for it from other
+    threads or worker processes with add_cpu. rss_delta_bytes is how much
+    the process's resident memory grew (or shrank) over the stage; it is
+    process wide, so overlapping stages and captures show up in each
+    other's figures. Stages that move data also record bytes.
+    """
+    
+    def __init__(self):
+        self.started = time.monotonic()
+        self.started_cpu = time.process_time()
+        self.started_rss = current_rss_bytes()
+        self.stages = {}
+        self._extra_cpu = {}
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def stage(self, name, track_cpu=True):
+        """Time the enclosed block as the named stage
+        
+        Yields the stage's record; set 'bytes' on it for stages that
+        transfer data. Use track_cpu=False when the block only waits on
+        work running elsewhere, such as coroutines sharing an event loop.
+        """
+        record = {}
+        start = time.monotonic()
+        start_cpu = time.thread_time()
+        start_rss = current_rss_bytes()
+        try:
+            yield record
+        finally:
+            end = time.monotonic()
+            if track_cpu:
+                record['cpu_seconds'] = time.thread_time() - start_cpu
+            self._finish(name, start, end, record, start_rss)
+    
+    def record(self, name, start, **fields):
+        """Record a stage that began at start (a time.monotonic() value) and ends now
+        
+        No memory figure is recorded, since the stage's starting RSS is unknown.
+        """
+        self._finish(name, start, time.monotonic(), fields)
+    
+    def add_cpu(self, name, seconds):
+        """Count CPU time spent for a stage on another thread"""
+        with self._lock:
+            self._extra_cpu[name] = self._extra_cpu.get(name, 0.0) + seconds
+    
+    def cpu_timed(self, name, fn):
+        """Wrap fn so the CPU time of each call is added to the named stage"""
+        def run(*args):
+            start_cpu = time.thread_time()
+            try:
+                return fn(*args)
+            finally:
+                self.add_cpu(name, time.thread_time() - start_cpu)
+        return run
+    
+    def _finish(self, name, start, end, fields, start_rss=None):
+        stage = {'start': round(start - self.started, 3), 'seconds': round(end - start, 3)}
+        stage.update(fields)
+        rss = current_rss_bytes()
+        if rss is not None and start_rss is not None:
+            stage['rss_delta_bytes'] = rss - start_rss
+        with self._lock:
+            self.stages[name] = stage
+    
+    def to_dict(self):
+        with self._lock:
+            timings = {}
+            for name, stage in self.stages.items():
+                stage = dict(stage)
+                cpu = stage.get('cpu_seconds', 0.0) + self._extra_cpu.get(name, 0.0)
+                if 'cpu_seconds' in stage or name in self._extra_cpu:
+                    stage['cpu_seconds'] = round(cpu, 3)
+                timings[name] = stage
+        
+        # Process CPU includes every thread, and other captures running at the same time
+        timings['total'] = {
+            'start': 0.0,
+            'seconds': round(time.monotonic() - self.started, 3),
+            'process_cpu_seconds': round(time.process_time() - self.started_cpu, 3)
+        }
+        rss = current_rss_bytes()
+        if rss is not None and self.started_rss is not None:
+            timings['total']['rss_delta_bytes'] = rss - self.started_rss
+        return timings
+
+
+def current_rss_bytes():
+    """Current resident memory of this process in bytes, or None where unavailable
+    
+    Read from /proc/self/statm, so memory figures are left out of the
+    timings on systems without procfs.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+# Progress percent reached when each capture stage starts. Downloads fill
+# the range from 'download' to 'stylesheets' as assets complete; stages not
+# listed (the screenshot, which overlaps later stages) keep the percent.
+PROGRESS_STAGES = {
+    'start': 2,
+    'baseline': 4,
+    'browser': 5,
+    'load': 10,
+    'settle': 15,
+    'extract': 30,
+    'discover': 35,
+    'download': 40,
+    'stylesheets': 85,
+    'rewrite': 90,
+    'patch_js': 93,
+    'completed': 100
+}
+
+
+class CaptureProgress:
+    """Structured progress of one capture for progress callbacks
+    
+    Each update calls callback(message, details), where details holds the
+    stage, a percent estimate that only moves forward, asset counts and
+    bytes downloaded. Download stages running side by side are summed.
+    """
+    
+    def __init__(self, callback=None, cancel_event=None):
+        self.callback = callback
+        self.cancel_event = cancel_event
+        self.stage = 'start'
+        self.percent = 0
+        self._downloads = {}
+        self._lock = threading.Lock()
+    
+    def update(self, message, stage=None, download_stats=None, total_assets=0, download_id=None):
+        """Report progress, raising CaptureCancelled once cancel_event is set"""
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise CaptureCancelled("Capture cancelled")
+        self.report(message, stage, download_stats, total_assets, download_id)
+    
+    def report(self, message, stage=None, download_stats=None, total_assets=0, download_id=None):
+        """Report progress without checking for cancellation
+        
+        download_stats is a snapshot of the counts of the download stage
+        identified by download_id. The latest snapshot of each stage is
+        kept; one that arrives late never moves the counts back.
+        """
+        with self._lock:
+            if download_stats is not None:
+                previous = self._downloads.get(download_id)
+                if previous is None or previous[0]['completed'] <= download_stats['completed']:
+                    self._downloads[download_id] = (download_stats, total_assets)
+                stage = stage or 'download'
+            if stage is not None:
+                self.stage = stage
+            
+            assets = {'total': 0, 'completed': 0, 'in_flight': 0, 'failed': 0}
+            downloaded_bytes = 0
+            for stats, total in list(self._downloads.values()):
+                assets['total'] += total
+                for key in ('completed', 'in_flight', 'failed'):
+                    assets[key] += stats[key]
+                downloaded_bytes += stats['bytes']
+            
+            percent = PROGRESS_STAGES.get(stage, self.percent)
+            if stage == 'download' and assets['total']:
+                span = PROGRESS_STAGES['stylesheets'] - PROGRESS_STAGES['download']
+                percent += span * assets['completed'] // assets['total']
+            self.percent = max(self.percent, percent)
+            
+            details = {
+                'stage': self.stage,
+                'percent': self.percent,
+                'assets': assets,
+                'bytes': downloaded_bytes
+            }
+        
+        if self.callback:
+            self.callback(message, details)
+
+
+class DownloadStats:
+    """Counters of one download stage, updated by its concurrent download jobs"""
+    
+    KEYS = ('completed', 'failed', 'skipped', 'truncated', 'bytes', 'from_browser', 'prefetched', 'reused')
+    
+    def __init__(self, total):
+        self.total = total
+        self._counts = dict.fromkeys(('in_flight',) + self.KEYS, 0)
+        self._lock = threading.Lock()
+    
+    def start(self):
+        """Count a job that has begun fetching"""
+        with self._lock:
+            self._counts['in_flight'] += 1
+    
+    def finish(self, status, size=0, truncated=False, source=None):
+        """Count a finished job and return a snapshot of the counters
+        
+        status is 'downloaded', 'failed' or 'skipped' (which also counts as
+        failed); source is the counter of where a stored body came from.
+        """
+        with self._lock:
+            counts = self._counts
+            counts['in_flight'] -= 1
+            counts['completed'] += 1
+            if status != 'downloaded':
+                counts['failed'] += 1
+            if status == 'skipped':
+                counts['skipped'] += 1
+            if truncated:
+                counts['truncated'] += 1
+            if source:
+                counts[source] += 1
+            counts['bytes'] += size
+            return dict(counts)
+    
+    def snapshot(self):
+        """Copy of the counters, including downloads in flight"""
+        with self._lock:
+            return dict(self._counts)
+    
+    def summary(self):
+        """Final counters of the stage"""
+        with self._lock:
+            return {key: self._counts[key] for key in self.KEYS}
+
+
+class DownloadState:
+    """Download state shared by every download stage of one capture
+    
+    All downloads run on one worker pool, so stages can overlap without
+    exceeding the global concurrency limit. Filenames are reserved under a
+    lock and every URL gets a completion event, letting one stage wait for
+    a download another stage started. Assets the browser requests while
+    the page is still loading can be prefetched before discovery runs.
+    
+    In an incremental capture, baseline holds the reusable asset records of
+    the previous capture by canonical URL; those are never prefetched. URLs
+    linked from the baseline without being revalidated are collected in
+    assumed_unchanged. Once cancel_event is set, downloads that have not started fetching are
+    abandoned.
+    """
+    
+    def __init__(self, executor, budget, asset_store, fetch, cancel_event=None):
+        self.executor = executor
+        self.budget = budget
+        self.asset_store = asset_store
+        self.cancel_event = cancel_event
+        self.browser_assets = {}
+        self.baseline = {}
+        self.assumed_unchanged = set()
+        self._fetch = fetch
+        self._used_names = {}
+        self._finished = {}
+        self._prefetched = {}
+        self._prefetch_requested = set()
+        self._closed = False
+        self._lock = threading.Lock()
+    
+    def reserve_name(self, asset_type, assign):
+        """Reserve a filename; assign(used_names) picks one not yet used for the type"""
+        with self._lock:
+            return assign(self._used_names.setdefault(asset_type, set()))
+    
+    def cancelled(self):
+        """Whether the capture has been cancelled"""
+        return self.cancel_event is not None and self.cancel_event.is_set()
+    
+    def started(self, canonical_url):
+        """Register a download and return the event set when it finishes"""
+        with self._lock:
+            return self._finished.setdefault(canonical_url, threading.Event())
+    
+    def wait_for(self, canonical_url):
+        """Block until a registered download of the URL has finished"""
+        with self._lock:
+            event = self._finished.get(canonical_url)
+        if event is not None:
+            event.wait()
+    
+    def prefetch(self, canonical_url, url):
+        """Start fetching an asset into a temp link in the blob store"""
+        with self._lock:
+            if not self._claim_prefetch(canonical_url):
+                return
+            temp_path = self.asset_store.new_temp_path()
+            future = self.executor.submit(self._fetch, url, temp_path, self.budget)
+            self._prefetched[canonical_url] = (future, temp_path)
+    
+    def take_prefetch(self, canonical_url):
+        """Claim a started prefetch as (future, temp_path), or None
+        
+        A prefetch still waiting for a worker is cancelled instead, so a
+        download never blocks on a job queued behind it.
+        """
+        with self._lock:
+            prefetched = self._prefetched.pop(canonical_url, None)
+        if prefetched is not None and prefetched[0].cancel():
+            return None
+        return prefetched
+    
+    def _claim_prefetch(self, canonical_url):
+        """Whether a URL should be prefetched, marking it as requested if so"""
+        # Once a download has started the prefetch would only duplicate it
+        if (self._closed or canonical_url in self._prefetch_requested or canonical_url in self._finished or
+                canonical_url in self.baseline):
+            return False
+        self._prefetch_requested.add(canonical_url)
+        return True
+    
+    def close(self):
+        """Stop the worker pool and drop recorded bodies and prefetches nobody used"""
+        with self._lock:
+            self._closed = True
+            unused = list(self._prefetched.values())
+            self._prefetched.clear()
+        for future, _ in unused:
+            future.cancel()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        
+        results = [future.result() for future, _ in unused if not future.cancelled() and future.exception() is None]
+        self._discard(results, [temp_path for _, temp_path in unused])
+    
+    def _discard(self, prefetch_results, temp_paths):
+        """Free what unused prefetches and recorded bodies hold
+        
+        prefetch_results are the (digest, size, truncated) results of the
+        prefetches that finished; temp_paths their temp links.
+        """
+        digests = []
+        for digest, size, _ in prefetch_results:
+            digests.append(digest)
+            # Give back the budget an unused body (such as a 206 media prefetch) held
+            self.budget.release(size)
+        temp_paths = list(temp_paths) + [recorded['temp_path'] for recorded in self.browser_assets.values()]
+        for temp_path in temp_paths:
+            if temp_path.exists():
+                temp_path.unlink()
+        self.asset_store.release(digests)
 
 
 class WebsiteCloner:
-    def __init__(self, base_dir="captured_sites"):
+    def __init__(self, base_dir="captured_sites", max_download_workers=8, max_downloads_per_host=4,
+                 http_cache_max_bytes=512 * 1024 * 1024, max_asset_bytes=100 * 1024 * 1024,
+                 capture_byte_budget=1024 * 1024 * 1024, oversize_policy='skip',
+                 max_browser_contexts=2, browser_max_uses=50, browser_timeout=300, adaptive_settle=True, settle_quiet_ms=500,
+                 record_browser_assets=True, html_engine='soup', patch_js_loaders=False, js_workers=None,
+                 zip_cache_max_bytes=0, screenshot_format='png', screenshot_quality=80, screenshot_max_height=None,
+                 screenshot_tile_height=8000, thumbnail_width=480):
         self.base_dir = Path(base_dir)
         self.base_dir.mkdir(exist_ok=True)
+        
+        # Content-addressed blob store shared by all captures
+        self.asset_store = AssetStore(self.base_dir / ".blobs")
+        
+        # Indexed catalog of captures, kept in step with the folders on disk
+        self.catalog = CaptureCatalog(self.base_dir / ".catalog.sqlite3")
+        self.catalog.sync_with_disk(self.base_dir)
+        
+        # Persistent HTTP cache so recaptures only revalidate unchanged assets
+        self.http_cache = HttpCache(self.base_dir / ".http-cache", self.asset_store, http_cache_max_bytes)
+        
+        # Finished ZIP exports keyed by capture content, if zip_cache_max_bytes is set
+        self.zip_cache = ZipCache(self.base_dir / ".zip-cache", zip_cache_max_bytes) if zip_cache_max_bytes else None
+        
+        # Screenshot output: 'png', 'jpeg' or 'webp' at screenshot_quality,
+        # cut off at screenshot_max_height. Tall pages are captured in tiles
+        # of screenshot_tile_height pixels and stitched, and every capture
+        # gets a thumbnail_width wide JPEG thumbnail for the dashboard.
+        if screenshot_format not in SCREENSHOT_FORMATS:
+            raise ValueError(f"Unsupported screenshot format: {screenshot_format}")
+        self.screenshot_format = screenshot_format
+        self.screenshot_quality = screenshot_quality
+        self.screenshot_max_height = screenshot_max_height
+        self.screenshot_tile_height = screenshot_tile_height
+        self.thumbnail_width = thumbnail_width
+        
+        # Stage figures of recent captures for /api/metrics
+        self.metrics = CaptureMetrics()
+        
+        # Analysis packages are created on first use rather than per capture
+        self._analysis_lock = threading.Lock()
+        
+        # Long-lived browsers shared by all captures. A capture gives up on
+        # its browser stage after browser_timeout seconds, queueing included.
+        self.browser_pool = BrowserPool(max_contexts=max_browser_contexts, max_uses=browser_max_uses)
+        self.browser_timeout = browser_timeout
+        
+        # Page readiness: proceed once network, DOM and images have been quiet
+        # for settle_quiet_ms. The old fixed waits remain as upper bounds.
+        self.adaptive_settle = adaptive_settle
+        self.settle_quiet_ms = settle_quiet_ms
+        
+        # Reuse response bodies the browser already received instead of
+        # fetching every asset a second time with requests
+        self.record_browser_assets = record_browser_assets
+        
+        # HTML engine for discovery and rewriting: 'soup' (BeautifulSoup) or
+        # 'lxml', which works on the lxml tree directly and is much faster on
+        # large pages
+        self.html_engine = html_engine
+        
+        # Rewrite the Next.js Image loader inside downloaded JS chunks so it
+        # returns local paths. Chunks are patched across js_workers processes
+        # (default: one per CPU) in a pool shared by all captures. Workers are
+        # started with forkserver (spawn where unavailable) rather than forked
+        # from this multithreaded process, and only on first use.
+        self.patch_js_loaders = patch_js_loaders
+        self.js_workers = js_workers
+        self._js_executor = None
+        if patch_js_loaders:
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._js_executor = ProcessPoolExecutor(max_workers=js_workers or os.cpu_count() or 1,
+                                                    mp_context=multiprocessing.get_context(start_method))
+        
+        # Download concurrency limits (global and per host)
+        self.max_download_workers = max_download_workers
+        self.max_downloads_per_host = max_downloads_per_host
+        self._host_semaphores = {}
+        self._host_lock = threading.Lock()
+        
+        # Size limits for downloads. oversize_policy is 'skip' (leave the
+        # asset remote) or 'truncate' (keep the first max_asset_bytes bytes).
+        self.max_asset_bytes = max_asset_bytes
+        self.capture_byte_budget = capture_byte_budget
+        self.oversize_policy = oversize_policy
+        
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         })
         
+        # Size the connection pool so concurrent downloads can reuse connections
+        adapter = HTTPAdapter(pool_connections=max_download_workers, pool_maxsize=max_download_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
+    def close(self):
+        """Shut down pooled browsers and the JS patching processes"""
+        self.browser_pool.close()
+        self._close_js_executor()
+        
+    def _close_js_executor(self):
+        if self._js_executor is not None:
+            self._js_executor.shutdown(wait=True, cancel_futures=True)
+            self._js_executor = None
+        
     def sanitize_filename(self, filename):
         """Convert filename to safe filesystem name"""
         filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
@@ -30,20 +596,7 @@ class WebsiteCloner:
         
     def parse_nextjs_image_url(self, url):
         """Parse Next.js image optimization URLs to extract actual image path"""
-        try:
-            # Check if this is a Next.js image optimization URL
-            if '/_next/image?' in url:
-                parsed = urlparse(url)
-                query_params = parse_qs(parsed.query)
-                
-                # Extract the actual image URL from the 'url' parameter
-                if 'url' in query_params:
-                    actual_url = unquote(query_params['url'][0])
-                    return actual_url
-            
-            return url
-        except Exception:
-            return url
+        return unwrap_nextjs_image_url(url)
     
     def normalize_url_for_matching(self, url):
         """Normalize URL for matching by handling HTML entities"""
@@ -51,25 +604,30 @@ class WebsiteCloner:
         decoded_url = html.unescape(url)
         return decoded_url
     
-    def create_url_mapping(self, assets):
-        """Create mapping from original URLs (both encoded/decoded) to local paths"""
-        url_mapping = {}
-        
+    def canonicalize_asset_url(self, url, base_url):
+        """Resolve an asset reference to the canonical URL used to dedupe and match assets"""
+        return canonicalize_url(url, base_url)
+    
+    def _build_asset_index(self, assets):
+        """Group asset references by canonical URL, preserving discovery order"""
+        asset_index = {}
         for asset_type, asset_list in assets.items():
             for asset in asset_list:
-                if asset.get('local_path'):
-                    original_url = asset['original_url']
-                    local_path = asset['local_path']
-                    
-                    # Map both original and normalized versions
-                    url_mapping[original_url] = local_path
-                    url_mapping[self.normalize_url_for_matching(original_url)] = local_path
-                    
-                    # Also map HTML-encoded version
-                    encoded_url = html.escape(original_url)
-                    url_mapping[encoded_url] = local_path
-        
-        return url_mapping
+                asset.canonical_url = self.canonicalize_asset_url(asset.url, asset.url)
+                asset_index.setdefault(asset.canonical_url, []).append((asset_type, asset))
+        return asset_index
+    
+    def _build_url_index(self, assets, base_url):
+        """Build the capture's canonical URL index from downloaded assets"""
+        url_index = UrlIndex(base_url)
+        for asset_type, asset_list in assets.items():
+            for asset in asset_list:
+                if asset.local_path:
+                    # References found in stylesheets are relative to the sheet, not the page
+                    alias = None if asset.stylesheet else asset.original_url
+                    url_index.add(asset.url, asset.local_path,
+                                  client_visible=(asset_type == 'images'), alias=alias)
+        return url_index
         
     def create_capture_folder(self, url):
         """Create timestamped folder for capture"""
@@ -78,8 +636,16 @@ class WebsiteCloner:
         timestamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
         folder_name = f"{self.sanitize_filename(domain)}_{timestamp}"
         
+        # Concurrent captures of one site can start within the same second
         capture_dir = self.base_dir / folder_name
-        capture_dir.mkdir(exist_ok=True)
+        counter = 1
+        while True:
+            try:
+                capture_dir.mkdir()
+                break
+            except FileExistsError:
+                capture_dir = self.base_dir / f"{folder_name}_{counter}"
+                counter += 1
         
         # Create subdirectories
         (capture_dir / "assets" / "css").mkdir(parents=True, exist_ok=True)
@@ -92,88 +658,132 @@ class WebsiteCloner:
         
         return capture_dir
     
-    def _create_analysis_package(self, capture_dir, assets, metadata):
-        """Create analysis package optimized for LLM analysis"""
+    def ensure_analysis_package(self, folder_name):
+        """Create a capture's analysis package on first use and return its directory"""
+        capture_dir = self.base_dir / folder_name
+        if folder_name.startswith('.') or not capture_dir.is_dir():
+            raise FileNotFoundError(f"Capture {folder_name} not found")
+        
+        analysis_dir = capture_dir / "analysis-package"
+        with self._analysis_lock:
+            if not analysis_dir.exists():
+                self._create_analysis_package(capture_dir)
+        return analysis_dir
+    
+    def find_screenshot(self, capture_dir):
+        """Path of a capture's screenshot in whichever format it was saved, or None"""
+        for _, extension, _, _ in SCREENSHOT_FORMATS.values():
+            screenshot_path = capture_dir / f"screenshot{extension}"
+            if screenshot_path.exists():
+                return screenshot_path
+        return None
+    
+    def ensure_thumbnail(self, folder_name):
+        """Return a capture's thumbnail, generating it for captures saved without one"""
+        capture_dir = self.base_dir / folder_name
+        if folder_name.startswith('.') or not capture_dir.is_dir():
+            raise FileNotFoundError(f"Capture {folder_name} not found")
+        
+        thumbnail_path = capture_dir / THUMBNAIL_NAME
+        if thumbnail_path.exists():
+            return thumbnail_path
+        screenshot_path = self.find_screenshot(capture_dir)
+        if screenshot_path is None:
+            raise FileNotFoundError(f"Capture {folder_name} has no screenshot")
+        
+        # Written under a temporary name so a request never sees a partial file
+        temp_path = capture_dir / f".thumbnail-{os.getpid()}-{threading.get_ident()}.jpg"
+        with Image.open(screenshot_path) as image:
+            save_thumbnail(image, temp_path, self.thumbnail_width)
+        os.replace(temp_path, thumbnail_path)
+        return thumbnail_path
+    
+    def _write_json_atomic(self, path, data):
+        """Replace a JSON file without readers ever seeing it half written"""
+        temp_path = path.with_name(f".{path.name}.{os.getpid()}-{threading.get_ident()}")
+        with open(temp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, path)
+    
+    def _create_analysis_package(self, capture_dir):
+        """Create analysis package optimized for LLM analysis
+        
+        The package references the capture's own files by path instead of
+        copying them, so it only adds the brief and the inventory.
+        """
         try:
-            # Create analysis package directory
-            analysis_dir = capture_dir / "analysis-package"
-            analysis_dir.mkdir(exist_ok=True)
+            metadata = {}
+            metadata_path = capture_dir / "metadata.json"
+            if metadata_path.exists():
+                with open(metadata_path, 'r') as f:
+                    metadata = json.load(f)
             
-            # Create subdirectories
-            (analysis_dir / "key-assets").mkdir(exist_ok=True)
-            (analysis_dir / "key-assets" / "logos").mkdir(exist_ok=True)
-            (analysis_dir / "key-assets" / "hero-images").mkdir(exist_ok=True)
-            (analysis_dir / "key-assets" / "feature-screenshots").mkdir(exist_ok=True)
+            # Built after the capture, so its timing is added to the metadata later
+            timings = StageTimings()
+            with timings.stage('analysis_package'):
+                # Build next to the capture and rename, so a package is never seen half written
+                temp_dir = capture_dir / f".analysis-package-{os.getpid()}-{threading.get_ident()}"
+                temp_dir.mkdir(exist_ok=True)
+                self._generate_analysis_documentation(capture_dir, temp_dir, metadata)
+                os.replace(temp_dir, capture_dir / "analysis-package")
             
-            # Copy essential files
-            self._copy_essential_files(capture_dir, analysis_dir)
+            stage = timings.to_dict()['analysis_package']
+            self.metrics.record({'analysis_package': stage})
+            if metadata:
+                metadata.setdefault('stage_timings', {})['analysis_package'] = stage
+                self._write_json_atomic(metadata_path, metadata)
             
-            # Extract and organize key visual assets
-            self._extract_key_assets(capture_dir, analysis_dir, assets)
-            
-            # Generate analysis documentation
-            self._generate_analysis_documentation(capture_dir, analysis_dir, assets, metadata)
-            
-            print(f"✅ Analysis package created at: {analysis_dir}")
+            print(f"✅ Analysis package created at: {capture_dir / 'analysis-package'}")
             
         except Exception as e:
             print(f"Warning: Failed to create analysis package: {e}")
     
-    def _copy_essential_files(self, capture_dir, analysis_dir):
-        """Copy essential files for analysis"""
-        essential_files = [
-            "index.html",
-            "screenshot.png", 
-            "metadata.json"
-        ]
-        
-        for filename in essential_files:
-            source_path = capture_dir / filename
-            if source_path.exists():
-                shutil.copy2(source_path, analysis_dir / filename)
-        
-        # Find and copy main CSS file
+    def _find_main_stylesheet(self, capture_dir):
+        """Path of the largest CSS file (likely the main stylesheet), relative to the capture"""
         css_dir = capture_dir / "assets" / "css"
-        if css_dir.exists():
-            css_files = list(css_dir.glob("*.css"))
-            if css_files:
-                # Copy the largest CSS file (likely the main stylesheet)
-                main_css = max(css_files, key=lambda f: f.stat().st_size)
-                shutil.copy2(main_css, analysis_dir / "main-styles.css")
-    
-    def _extract_key_assets(self, capture_dir, analysis_dir, assets):
-        """Extract and organize key visual assets"""
+        css_files = list(css_dir.glob("*.css")) if css_dir.exists() else []
+        if not css_files:
+            return None
+        main_css = max(css_files, key=lambda f: f.stat().st_size)
+        return main_css.relative_to(capture_dir).as_posix()
+    
+    def _find_key_assets(self, capture_dir):
+        """Categorize key visual assets, as paths relative to the capture"""
+        key_assets = {'logos': [], 'hero_images': [], 'feature_screenshots': []}
         images_dir = capture_dir / "assets" / "images"
         if not images_dir.exists():
-            return
+            return key_assets
         
         # Define patterns for different asset types
         logo_patterns = ['logo', 'brand', 'icon']
         hero_patterns = ['hero', 'banner', 'background', 'main']
         feature_patterns = ['feature', 'screenshot', 'demo', 'example']
         
-        # Get all image files
-        image_files = list(images_dir.glob("*"))
-        
-        # Categorize and copy assets
-        for img_file in image_files:
+        for img_file in sorted(images_dir.glob("*")):
             filename_lower = img_file.name.lower()
+            relative_path = img_file.relative_to(capture_dir).as_posix()
             
             # Check for logos
             if any(pattern in filename_lower for pattern in logo_patterns):
-                shutil.copy2(img_file, analysis_dir / "key-assets" / "logos" / img_file.name)
+                key_assets['logos'].append(relative_path)
             
-            # Check for hero images (also copy larger images)
+            # Check for hero images (also include larger images)
             elif (any(pattern in filename_lower for pattern in hero_patterns) or 
                   img_file.stat().st_size > 100000):  # Large images likely to be hero/background
-                shutil.copy2(img_file, analysis_dir / "key-assets" / "hero-images" / img_file.name)
+                key_assets['hero_images'].append(relative_path)
             
             # Check for feature screenshots
             elif any(pattern in filename_lower for pattern in feature_patterns):
-                shutil.copy2(img_file, analysis_dir / "key-assets" / "feature-screenshots" / img_file.name)
+                key_assets['feature_screenshots'].append(relative_path)
+        
+        return key_assets
     
-    def _generate_analysis_documentation(self, capture_dir, analysis_dir, assets, metadata):
+    def _generate_analysis_documentation(self, capture_dir, analysis_dir, metadata):
         """Generate analysis documentation and asset inventory"""
+        main_css = self._find_main_stylesheet(capture_dir)
+        key_assets = self._find_key_assets(capture_dir)
+        screenshot_path = self.find_screenshot(capture_dir)
+        screenshot = screenshot_path.name if screenshot_path else None
         
         # Create analysis brief
         analysis_brief = f"""# Landing Page Analysis Brief
@@ -193,16 +803,19 @@ class WebsiteCloner:
 
 ## Files Included for Analysis
 
+All paths are relative to the capture folder, one level above this package.
+`asset-inventory.json` lists every file below.
+
 ### Essential Files
 1. **index.html** - Complete HTML structure and content
-2. **screenshot.png** - Full page visual representation
+2. **{screenshot or 'N/A'}** - Full page visual representation
 3. **metadata.json** - Technical capture metadata
-4. **main-styles.css** - Primary stylesheet with design system
+4. **{main_css or 'N/A'}** - Primary stylesheet with design system
 
 ### Key Visual Assets
-- **Logos & Branding**: Located in `key-assets/logos/`
-- **Hero Images**: Located in `key-assets/hero-images/`
-- **Feature Screenshots**: Located in `key-assets/feature-screenshots/`
+- **Logos & Branding**: {len(key_assets['logos'])} files
+- **Hero Images**: {len(key_assets['hero_images'])} files
+- **Feature Screenshots**: {len(key_assets['feature_screenshots'])} files
 
 ## Analysis Capabilities
 
@@ -218,9 +831,9 @@ This package enables comprehensive analysis of:
 
 ## Recommended Analysis Approach
 
-1. **Visual Assessment**: Start with screenshot.png for overall layout
+1. **Visual Assessment**: Start with {screenshot or 'the live page'} for overall layout
 2. **Content Analysis**: Review index.html for messaging and structure
-3. **Design System**: Examine main-styles.css for design tokens
+3. **Design System**: Examine the primary stylesheet for design tokens
 4. **Asset Quality**: Evaluate key visual assets for brand consistency
 5. **Technical Review**: Check metadata.json for performance metrics
 
@@ -238,21 +851,18 @@ This package contains all necessary data for professional-grade landing page ana
                 "capture_time": metadata.get('capture_time'),
                 "total_assets": sum(metadata.get('assets', {}).values())
             },
+            "paths_relative_to": "capture folder",
             "essential_files": {
                 "html": "index.html",
-                "screenshot": "screenshot.png", 
+                "screenshot": screenshot,
                 "metadata": "metadata.json",
-                "main_css": "main-styles.css"
-            },
-            "key_assets": {
-                "logos": self._list_files_in_dir(analysis_dir / "key-assets" / "logos"),
-                "hero_images": self._list_files_in_dir(analysis_dir / "key-assets" / "hero-images"),
-                "feature_screenshots": self._list_files_in_dir(analysis_dir / "key-assets" / "feature-screenshots")
+                "main_css": main_css
             },
+            "key_assets": key_assets,
             "analysis_recommendations": [
-                "Start with visual assessment using screenshot.png",
+                f"Start with visual assessment using {screenshot or 'the live page'}",
                 "Review content structure in index.html",
-                "Analyze design system in main-styles.css",
+                "Analyze design system in the main stylesheet",
                 "Evaluate brand consistency across key assets",
                 "Check technical implementation in metadata.json"
             ]
@@ -262,508 +872,1133 @@ This package contains all necessary data for professional-grade landing page ana
         with open(analysis_dir / "asset-inventory.json", 'w', encoding='utf-8') as f:
             json.dump(asset_inventory, f, indent=2)
         
-        print(f"Generated analysis documentation with {len(asset_inventory['key_assets']['logos']) + len(asset_inventory['key_assets']['hero_images']) + len(asset_inventory['key_assets']['feature_screenshots'])} key assets")
-    
-    def _list_files_in_dir(self, directory):
-        """List files in a directory"""
-        if directory.exists():
-            return [f.name for f in directory.iterdir() if f.is_file()]
-        return []
+        print(f"Generated analysis documentation with {sum(len(paths) for paths in key_assets.values())} key assets")
+        
+    def capture_page(self, url, progress_callback=None, cancel_event=None, baseline=None):
+        """Main capture function
         
-    def capture_page(self, url, progress_callback=None):
-        """Main capture function"""
-        def log_progress(message):
-            if progress_callback:
-                progress_callback(message)
+        Setting cancel_event stops the capture at the next progress update
+        and removes the partial capture folder. With baseline (the folder
+        name of an earlier capture) the capture is incremental: unchanged
+        assets are linked from the baseline instead of downloaded and the
+        differences are recorded in the metadata.
+        
+        progress_callback is called as progress_callback(message, details);
+        see CaptureProgress for the details.
+        """
+        progress = CaptureProgress(progress_callback, cancel_event)
+        report_progress = progress.update
+        
+        def log_progress(message, stage=None):
+            report_progress(message, stage)
             print(message)
-            
+        
+        capture_dir = None
+        state = None
+        load_future = None
+        timings = StageTimings()
         try:
-            log_progress("🚀 Starting capture...")
-            capture_dir = self.create_capture_folder(url)
+            log_progress("🚀 Starting capture...", 'start')
+            capture_dir = self._start_capture(url)
             
-            # Initialize browser
-            log_progress("🌐 Launching browser...")
-            with sync_playwright() as p:
-                browser = p.chromium.launch(headless=True)
-                page = browser.new_page()
-                
-                # Set realistic viewport
-                page.set_viewport_size({"width": 1920, "height": 1080})
-                
-                log_progress("📄 Loading page...")
-                response = page.goto(url, wait_until="networkidle", timeout=30000)
-                
-                if not response.ok:
-                    raise Exception(f"Failed to load page: {response.status}")
-                
-                # Wait for dynamic content and trigger lazy loading
-                log_progress("⏳ Waiting for dynamic content...")
-                page.wait_for_timeout(3000)
-                
-                # Enhanced but simpler dynamic content loading
-                log_progress("📜 Triggering lazy loading and dynamic content...")
-                page.evaluate("""
-                    () => {
-                        return new Promise((resolve) => {
-                            let totalHeight = 0;
-                            let distance = 150;
-                            let timer = setInterval(() => {
-                                let scrollHeight = document.body.scrollHeight;
-                                window.scrollBy(0, distance);
-                                totalHeight += distance;
-                                if(totalHeight >= scrollHeight || totalHeight > 15000) {
-                                    clearInterval(timer);
-                                    window.scrollTo(0, 0);
-                                    setTimeout(resolve, 2000);
-                                }
-                            }, 200);
-                        });
-                    }
-                """)
-                
-                # Additional wait for dynamic content and intersection observers
-                log_progress("⏳ Waiting for dynamic content to render...")
-                page.wait_for_timeout(4000)
-                
-                # Scroll to trigger section-based content
-                log_progress("🎯 Triggering section-based content...")
-                page.evaluate("""
-                    () => {
-                        // Scroll to bottom and back to top to trigger all content
-                        window.scrollTo(0, document.body.scrollHeight);
-                    }
-                """)
-                page.wait_for_timeout(2000)
-                page.evaluate("window.scrollTo(0, 0)")
-                page.wait_for_timeout(2000)
-                
-                # Take screenshot
-                log_progress("📸 Taking screenshot...")
-                screenshot_path = capture_dir / "screenshot.png"
-                page.screenshot(path=str(screenshot_path), full_page=True)
-                
-                # Get final HTML
-                log_progress("🔍 Extracting HTML...")
-                html_content = page.content()
-                
-                # Get current URL (in case of redirects)
-                final_url = page.url
-                
-                browser.close()
-                
-            # Parse HTML with BeautifulSoup
-            soup = BeautifulSoup(html_content, 'lxml')
+            # Downloads can start while the page is still loading
+            state = self._new_download_state(cancel_event)
+            baseline_records = {}
+            if baseline:
+                log_progress("♻️ Loading baseline capture...", 'baseline')
+                baseline_records = self._apply_baseline(state, baseline)
+            
+            # Load the page on a pooled browser. The HTML arrives through
+            # page_ready while the browser goes on to take the screenshot.
+            log_progress("🌐 Acquiring browser...", 'browser')
+            page_ready = Future()
+            browser_requested = time.monotonic()
+            
+            def load_page(context):
+                # Waiting for a pooled browser, launching it if needed
+                timings.record('browser', browser_requested)
+                return self._load_page(context, url, capture_dir, log_progress, page_ready, state, timings)
+            
+            load_future = self.browser_pool.submit(load_page)
+            wait([page_ready, load_future], timeout=self.browser_timeout, return_when=FIRST_COMPLETED)
+            if not page_ready.done():
+                if not load_future.done():
+                    load_future.cancel()
+                    raise TimeoutError(f"No page from the browser after {self.browser_timeout}s")
+                load_future.result()
+            html_content, final_url, state.browser_assets = page_ready.result()
+            
+            # Parse HTML with the configured engine
+            with timings.stage('parse'):
+                document = parse_html(html_content, self.html_engine)
             
             # Track assets
-            assets = {
-                'css': [],
-                'js': [],
-                'images': [],
-                'fonts': [],
-                'videos': [],
-                'audio': [],
-                'documents': []
-            }
+            assets = self._new_asset_lists()
             
             # Find all assets
-            log_progress("🔍 Discovering assets...")
-            self._discover_assets(soup, final_url, assets)
+            log_progress("🔍 Discovering assets...", 'discover')
+            with timings.stage('discover'):
+                elements = ElementTable()
+                asset_index = self._discover_assets(document, final_url, assets, elements)
+            
+            css_index, other_index = self._split_download_stages(asset_index, state)
+            
+            def stylesheet_stage():
+                with timings.stage('stylesheets') as stage:
+                    stylesheet_cpu = lambda fn: timings.cpu_timed('stylesheets', fn)
+                    stats = self._download_assets(assets, capture_dir, report_progress, css_index, state,
+                                                  stylesheet_cpu)
+                    css_stats = self._process_stylesheets(assets, capture_dir, asset_index, report_progress, state,
+                                                          stylesheet_cpu)
+                    for key, value in css_stats.items():
+                        stats[key] += value
+                    stage['bytes'] = stats['bytes']
+                    return stats
             
             # Download assets
-            log_progress("⬇️ Downloading assets...")
-            self._download_assets(assets, capture_dir, progress_callback)
+            log_progress("⬇️ Downloading assets...", 'download')
+            with ThreadPoolExecutor(max_workers=1) as stage_runner:
+                css_future = stage_runner.submit(stylesheet_stage)
+                with timings.stage('download') as stage:
+                    download_stats = self._download_assets(assets, capture_dir, report_progress, other_index, state,
+                                                           lambda fn: timings.cpu_timed('download', fn))
+                    stage['bytes'] = download_stats['bytes']
+                log_progress("🎨 Processing stylesheets...", 'stylesheets')
+                for key, value in css_future.result().items():
+                    download_stats[key] += value
             
             # Rewrite HTML
-            log_progress("✏️ Rewriting HTML...")
-            self._rewrite_html(soup, assets, capture_dir)
+            log_progress("✏️ Rewriting HTML...", 'rewrite')
+            with timings.stage('rewrite'):
+                url_index = self._build_url_index(assets, final_url)
+                self._rewrite_html(document, assets, elements, capture_dir, url_index)
             
-            # Save metadata
-            metadata = {
-                'original_url': url,
-                'final_url': final_url,
-                'capture_time': datetime.now().isoformat(),
-                'assets': {k: len(v) for k, v in assets.items()},
-                'folder_name': capture_dir.name
-            }
+            modified_js_files = []
+            if self.patch_js_loaders:
+                log_progress("🧩 Patching JavaScript image loaders...", 'patch_js')
+                with timings.stage('patch_js'):
+                    modified_js_files = self._modify_nextjs_loader_in_js_files(assets, capture_dir, url_index,
+                                                                               timings)
             
-            with open(capture_dir / "metadata.json", 'w') as f:
-                json.dump(metadata, f, indent=2)
+            # The screenshot has been running alongside everything above
+            screenshot_tiles, truncated = load_future.result(timeout=self.browser_timeout)
+            self._finish_capture_stages(state, load_future)
             
-            # Create analysis package
-            log_progress("📊 Creating analysis package...")
-            self._create_analysis_package(capture_dir, assets, metadata)
-                
-            log_progress("✅ Capture completed successfully!")
+            with timings.stage('screenshot_encode'):
+                screenshot = self._save_screenshot(capture_dir, screenshot_tiles, truncated)
+            
+            # Save metadata
+            self._save_capture(capture_dir, url, final_url, assets, asset_index, download_stats,
+                               modified_js_files, timings, baseline, baseline_records, screenshot,
+                               state.assumed_unchanged)
+            
+            log_progress("✅ Capture completed successfully!", 'completed')
             return capture_dir.name
+        
+        except CaptureCancelled:
+            print(f"🛑 Capture of {url} cancelled")
+            self._finish_capture_stages(state, load_future)
+            if capture_dir is not None:
+                self.delete_capture(capture_dir.name)
+            raise
             
         except Exception as e:
-            log_progress(f"❌ Error: {str(e)}")
+            message = f"❌ Error: {str(e)}"
+            progress.report(message, 'error')
+            print(message)
+            self._finish_capture_stages(state, load_future)
+            if capture_dir is not None:
+                self.catalog.set_status(capture_dir.name, 'error')
             raise
+    
+    def _start_capture(self, url):
+        """Create the folder of a new capture and list it as in progress"""
+        capture_dir = self.create_capture_folder(url)
+        self.catalog.upsert({
+            'original_url': url,
+            'capture_time': datetime.now().isoformat(),
+            'folder_name': capture_dir.name
+        }, status='in_progress')
+        return capture_dir
+    
+    def _apply_baseline(self, state, baseline):
+        """Load a baseline capture's records, offering the reusable ones to state
+        
+        Returns every downloaded record of the baseline for the diff.
+        """
+        baseline_records = self._load_baseline(baseline)
+        state.baseline = self._reusable_baseline(baseline_records)
+        return baseline_records
+    
+    def _split_download_stages(self, asset_index, state):
+        """Split discovered assets into the stylesheet stage and the other downloads
+        
+        Stylesheets are downloaded and processed in their own stage so their
+        fonts and images are queued while other downloads run. Every download
+        is registered before either stage starts, so the stylesheet stage
+        waits for page assets it shares with the page.
+        """
+        for canonical_url in asset_index:
+            state.started(canonical_url)
+        css_index = {key: refs for key, refs in asset_index.items() if refs[0][0] == 'css'}
+        other_index = {key: refs for key, refs in asset_index.items() if refs[0][0] != 'css'}
+        return css_index, other_index
+    
+    def find_baseline(self, url):
+        """Folder name of the latest completed capture of url usable as a baseline, or None
+        
+        Captures saved without asset records are skipped, so a URL whose
+        only captures predate them is captured in full.
+        """
+        domain = self.catalog.domain_for_url(url)
+        for capture in self.get_all_captures(domain=domain):
+            if capture.get('original_url') == url and self.is_baseline(capture['folder_name']):
+                return capture['folder_name']
+        return None
+    
+    def is_baseline(self, folder_name):
+        """Whether folder_name is a capture directly inside base_dir with asset records"""
+        capture_dir = self.base_dir / folder_name
+        return (not folder_name.startswith('.') and capture_dir.parent == self.base_dir and
+                capture_dir.is_dir() and (capture_dir / "asset-records.json").exists())
+    
+    def _load_baseline(self, folder_name):
+        """Downloaded asset records of an earlier capture by canonical URL"""
+        if not self.is_baseline(folder_name):
+            raise FileNotFoundError(f"Baseline capture {folder_name} not found")
+        with open(self.base_dir / folder_name / "asset-records.json", 'r') as f:
+            records = [AssetRecord.from_dict(data) for data in json.load(f)]
+        return {record.canonical_url: record for record in records
+                if record.status == 'downloaded' and record.canonical_url and record.content_hash}
+    
+    def _reusable_baseline(self, baseline_records):
+        """Baseline records whose files can be linked into a new capture unchanged
+        
+        Stylesheets are always downloaded again because the baseline copies
+        are already rewritten, as are JS files when loaders get patched.
+        """
+        return {canonical_url: record for canonical_url, record in baseline_records.items()
+                if record.kind != 'css' and not (record.kind == 'js' and self.patch_js_loaders)}
+    
+    def _diff_with_baseline(self, capture_dir, baseline, baseline_records, assets, assumed_unchanged=()):
+        """Added, removed and changed assets and the size of the HTML diff against a baseline
+        
+        Assets in assumed_unchanged were linked from the baseline without a
+        request, since the server sent no validators to revalidate them
+        with; they are listed apart from the assets known to be unchanged.
+        """
+        current = {}
+        for asset_list in assets.values():
+            for asset in asset_list:
+                if asset.status == 'downloaded':
+                    current.setdefault(asset.canonical_url, asset.content_hash)
+        previous = {canonical_url: record.content_hash for canonical_url, record in baseline_records.items()}
+        
+        common = current.keys() & previous.keys()
+        changed = sorted(url for url in common if current[url] != previous[url])
+        assumed = sorted(common.intersection(assumed_unchanged))
+        return {
+            'baseline': baseline,
+            'added': sorted(current.keys() - previous.keys()),
+            'removed': sorted(previous.keys() - current.keys()),
+            'changed': changed,
+            'unchanged': len(common) - len(changed) - len(assumed),
+            'assumed_unchanged': assumed,
+            'html': self._html_diff(self.base_dir / baseline / "index.html", capture_dir / "index.html")
+        }
+    
+    def _html_diff(self, old_path, new_path):
+        """Line diff size between two saved pages, or None if either is missing"""
+        try:
+            with open(old_path, 'r', encoding='utf-8', errors='replace') as f:
+                old_lines = f.read().splitlines()
+            with open(new_path, 'r', encoding='utf-8', errors='replace') as f:
+                new_lines = f.read().splitlines()
+        except OSError:
+            return None
+        
+        diff = {'lines_added': 0, 'lines_removed': 0, 'diff_bytes': 0}
+        for line in difflib.unified_diff(old_lines, new_lines, lineterm='', n=0):
+            if line.startswith(('+++', '---', '@@')):
+                continue
+            if line.startswith('+'):
+                diff['lines_added'] += 1
+            elif line.startswith('-'):
+                diff['lines_removed'] += 1
+            diff['diff_bytes'] += len(line) - 1
+        return diff
+    
+    def _new_asset_lists(self):
+        """Empty per-type asset lists for a capture"""
+        return {
+            'css': [],
+            'js': [],
+            'images': [],
+            'fonts': [],
+            'videos': [],
+            'audio': [],
+            'documents': []
+        }
+    
+    def _save_capture(self, capture_dir, url, final_url, assets, asset_index, download_stats,
+                      modified_js_files, timings, baseline=None, baseline_records=None, screenshot=None,
+                      assumed_unchanged=()):
+        """Write metadata, manifest and asset records and mark the capture completed"""
+        metadata = {
+            'original_url': url,
+            'final_url': final_url,
+            'capture_time': datetime.now().isoformat(),
+            'assets': {k: len(v) for k, v in assets.items()},
+            'unique_assets': len(asset_index),
+            'download_stats': download_stats,
+            'modified_js_files': modified_js_files,
+            'stage_timings': timings.to_dict(),
+            'folder_name': capture_dir.name
+        }
+        if screenshot:
+            metadata['screenshot'] = screenshot
+        if baseline:
+            metadata['diff'] = self._diff_with_baseline(capture_dir, baseline, baseline_records, assets,
+                                                        assumed_unchanged)
+        
+        with open(capture_dir / "metadata.json", 'w') as f:
+            json.dump(metadata, f, indent=2)
+        
+        self._write_asset_manifest(capture_dir, assets)
+        self._write_asset_records(capture_dir, assets)
+        self.catalog.upsert(metadata, status='completed')
+        self.metrics.record(metadata['stage_timings'])
+        return metadata
+    
+    def _finish_capture_stages(self, state, load_future):
+        """Wait for the browser stage and release the download state"""
+        if load_future is not None:
+            wait([load_future], timeout=self.browser_timeout)
+        if state is not None:
+            state.close()
+            
+    def _track_network(self, page):
+        """Track in-flight requests and DOM mutations on a page for readiness detection"""
+        network = self._watch_requests(page)
+        page.add_init_script(MUTATION_OBSERVER_SCRIPT)
+        return network
+    
+    def _watch_requests(self, page):
+        """Track in-flight requests on a page"""
+        # Media and streaming requests can stay open indefinitely
+        ignored_types = ('media', 'websocket', 'eventsource')
+        network = {'in_flight': set(), 'last_activity': time.monotonic()}
+        
+        def on_request(request):
+            if request.resource_type not in ignored_types:
+                network['in_flight'].add(request)
+                network['last_activity'] = time.monotonic()
+        
+        def on_request_done(request):
+            network['in_flight'].discard(request)
+            network['last_activity'] = time.monotonic()
+        
+        page.on("request", on_request)
+        page.on("requestfinished", on_request_done)
+        page.on("requestfailed", on_request_done)
+        return network
+    
+    def _wait_for_settle(self, page, network, max_wait_ms, on_poll=None):
+        """Wait until the network, DOM and visible images are quiet, at most max_wait_ms
+        
+        on_poll is called between checks so other browser-side work can use
+        the wait.
+        """
+        if not self.adaptive_settle:
+            page.wait_for_timeout(max_wait_ms)
+            if on_poll:
+                on_poll()
+            return
+        
+        deadline = time.monotonic() + max_wait_ms / 1000
+        while time.monotonic() < deadline:
+            if on_poll:
+                on_poll()
+            if self._is_settled(network, page.evaluate(SETTLE_STATE_SCRIPT)):
+                return
+            
+            page.wait_for_timeout(100)
+    
+    def _is_settled(self, network, state):
+        """Whether the network and the page state from SETTLE_STATE_SCRIPT have been quiet long enough"""
+        network_quiet_ms = (time.monotonic() - network['last_activity']) * 1000
+        return (not network['in_flight'] and
+                network_quiet_ms >= self.settle_quiet_ms and
+                state['sinceMutation'] >= self.settle_quiet_ms and
+                state['pendingImages'] == 0)
+    
+    def _record_responses(self, page, prefetch=None):
+        """Collect asset responses the browser receives while the page loads
+        
+        Responses whose bodies are not recorded are passed to prefetch(url)
+        so their download starts right away. Next.js image optimiser
+        responses are neither recorded nor prefetched.
+        """
+        recorded_types = ('stylesheet', 'script', 'image', 'font', 'media')
+        responses = []
+        
+        def on_response(response):
+            request = response.request
+            if request.resource_type not in recorded_types or request.method != 'GET':
+                return
+            # Image optimiser responses hold resized WebP/AVIF bytes but share
+            # the original image's canonical URL; the original is downloaded
+            if unwrap_nextjs_image_url(response.url) != response.url:
+                return
+            # Partial (206) media responses are not complete bodies
+            if response.status == 200 and self.record_browser_assets:
+                responses.append(response)
+            elif response.status in (200, 206) and prefetch and response.url.startswith(('http://', 'https://')):
+                prefetch(response.url)
+        
+        page.on("response", on_response)
+        return responses
+    
+    def _collect_browser_assets(self, responses, browser_assets, network=None):
+        """Write recorded response bodies to temp files keyed by canonical URL
+        
+        Collected responses are removed from the list. With network, bodies
+        of requests still in flight are left for a later call.
+        """
+        for canonical_url, response in self._take_recordable(responses, browser_assets, network):
+            try:
+                self._save_browser_body(canonical_url, response.body(), browser_assets)
+            except Exception as e:
+                # Bodies can be evicted from the browser's buffer; requests will refetch
+                print(f"Warning: Could not record browser response for {response.url}: {e}")
+        
+        return browser_assets
+    
+    def _take_recordable(self, responses, browser_assets, network=None):
+        """Remove responses whose bodies can be recorded now from the list
+        
+        Returns (canonical_url, response) pairs, skipping URLs already
+        recorded and bodies the headers say are too large.
+        """
+        recordable = []
+        seen = set(browser_assets)
+        pending = list(responses)
+        responses.clear()
+        for response in pending:
+            if network is not None and response.request in network['in_flight']:
+                responses.append(response)
+                continue
             
-    def _discover_assets(self, soup, base_url, assets):
-        """Discover all assets in the page"""
+            canonical_url = self.canonicalize_asset_url(response.url, response.url)
+            if canonical_url in seen:
+                continue
+            seen.add(canonical_url)
+            
+            content_length = int(response.headers.get('content-length') or 0)
+            if self.max_asset_bytes is not None and content_length > self.max_asset_bytes:
+                continue
+            recordable.append((canonical_url, response))
+        return recordable
+    
+    def _save_browser_body(self, canonical_url, body, browser_assets):
+        """Write a recorded response body to a temp file in the blob store"""
+        if self.max_asset_bytes is not None and len(body) > self.max_asset_bytes:
+            return
+        
+        temp_path = self.asset_store.new_temp_path()
+        with open(temp_path, 'wb') as f:
+            f.write(body)
+        browser_assets[canonical_url] = {
+            'temp_path': temp_path,
+            'digest': hashlib.sha256(body).hexdigest(),
+            'size': len(body)
+        }
+    
+    def _load_page(self, context, url, capture_dir, log_progress, page_ready=None, state=None, timings=None):
+        """Load and settle the page in a browser context
+        
+        Returns the screenshot as (png_tiles, truncated). (html, final_url,
+        browser_assets) is set on the page_ready future as soon as the HTML
+        is extracted, so the caller can start processing it while the
+        screenshot is taken. Recorded bodies are collected during the settle
+        waits, and with a download state the assets the browser cannot hand
+        over are prefetched.
+        """
+        if timings is None:
+            timings = StageTimings()
+        
+        page = context.new_page()
+        network = self._track_network(page)
+        prefetch = None
+        if state is not None:
+            prefetch = lambda asset_url: state.prefetch(self.canonicalize_asset_url(asset_url, asset_url), asset_url)
+        responses = self._record_responses(page, prefetch)
+        browser_assets = {}
+        collect_bodies = lambda: self._collect_browser_assets(responses, browser_assets, network)
+        
+        # Set realistic viewport
+        page.set_viewport_size({"width": 1920, "height": 1080})
+        
+        log_progress("📄 Loading page...", 'load')
+        with timings.stage('load'):
+            response = page.goto(url, wait_until="networkidle", timeout=30000)
+            
+            if not response.ok:
+                raise Exception(f"Failed to load page: {response.status}")
+        
+        # Wait for dynamic content and trigger lazy loading
+        with timings.stage('settle'):
+            for message, script, max_wait_ms in SETTLE_STEPS:
+                if message:
+                    log_progress(message, 'settle')
+                if script:
+                    page.evaluate(script)
+                self._wait_for_settle(page, network, max_wait_ms, collect_bodies)
+        
+        # Get final HTML
+        log_progress("🔍 Extracting HTML...", 'extract')
+        with timings.stage('extract') as stage:
+            html_content = page.content()
+            
+            # Get current URL (in case of redirects)
+            final_url = page.url
+            
+            # Remaining bodies, waiting for any still being received
+            self._collect_browser_assets(responses, browser_assets)
+            stage['bytes'] = self._browser_bytes(html_content, browser_assets)
+        
+        # Hand the page over before the screenshot so processing can start
+        if page_ready is not None:
+            page_ready.set_result((html_content, final_url, browser_assets))
+        
+        # Take screenshot
+        log_progress("📸 Taking screenshot...", 'screenshot')
+        with timings.stage('screenshot') as stage:
+            clips, truncated = self._screenshot_clips(page.evaluate(PAGE_SIZE_SCRIPT))
+            tiles = [page.screenshot(full_page=True, clip=clip) for clip in clips]
+            stage['bytes'] = sum(len(tile) for tile in tiles)
+        
+        return tiles, truncated
+    
+    def _browser_bytes(self, html_content, browser_assets):
+        """Size of the page and the response bodies recorded from the browser"""
+        return len(html_content.encode('utf-8')) + sum(body['size'] for body in browser_assets.values())
+    
+    def _screenshot_clips(self, page_size):
+        """Screenshot tiles for a page of page_size with the configured limits"""
+        return screenshot_clips(page_size['width'], page_size['height'], self.screenshot_format,
+                                self.screenshot_max_height, self.screenshot_tile_height)
+    
+    def _save_screenshot(self, capture_dir, tiles, truncated):
+        """Encode the screenshot tiles and thumbnail into the capture and return their metadata"""
+        screenshot = save_screenshot(tiles, capture_dir, self.screenshot_format, self.screenshot_quality,
+                                     self.thumbnail_width)
+        screenshot['truncated'] = truncated
+        return screenshot
+    
+    def _add_asset(self, assets, elements, kind, base_url, url, element, attribute):
+        """Record one asset reference found in the page"""
+        if not url or url.startswith('data:'):
+            return
+        # Parse Next.js image optimization URLs
+        full_url = urljoin(base_url, self.parse_nextjs_image_url(url))
+        assets[kind].append(AssetRecord(
+            url=full_url,
+            original_url=url,
+            kind=kind,
+            attribute=attribute,
+            element_id=elements.add(element)
+        ))
+    
+    def _srcset_urls(self, srcset):
+        """URLs of the candidates in a srcset attribute"""
+        urls = []
+        for src_item in srcset.split(','):
+            parts = src_item.strip().split()
+            if parts:
+                urls.append(parts[0])
+        return urls
+    
+    def _discover_assets(self, document, base_url, assets, elements):
+        """Discover all assets in the page and return them indexed by canonical URL
+        
+        Records are appended to assets by kind; the elements they reference
+        are registered in the elements table.
+        """
+        
+        def rel_tokens(link):
+            return set((document.get(link, 'rel') or '').lower().split())
         
         # CSS files
-        for link in soup.find_all('link', rel='stylesheet'):
-            href = link.get('href')
-            if href:
-                full_url = urljoin(base_url, href)
-                assets['css'].append({
-                    'url': full_url,
-                    'element': link,
-                    'original_url': href
-                })
+        for link in document.find_all('link', 'rel'):
+            if 'stylesheet' in rel_tokens(link):
+                self._add_asset(assets, elements, 'css', base_url, document.get(link, 'href'), link, 'href')
         
         # JavaScript files
-        for script in soup.find_all('script', src=True):
-            src = script.get('src')
-            if src:
-                full_url = urljoin(base_url, src)
-                assets['js'].append({
-                    'url': full_url,
-                    'element': script,
-                    'original_url': src
-                })
+        for script in document.find_all('script', 'src'):
+            self._add_asset(assets, elements, 'js', base_url, document.get(script, 'src'), script, 'src')
         
         # Images (regular img tags)
-        for img in soup.find_all('img'):
+        for img in document.find_all('img'):
             # Check src attribute
-            src = img.get('src')
-            if src and not src.startswith('data:'):
-                # Parse Next.js image optimization URLs
-                actual_url = self.parse_nextjs_image_url(src)
-                full_url = urljoin(base_url, actual_url)
-                assets['images'].append({
-                    'url': full_url,
-                    'element': img,
-                    'original_url': src,
-                    'actual_url': actual_url,
-                    'attribute': 'src',
-                    'is_nextjs_image': '/_next/image?' in src
-                })
+            self._add_asset(assets, elements, 'images', base_url, document.get(img, 'src'), img, 'src')
             
             # Check data-src for lazy loading
-            data_src = img.get('data-src')
-            if data_src and not data_src.startswith('data:'):
-                # Parse Next.js image optimization URLs
-                actual_url = self.parse_nextjs_image_url(data_src)
-                full_url = urljoin(base_url, actual_url)
-                assets['images'].append({
-                    'url': full_url,
-                    'element': img,
-                    'original_url': data_src,
-                    'actual_url': actual_url,
-                    'attribute': 'data-src',
-                    'is_nextjs_image': '/_next/image?' in data_src
-                })
+            self._add_asset(assets, elements, 'images', base_url, document.get(img, 'data-src'), img, 'data-src')
             
             # Check srcset for responsive images
-            srcset = img.get('srcset')
-            if srcset:
-                for src_item in srcset.split(','):
-                    src_url = src_item.strip().split()[0]
-                    if not src_url.startswith('data:'):
-                        # Parse Next.js image optimization URLs
-                        actual_url = self.parse_nextjs_image_url(src_url)
-                        full_url = urljoin(base_url, actual_url)
-                        assets['images'].append({
-                            'url': full_url,
-                            'element': img,
-                            'original_url': src_url,
-                            'actual_url': actual_url,
-                            'attribute': 'srcset',
-                            'is_nextjs_image': '/_next/image?' in src_url
-                        })
+            for src_url in self._srcset_urls(document.get(img, 'srcset') or ''):
+                self._add_asset(assets, elements, 'images', base_url, src_url, img, 'srcset')
         
         # Picture elements
-        for picture in soup.find_all('picture'):
-            for source in picture.find_all('source'):
-                srcset = source.get('srcset')
-                if srcset:
-                    for src_item in srcset.split(','):
-                        src_url = src_item.strip().split()[0]
-                        if not src_url.startswith('data:'):
-                            # Parse Next.js image optimization URLs
-                            actual_url = self.parse_nextjs_image_url(src_url)
-                            full_url = urljoin(base_url, actual_url)
-                            assets['images'].append({
-                                'url': full_url,
-                                'element': source,
-                                'original_url': src_url,
-                                'actual_url': actual_url,
-                                'attribute': 'srcset',
-                                'is_nextjs_image': '/_next/image?' in src_url
-                            })
-        
-        # Video elements
-        for video in soup.find_all('video'):
-            # Check src attribute
-            src = video.get('src')
-            if src:
-                full_url = urljoin(base_url, src)
-                assets['videos'].append({
-                    'url': full_url,
-                    'element': video,
-                    'original_url': src,
-                    'attribute': 'src'
-                })
-            
-            # Check source elements within video
-            for source in video.find_all('source'):
-                src = source.get('src')
-                if src:
-                    full_url = urljoin(base_url, src)
-                    assets['videos'].append({
-                        'url': full_url,
-                        'element': source,
-                        'original_url': src,
-                        'attribute': 'src'
-                    })
-        
-        # Audio elements
-        for audio in soup.find_all('audio'):
-            # Check src attribute
-            src = audio.get('src')
-            if src:
-                full_url = urljoin(base_url, src)
-                assets['audio'].append({
-                    'url': full_url,
-                    'element': audio,
-                    'original_url': src,
-                    'attribute': 'src'
-                })
-            
-            # Check source elements within audio
-            for source in audio.find_all('source'):
-                src = source.get('src')
-                if src:
-                    full_url = urljoin(base_url, src)
-                    assets['audio'].append({
-                        'url': full_url,
-                        'element': source,
-                        'original_url': src,
-                        'attribute': 'src'
-                    })
+        for picture in document.find_all('picture'):
+            for source in document.children(picture, 'source'):
+                for src_url in self._srcset_urls(document.get(source, 'srcset') or ''):
+                    self._add_asset(assets, elements, 'images', base_url, src_url, source, 'srcset')
+        
+        # Video and audio elements, including their <source> children
+        for kind, tag in (('videos', 'video'), ('audio', 'audio')):
+            for media in document.find_all(tag):
+                self._add_asset(assets, elements, kind, base_url, document.get(media, 'src'), media, 'src')
+                for source in document.children(media, 'source'):
+                    self._add_asset(assets, elements, kind, base_url, document.get(source, 'src'), source, 'src')
         
         # Favicon and icons
-        for link in soup.find_all('link', rel=['icon', 'shortcut icon', 'apple-touch-icon']):
-            href = link.get('href')
-            if href:
-                full_url = urljoin(base_url, href)
-                assets['images'].append({
-                    'url': full_url,
-                    'element': link,
-                    'original_url': href,
-                    'attribute': 'href'
-                })
-        
-        # Background images in CSS
-        for element in soup.find_all(style=True):
-            style = element.get('style', '')
-            bg_matches = re.findall(r'background-image:\s*url\(["\']?([^"\']+)["\']?\)', style)
-            for bg_url in bg_matches:
-                if not bg_url.startswith('data:'):
-                    full_url = urljoin(base_url, bg_url)
-                    assets['images'].append({
-                        'url': full_url,
-                        'element': element,
-                        'original_url': bg_url,
-                        'is_background': True
-                    })
+        for link in document.find_all('link', 'rel'):
+            if rel_tokens(link) & {'icon', 'apple-touch-icon'}:
+                self._add_asset(assets, elements, 'images', base_url, document.get(link, 'href'), link, 'href')
+        
+        # Background images in inline styles
+        for element in document.find_all('*', 'style'):
+            for reference in find_css_urls(document.get(element, 'style') or ''):
+                self._add_asset(assets, elements, 'images', base_url, reference.url, element, 'style')
         
         # Documents (PDFs, etc.)
-        for link in soup.find_all('a', href=True):
-            href = link.get('href')
+        for link in document.find_all('a', 'href'):
+            href = document.get(link, 'href')
             if href and any(href.lower().endswith(ext) for ext in ['.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx']):
-                full_url = urljoin(base_url, href)
-                assets['documents'].append({
-                    'url': full_url,
-                    'element': link,
-                    'original_url': href,
-                    'attribute': 'href'
-                })
+                self._add_asset(assets, elements, 'documents', base_url, href, link, 'href')
         
         # Fonts
-        for link in soup.find_all('link', rel='preload'):
-            if link.get('as') == 'font':
-                href = link.get('href')
-                if href:
-                    full_url = urljoin(base_url, href)
-                    assets['fonts'].append({
-                        'url': full_url,
-                        'element': link,
-                        'original_url': href,
-                        'attribute': 'href'
-                    })
-        
-        # CSS @font-face and other URL references (parse existing CSS)
-        for style in soup.find_all('style'):
-            css_content = style.string
+        for link in document.find_all('link', 'rel'):
+            if 'preload' in rel_tokens(link) and document.get(link, 'as') == 'font':
+                self._add_asset(assets, elements, 'fonts', base_url, document.get(link, 'href'), link, 'href')
+        
+        # CSS @import, @font-face and other URL references (parse existing CSS).
+        # Imported sheets are processed like linked ones.
+        for style in document.find_all('style'):
+            css_content = document.text(style)
             if css_content:
-                # Find font URLs
-                font_matches = re.findall(r'url\(["\']?([^"\']+\.(woff2?|eot|ttf|otf))["\']?\)', css_content)
-                for font_url, _ in font_matches:
-                    if not font_url.startswith('data:'):
-                        full_url = urljoin(base_url, font_url)
-                        assets['fonts'].append({
-                            'url': full_url,
-                            'element': style,
-                            'original_url': font_url,
-                            'is_css_font': True
-                        })
-                
-                # Find other asset URLs in CSS
-                url_matches = re.findall(r'url\(["\']?([^"\']+)["\']?\)', css_content)
-                for asset_url in url_matches:
-                    if not asset_url.startswith('data:') and not any(asset_url.endswith(ext) for ext in ['.woff', '.woff2', '.eot', '.ttf', '.otf']):
-                        full_url = urljoin(base_url, asset_url)
-                        if any(asset_url.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp']):
-                            assets['images'].append({
-                                'url': full_url,
-                                'element': style,
-                                'original_url': asset_url,
-                                'is_css_image': True
-                            })
-                    
-    def _download_assets(self, assets, capture_dir, progress_callback=None):
-        """Download all discovered assets"""
-        total_assets = sum(len(asset_list) for asset_list in assets.values())
-        downloaded = 0
+                for reference in find_css_urls(css_content):
+                    if reference.is_import:
+                        self._add_asset(assets, elements, 'css', base_url, reference.url, style, None)
+                        continue
+                    full_url = urljoin(base_url, reference.url)
+                    kind = self._classify_css_url(full_url)
+                    # Font URLs, and other image URLs in CSS
+                    if kind == 'fonts' or (kind == 'images' and self._has_image_extension(full_url)):
+                        self._add_asset(assets, elements, kind, base_url, reference.url, style, None)
         
-        for asset_type, asset_list in assets.items():
-            for asset in asset_list:
-                try:
-                    downloaded += 1
-                    if progress_callback:
-                        progress_callback(f"📥 Downloading {asset_type} ({downloaded}/{total_assets})")
-                    
-                    response = self.session.get(asset['url'], timeout=10)
-                    response.raise_for_status()
-                    
-                    # Generate filename - use actual URL for Next.js images to get better filenames
-                    url_for_filename = asset.get('actual_url', asset['url'])
-                    parsed_url = urlparse(url_for_filename)
-                    filename = os.path.basename(parsed_url.path) or 'index'
-                    filename = self.sanitize_filename(filename)
-                    
-                    # Add extension if missing
-                    common_extensions = {
-                        'css': ['.css'],
-                        'js': ['.js'],
-                        'images': ['.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.webp', '.avif'],
-                        'videos': ['.mp4', '.webm', '.ogg', '.mov', '.avi'],
-                        'audio': ['.mp3', '.wav', '.ogg', '.m4a', '.flac'],
-                        'fonts': ['.woff', '.woff2', '.eot', '.ttf', '.otf'],
-                        'documents': ['.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx']
-                    }
-                    
-                    # Check if filename already has appropriate extension
-                    has_extension = any(filename.lower().endswith(ext) for ext in common_extensions.get(asset_type, []))
-                    
-                    if not has_extension:
-                        # Add default extension based on asset type
-                        if asset_type == 'css':
-                            filename += '.css'
-                        elif asset_type == 'js':
-                            filename += '.js'
-                        elif asset_type == 'images':
-                            filename += '.png'
-                        elif asset_type == 'videos':
-                            filename += '.mp4'
-                        elif asset_type == 'audio':
-                            filename += '.mp3'
-                        elif asset_type == 'fonts':
-                            filename += '.woff'
-                        elif asset_type == 'documents':
-                            filename += '.pdf'
-                    
-                    # Ensure unique filename
-                    counter = 1
-                    original_filename = filename
-                    while (capture_dir / "assets" / asset_type / filename).exists():
-                        name, ext = os.path.splitext(original_filename)
-                        filename = f"{name}_{counter}{ext}"
-                        counter += 1
-                    
-                    filepath = capture_dir / "assets" / asset_type / filename
-                    
-                    with open(filepath, 'wb') as f:
-                        f.write(response.content)
-                    
-                    asset['local_path'] = f"assets/{asset_type}/{filename}"
+        return self._build_asset_index(assets)
                     
-                except Exception as e:
-                    print(f"Failed to download {asset['url']}: {e}")
-                    asset['local_path'] = None
+    def _get_host_semaphore(self, url):
+        """Get the semaphore limiting concurrent downloads from a single host"""
+        host = urlparse(url).netloc
+        with self._host_lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.Semaphore(self.max_downloads_per_host)
+            return self._host_semaphores[host]
+    
+    def _assign_asset_filename(self, asset_type, asset, capture_dir, used_names):
+        """Pick a unique local filename for an asset before it is downloaded"""
+        # Generate filename - use actual URL for Next.js images to get better filenames
+        parsed_url = urlparse(asset.url)
+        filename = os.path.basename(parsed_url.path) or 'index'
+        filename = self.sanitize_filename(filename)
+        
+        # Add extension if missing
+        common_extensions = {
+            'css': ['.css'],
+            'js': ['.js'],
+            'images': ['.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.webp', '.avif'],
+            'videos': ['.mp4', '.webm', '.ogg', '.mov', '.avi'],
+            'audio': ['.mp3', '.wav', '.ogg', '.m4a', '.flac'],
+            'fonts': ['.woff', '.woff2', '.eot', '.ttf', '.otf'],
+            'documents': ['.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx']
+        }
+        
+        # Check if filename already has appropriate extension
+        has_extension = any(filename.lower().endswith(ext) for ext in common_extensions.get(asset_type, []))
+        
+        if not has_extension:
+            # Add default extension based on asset type
+            if asset_type == 'css':
+                filename += '.css'
+            elif asset_type == 'js':
+                filename += '.js'
+            elif asset_type == 'images':
+                filename += '.png'
+            elif asset_type == 'videos':
+                filename += '.mp4'
+            elif asset_type == 'audio':
+                filename += '.mp3'
+            elif asset_type == 'fonts':
+                filename += '.woff'
+            elif asset_type == 'documents':
+                filename += '.pdf'
+        
+        # Ensure unique filename. Names are reserved in discovery order so the
+        # result does not depend on which download finishes first.
+        counter = 1
+        original_filename = filename
+        while (filename in used_names or
+               (capture_dir / "assets" / asset_type / filename).exists()):
+            name, ext = os.path.splitext(original_filename)
+            filename = f"{name}_{counter}{ext}"
+            counter += 1
+        
+        used_names.add(filename)
+        return filename
+    
+    def _fetch_asset(self, url, filepath, budget=None):
+        """Download a single asset into the blob store and link it at filepath
+        
+        Returns (digest, bytes_transferred, truncated).
+        """
+        cached = self.http_cache.lookup(url)
+        
+        with self._get_host_semaphore(url):
+            response = self.session.get(url, timeout=10, headers=self.http_cache.conditional_headers(cached),
+                                        stream=True)
+            try:
+                if response.status_code == 304 and cached:
+                    # Unchanged since the last capture - reuse the cached body
+                    if self.asset_store.link(cached['digest'], filepath):
+                        self.http_cache.touch(url)
+                        return cached['digest'], 0, False
                     
-    def _rewrite_images_statically(self, soup, assets, url_mapping):
-        """Rewrite image URLs in static HTML (the approach that worked before)"""
+                    # Cached body disappeared; fall back to a full fetch
+                    self.http_cache.invalidate(url)
+                    response.close()
+                    response = self.session.get(url, timeout=10, stream=True)
+                
+                response.raise_for_status()
+                self._check_content_length(response.headers)
+                
+                digest, size, truncated = self._stream_to_store(response, filepath, budget)
+            finally:
+                response.close()
         
+        # Truncated bodies must never be served as the full resource later
+        if not truncated:
+            self.http_cache.update(url, response, digest, size)
+        return digest, size, truncated
+    
+    def _check_content_length(self, headers):
+        """Skip obviously oversized assets before reading the body"""
+        content_length = int(headers.get('Content-Length') or 0)
+        if (self.oversize_policy == 'skip' and self.max_asset_bytes is not None and
+                content_length > self.max_asset_bytes):
+            raise AssetTooLargeError(f"{content_length} bytes exceeds the {self.max_asset_bytes} byte limit")
+    
+    def _link_prefetched(self, prefetched, filepath, budget=None):
+        """Link a finished prefetch at filepath
+        
+        Returns (digest, bytes_transferred, truncated), or (None, 0, False)
+        if the prefetch failed or its blob is gone and the asset must be
+        fetched again; the bytes a vanished prefetch reserved go back to
+        budget first. Oversized assets raise AssetTooLargeError as usual.
+        """
+        future, temp_path = prefetched
         try:
-            # Group image assets by element and attribute for complex rewriting
-            element_assets = {}
-            for asset in assets['images']:
-                if asset.get('local_path') and asset.get('element'):
-                    element_id = id(asset['element'])
-                    attribute = asset.get('attribute', 'src')
+            try:
+                digest, size, truncated = future.result()
+            except AssetTooLargeError:
+                raise
+            except Exception as e:
+                print(f"Warning: Prefetch failed, fetching again: {e}")
+                return None, 0, False
+            if not self.asset_store.link(digest, filepath):
+                if budget is not None:
+                    budget.release(size)
+                return None, 0, False
+            return digest, size, truncated
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+    
+    def _stream_to_store(self, response, filepath, budget=None):
+        """Stream a response body to a temp file, then move it into the blob store
+        
+        The bytes reserved from budget are given back if no blob gets
+        stored, for example when the connection drops mid-body.
+        """
+        temp_path = self.asset_store.new_temp_path()
+        hasher = hashlib.sha256()
+        size = 0
+        truncated = False
+        
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    if not chunk:
+                        continue
                     
-                    if element_id not in element_assets:
-                        element_assets[element_id] = {'element': asset['element'], 'assets': {}}
+                    chunk, truncated = self._limit_chunk(chunk, size, budget)
+                    size += len(chunk)
+                    f.write(chunk)
+                    hasher.update(chunk)
                     
-                    if attribute not in element_assets[element_id]['assets']:
-                        element_assets[element_id]['assets'][attribute] = []
+                    if truncated:
+                        break
+            
+            digest = hasher.hexdigest()
+            self.asset_store.store(temp_path, filepath, digest)
+        except BaseException:
+            if budget is not None:
+                budget.release(size)
+            raise
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+        
+        return digest, size, truncated
                     
-                    element_assets[element_id]['assets'][attribute].append(asset)
+    def _limit_chunk(self, chunk, size, budget=None):
+        """Apply the size cap and byte budget to the next chunk of a body
+        
+        size is the number of bytes already kept. Returns the part of the
+        chunk to keep and whether the body was cut short; under the skip
+        policy an oversized body raises AssetTooLargeError instead, as does
+        one truncated to nothing, so its reference stays remote. The caller
+        releases the bytes reserved for earlier chunks.
+        """
+        allowed = len(chunk)
+        if self.max_asset_bytes is not None:
+            allowed = min(allowed, self.max_asset_bytes - size)
+        if budget is not None:
+            allowed = budget.reserve(allowed)
+        
+        if allowed < len(chunk):
+            if self.oversize_policy != 'truncate' or size + allowed == 0:
+                if budget is not None:
+                    budget.release(allowed)
+                raise AssetTooLargeError("asset exceeds the size cap or capture byte budget")
+            return chunk[:allowed], True
+        return chunk, False
+    
+    def _classify_css_url(self, url):
+        """Asset type for a URL referenced from CSS, based on its extension"""
+        extension = os.path.splitext(urlparse(url).path)[1].lower()
+        if extension in ('.woff', '.woff2', '.eot', '.ttf', '.otf'):
+            return 'fonts'
+        if extension == '.css':
+            return 'css'
+        if extension in ('.mp4', '.webm', '.ogv', '.mov'):
+            return 'videos'
+        return 'images'
+    
+    def _has_image_extension(self, url):
+        """Check whether a URL path ends in a common image extension"""
+        extension = os.path.splitext(urlparse(url).path)[1].lower()
+        return extension in ('.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp', '.avif', '.ico')
+    
+    def _process_stylesheets(self, assets, capture_dir, asset_index, progress_callback=None, state=None,
+                             cpu_timed=None):
+        """Fetch and rewrite url() and @import references in downloaded stylesheets
+        
+        Relative URLs resolve against each stylesheet's own URL. Newly found
+        assets go through the regular download engine, and imported sheets
+        are processed in turn until no new stylesheets appear. Assets the page
+        itself references may still be downloading in another stage; each
+        sheet is rewritten once they have finished.
+        """
+        stats = {}
+        processed = set()
+        
+        while True:
+            parsed, new_assets, new_index = self._parse_pending_stylesheets(assets, capture_dir, asset_index,
+                                                                            processed)
+            if not parsed:
+                break
             
-            # Process each element's assets
-            for element_id, element_data in element_assets.items():
-                element = element_data['element']
-                assets_by_attr = element_data['assets']
-                
-                for attribute, element_assets_list in assets_by_attr.items():
-                    if attribute == 'srcset':
-                        # Rebuild srcset completely
-                        self._rebuild_srcset(element, element_assets_list, url_mapping)
-                    elif any(asset.get('is_background') for asset in element_assets_list):
-                        # Handle background images
-                        self._rebuild_background_style(element, element_assets_list, url_mapping)
-                    elif any(asset.get('is_css_image') for asset in element_assets_list):
-                        # Handle CSS image references
-                        self._rebuild_css_images(element, element_assets_list, url_mapping)
-                    else:
-                        # Handle simple src/href attributes
-                        if element_assets_list:
-                            # Use the first (or only) asset for simple attributes
-                            asset = element_assets_list[0]
-                            if asset.get('local_path') and element is not None:
-                                try:
-                                    element[attribute] = asset['local_path']
-                                except Exception as e:
-                                    print(f"Warning: Failed to update {attribute} on element: {e}")
+            if new_index:
+                new_stats = self._download_assets(new_assets, capture_dir, progress_callback, new_index, state,
+                                                  cpu_timed)
+                for key, value in new_stats.items():
+                    stats[key] = stats.get(key, 0) + value
+                for asset_type, asset_list in new_assets.items():
+                    assets[asset_type].extend(asset_list)
             
-            print(f"Static image rewriting completed for {len(element_assets)} elements")
+            for sheet in parsed:
+                if state is not None:
+                    for ref_url in sheet[-1]:
+                        if ref_url:
+                            state.wait_for(ref_url)
+                self._rewrite_stylesheet(sheet, asset_index)
+        
+        return stats
+    
+    def _parse_pending_stylesheets(self, assets, capture_dir, asset_index, processed):
+        """Parse downloaded stylesheets not processed yet and record assets they add
+        
+        Returns (parsed, new_assets, new_index). Each parsed sheet is
+        (sheet_url, references, css_path, css_text, css_references, ref_urls)
+        where ref_urls holds the canonical URL of each reference, or None for
+        ones that are never rewritten.
+        """
+        pending = [
+            (canonical_url, references) for canonical_url, references in asset_index.items()
+            if references[0][0] == 'css' and references[0][1].local_path and canonical_url not in processed
+        ]
+        
+        # Parse every pending stylesheet and queue assets not seen yet
+        new_assets = {asset_type: [] for asset_type in assets}
+        new_index = {}
+        parsed = []
+        for canonical_url, references in pending:
+            processed.add(canonical_url)
+            css_path = capture_dir / references[0][1].local_path
+            try:
+                with open(css_path, 'r', encoding='utf-8', errors='surrogateescape') as f:
+                    css_text = f.read()
+            except Exception as e:
+                print(f"Warning: Failed to read stylesheet {css_path}: {e}")
+                continue
             
-        except Exception as e:
-            print(f"Warning: Error in static image rewriting: {e}")
-
-    def _inject_minimal_nextjs_override(self, soup, assets):
+            css_references = find_css_urls(css_text)
+            sheet_url = references[0][1].url
+            ref_urls = []
+            parsed.append((sheet_url, references, css_path, css_text, css_references, ref_urls))
+            
+            for reference in css_references:
+                if not reference.url or reference.url.startswith(('data:', '#')):
+                    ref_urls.append(None)
+                    continue
+                ref_url = self.canonicalize_asset_url(reference.url, sheet_url)
+                ref_urls.append(ref_url)
+                if ref_url in asset_index:
+                    continue
+                
+                asset_type = 'css' if reference.is_import else self._classify_css_url(ref_url)
+                asset = AssetRecord(
+                    url=urljoin(sheet_url, reference.url.strip()),
+                    original_url=reference.url,
+                    kind=asset_type,
+                    canonical_url=ref_url,
+                    stylesheet=sheet_url
+                )
+                new_assets[asset_type].append(asset)
+                asset_index[ref_url] = new_index[ref_url] = [(asset_type, asset)]
+        
+        return parsed, new_assets, new_index
+    
+    def _rewrite_stylesheet(self, sheet, asset_index):
+        """Point each reference in a parsed stylesheet at the local copy, relative to the sheet"""
+        sheet_url, references, css_path, css_text, css_references, ref_urls = sheet
+        css_dir = posixpath.dirname(references[0][1].local_path)
+        canonical_urls = {id(reference): ref_url for reference, ref_url in zip(css_references, ref_urls)}
+        
+        def local_url(reference):
+            ref_url = canonical_urls[id(reference)]
+            targets = asset_index.get(ref_url) if ref_url else None
+            local_path = targets[0][1].local_path if targets else None
+            return posixpath.relpath(local_path, css_dir) if local_path else None
+        
+        new_css = rewrite_css_urls(css_text, css_references, local_url)
+        if new_css != css_text:
+            content_hash = self._replace_asset_file(css_path, new_css, references[0][1].content_hash)
+            for _, asset in references:
+                asset.content_hash = content_hash
+                asset.size = css_path.stat().st_size
+    
+    def _new_download_state(self, cancel_event=None):
+        """Fresh download state for one capture"""
+        return DownloadState(ThreadPoolExecutor(max_workers=self.max_download_workers),
+                             DownloadBudget(self.capture_byte_budget), self.asset_store, self._fetch_asset,
+                             cancel_event)
+    
+    def _download_assets(self, assets, capture_dir, progress_callback=None, asset_index=None, state=None,
+                         cpu_timed=None):
+        """Download all discovered assets concurrently, fetching each unique URL once
+        
+        Assets the browser already received (state.browser_assets) are stored
+        directly and prefetched ones are linked in; only the rest are fetched
+        with requests. cpu_timed, if given, wraps each download job so the
+        CPU time of the worker threads counts towards a stage; see
+        StageTimings.cpu_timed.
+        """
+        if asset_index is None:
+            asset_index = self._build_asset_index(assets)
+        own_state = state is None
+        if own_state:
+            state = self._new_download_state()
+        
+        jobs = self._plan_downloads(asset_index, capture_dir, state)
+        stats = DownloadStats(len(jobs))
+        
+        def download_job(asset_type, canonical_url, references, filename, finished):
+            # Jobs still queued when the capture is cancelled never fetch
+            if state.cancelled():
+                finished.set()
+                raise CaptureCancelled("Capture cancelled")
+            stats.start()
+            
+            # Fetch the URL as the page spelled it; the canonical form is only a key
+            fetch_url = urldefrag(references[0][1].url)[0]
+            filepath = capture_dir / "assets" / asset_type / filename
+            try:
+                content_hash, size, truncated, source = self._obtain_asset(state, canonical_url, fetch_url, filepath)
+                snapshot = self._finish_download(references, stats, f"assets/{asset_type}/{filename}", content_hash,
+                                                 filepath.stat().st_size, size, truncated, source)
+            except Exception as e:
+                snapshot = self._fail_download(references, stats, fetch_url, e)
+            finished.set()
+            self._report_download_progress(progress_callback, stats, snapshot)
+        
+        submitted = []
+        try:
+            try:
+                self._report_download_progress(progress_callback, stats, stats.snapshot())
+                job_fn = cpu_timed(download_job) if cpu_timed else download_job
+                submitted = [(state.executor.submit(job_fn, *job), job[-1]) for job in jobs]
+                for future, _ in submitted:
+                    future.result()
+            except BaseException:
+                # Drop queued jobs rather than fetching for a capture that gave
+                # up, and mark them finished so no other stage waits on them
+                for future, finished in submitted:
+                    if future.cancel():
+                        finished.set()
+                for job in jobs[len(submitted):]:
+                    job[-1].set()
+                raise
+        finally:
+            if own_state:
+                state.close()
+        
+        return stats.summary()
+    
+    def _plan_downloads(self, asset_index, capture_dir, state):
+        """One download job per URL: (asset_type, canonical_url, references, filename, finished)
+        
+        Every filename is assigned up front so naming is deterministic. The
+        first reference to a URL decides its asset type and filename.
+        """
+        jobs = []
+        for canonical_url, references in asset_index.items():
+            asset_type, asset = references[0]
+            filename = state.reserve_name(asset_type, lambda used_names: self._assign_asset_filename(
+                asset_type, asset, capture_dir, used_names))
+            jobs.append((asset_type, canonical_url, references, filename, state.started(canonical_url)))
+        return jobs
+    
+    def _obtain_asset(self, state, canonical_url, fetch_url, filepath):
+        """Store an asset at filepath from the cheapest source that has it
+        
+        Returns (content_hash, bytes_transferred, truncated, source) where
+        source names the stats counter of a body that was not fetched here.
+        """
+        content_hash, source = self._reuse_local_copy(state, canonical_url, fetch_url, filepath)
+        if content_hash is not None:
+            return content_hash, 0, False, source
+        prefetched = state.take_prefetch(canonical_url)
+        if prefetched is not None:
+            content_hash, size, truncated = self._link_prefetched(prefetched, filepath, state.budget)
+            if content_hash is not None:
+                return content_hash, size, truncated, 'prefetched'
+        content_hash, size, truncated = self._fetch_asset(fetch_url, filepath, state.budget)
+        return content_hash, size, truncated, None
+    
+    def _reuse_local_copy(self, state, canonical_url, fetch_url, filepath):
+        """Store the browser's body of an asset, or link the baseline's copy
+        
+        Returns (content_hash, source), or (None, None) if neither is usable.
+        """
+        content_hash = self._store_recorded(state, canonical_url, filepath)
+        if content_hash is not None:
+            return content_hash, 'from_browser'
+        content_hash = self._link_from_baseline(state, canonical_url, fetch_url, filepath)
+        if content_hash is not None:
+            return content_hash, 'reused'
+        return None, None
+    
+    def _finish_download(self, references, stats, local_path, content_hash, stored_size, size, truncated, source):
+        """Point a download's references at the stored file and count it; returns a stats snapshot"""
+        self._mark_references(references, local_path, content_hash, stored_size, 'downloaded')
+        return stats.finish('downloaded', size, truncated, source)
+    
+    def _fail_download(self, references, stats, fetch_url, error):
+        """Record a download that stored nothing and count it; returns a stats snapshot"""
+        if isinstance(error, AssetTooLargeError):
+            print(f"Skipped {fetch_url}: {error}")
+            status = 'skipped'
+        else:
+            print(f"Failed to download {fetch_url}: {error}")
+            status = 'failed'
+        self._mark_references(references, None, None, None, status)
+        return stats.finish(status)
+    
+    def _report_download_progress(self, progress_callback, stats, snapshot):
+        """Report a snapshot of a download stage's counters
+        
+        Never called while holding the stats lock.
+        """
+        if progress_callback:
+            progress_callback(
+                f"📥 Downloading assets ({snapshot['completed']}/{stats.total}, "
+                f"{snapshot['in_flight']} in flight, {snapshot['failed']} failed)",
+                download_stats=snapshot, total_assets=stats.total, download_id=id(stats)
+            )
+    
+    def _store_recorded(self, state, canonical_url, filepath):
+        """Store the body the browser recorded for a URL at filepath
+        
+        Returns the content hash, or None if the asset still has to be
+        downloaded because the browser never saw it or it does not fit the
+        byte budget. A prefetch or the network path then applies the
+        oversize policy.
+        """
+        recorded = state.browser_assets.get(canonical_url)
+        granted = state.budget.reserve(recorded['size']) if recorded else 0
+        if recorded and granted == recorded['size']:
+            return self.asset_store.store(recorded['temp_path'], filepath, recorded['digest'])
+        state.budget.release(granted)
+        return None
+    
+    def _link_from_baseline(self, state, canonical_url, fetch_url, filepath):
+        """Link the baseline capture's copy of an asset at filepath
+        
+        Returns the content hash, or None if the asset has to be downloaded.
+        URLs with HTTP cache validators are revalidated instead, since a
+        conditional request is cheap and catches changes. The rest are
+        linked unverified and recorded in state.assumed_unchanged.
+        """
+        record = state.baseline.get(canonical_url)
+        if record is None or self.http_cache.lookup(fetch_url):
+            return None
+        if not self.asset_store.link(record.content_hash, filepath):
+            return None
+        state.assumed_unchanged.add(canonical_url)
+        return record.content_hash
+    
+    def _mark_references(self, references, local_path, content_hash, size, status):
+        """Record a download's outcome on every reference to its URL
+        
+        Every element referencing the URL shares the single local file.
+        """
+        for _, asset in references:
+            asset.local_path = local_path
+            asset.content_hash = content_hash
+            asset.size = size
+            asset.status = status
+    
+    def _inject_minimal_nextjs_override(self, document, url_index):
         """Inject minimal Next.js Image loader override that preserves all other JavaScript"""
         
         try:
-            # Create mapping of original URLs to local paths
-            url_mapping = {}
-            for asset in assets.get('images', []):
-                if asset.get('local_path') and asset.get('original_url'):
-                    original_url = asset['original_url']
-                    local_path = asset['local_path']
-                    
-                    # Handle Next.js image optimization URLs - extract actual URL
-                    if '/_next/image?' in original_url:
-                        actual_url = self.parse_nextjs_image_url(original_url)
-                        if actual_url and not actual_url.startswith('/_next/'):
-                            url_mapping[actual_url] = local_path
-                    elif not original_url.startswith('/_next/'):
-                        url_mapping[original_url] = local_path
+            # Image URL mappings from the shared capture index
+            url_mapping = url_index.client_mapping()
             
             if not url_mapping:
                 print("No image URL mappings for minimal Next.js override")
@@ -827,10 +2062,7 @@ This package contains all necessary data for professional-grade landing page ana
             """
             
             # Insert at the end of head to run after other scripts load
-            head = soup.find('head')
-            if head:
-                script_tag = BeautifulSoup(minimal_script, 'html.parser')
-                head.append(script_tag)
+            if document.add_to_head(minimal_script):
                 print(f"Injected minimal Next.js override script with {len(url_mapping)} mappings")
             else:
                 print("Warning: No head tag found, could not inject minimal override")
@@ -838,26 +2070,12 @@ This package contains all necessary data for professional-grade landing page ana
         except Exception as e:
             print(f"Warning: Error injecting minimal Next.js override: {e}")
 
-    def _inject_react_protection_script(self, soup, assets):
+    def _inject_react_protection_script(self, document, url_index):
         """Inject aggressive multi-layer script to bulletproof images against React interference"""
         
         try:
-            # Create clean mapping for protection script (exclude Next.js URLs to prevent React interference)
-            url_mapping = {}
-            for asset in assets.get('images', []):
-                if asset.get('local_path') and asset.get('original_url'):
-                    original_url = asset['original_url']
-                    local_path = asset['local_path']
-                    
-                    # Handle Next.js image optimization URLs - extract actual URL but don't include Next.js URLs in mapping
-                    if '/_next/image?' in original_url:
-                        actual_url = self.parse_nextjs_image_url(original_url)
-                        # Only include the clean actual URL, not the Next.js URL
-                        if actual_url and not actual_url.startswith('/_next/'):
-                            url_mapping[actual_url] = local_path
-                    elif not original_url.startswith('/_next/'):
-                        # Only include URLs that don't start with /_next/
-                        url_mapping[original_url] = local_path
+            # Image URL mappings from the shared capture index
+            url_mapping = url_index.client_mapping()
             
             if not url_mapping:
                 print("No image URL mappings for protection script")
@@ -1087,11 +2305,8 @@ This package contains all necessary data for professional-grade landing page ana
             """
             
             # Inject the script at the very beginning of head for early execution
-            head = soup.find('head')
-            if head:
-                script_tag = BeautifulSoup(protection_script, 'html.parser')
-                # Insert at the beginning of head to run before React
-                head.insert(0, script_tag)
+            # Insert at the beginning of head to run before React
+            if document.add_to_head(protection_script, at_start=True):
                 print(f"Injected aggressive React protection script with {len(url_mapping)} mappings")
             else:
                 print("Warning: No head tag found, could not inject protection script")
@@ -1099,25 +2314,12 @@ This package contains all necessary data for professional-grade landing page ana
         except Exception as e:
             print(f"Warning: Error injecting aggressive React protection script: {e}")
 
-    def _inject_image_url_fixer(self, soup, assets):
+    def _inject_image_url_fixer(self, document, url_index):
         """Inject runtime script to fix Next.js image URLs without removing any JavaScript"""
         
         try:
-            # Create mapping from Next.js URLs to local paths
-            url_mapping = {}
-            for asset in assets.get('images', []):
-                if asset.get('local_path') and asset.get('original_url'):
-                    original_url = asset['original_url']
-                    local_path = asset['local_path']
-                    
-                    # Handle Next.js image optimization URLs
-                    if '/_next/image?' in original_url:
-                        # Parse the actual image URL from Next.js optimization
-                        actual_url = self.parse_nextjs_image_url(original_url)
-                        url_mapping[original_url] = local_path
-                        url_mapping[actual_url] = local_path
-                    else:
-                        url_mapping[original_url] = local_path
+            # Image URL mappings from the shared capture index
+            url_mapping = url_index.client_mapping()
             
             if not url_mapping:
                 print("No image URL mappings to inject")
@@ -1229,10 +2431,7 @@ This package contains all necessary data for professional-grade landing page ana
             """
             
             # Inject the script into the head
-            head = soup.find('head')
-            if head:
-                script_tag = BeautifulSoup(image_fixer_script, 'html.parser')
-                head.append(script_tag)
+            if document.add_to_head(image_fixer_script):
                 print(f"Injected image URL fixer with {len(url_mapping)} mappings")
             else:
                 print("Warning: No head tag found, could not inject image fixer script")
@@ -1241,306 +2440,267 @@ This package contains all necessary data for professional-grade landing page ana
             print(f"Warning: Error injecting image URL fixer: {e}")
             # Continue without script injection if there's an error
 
-    def _modify_nextjs_loader_in_js_files(self, assets, capture_dir):
-        """Modify Next.js Image loader function directly in JavaScript files"""
+    def _modify_nextjs_loader_in_js_files(self, assets, capture_dir, url_index, timings=None):
+        """Modify Next.js Image loader function directly in JavaScript files
         
+        Files are prefiltered by a byte search and the candidates are patched
+        in parallel worker processes, whose CPU time is added to the patch_js
+        stage of timings. Returns the local paths of the modified files.
+        """
+        modified_paths = []
         try:
-            # Create URL mapping for images
-            url_mapping = {}
-            for asset in assets.get('images', []):
-                if asset.get('local_path') and asset.get('original_url'):
-                    original_url = asset['original_url']
-                    local_path = asset['local_path']
-                    
-                    # Handle Next.js image optimization URLs - extract actual URL
-                    if '/_next/image?' in original_url:
-                        actual_url = self.parse_nextjs_image_url(original_url)
-                        if actual_url and not actual_url.startswith('/_next/'):
-                            url_mapping[actual_url] = local_path
-                    elif not original_url.startswith('/_next/'):
-                        url_mapping[original_url] = local_path
+            # Image URL mappings from the shared capture index
+            url_mapping = url_index.client_mapping()
             
             if not url_mapping:
                 print("No image URL mappings for JS modification")
-                return
+                return modified_paths
             
-            # Look for JavaScript files that might contain Next.js Image loader
-            modified_files = 0
+            # Group records by file; several references can share one download
+            js_files = {}
             for asset in assets.get('js', []):
-                if asset.get('local_path'):
-                    js_file_path = capture_dir / asset['local_path']
-                    
+                if asset.local_path:
+                    js_files.setdefault(asset.local_path, []).append(asset)
+            
+            # Look for JavaScript files that might contain Next.js Image loader
+            candidates = []
+            for local_path in js_files:
+                try:
+                    if contains_loader(capture_dir / local_path):
+                        print(f"Found Next.js Image loader in {local_path}")
+                        candidates.append(local_path)
+                except Exception as e:
+                    print(f"Warning: Failed to read JS file {local_path}: {e}")
+            
+            if candidates:
+                url_mapping_js = json.dumps(url_mapping)
+                if self._js_executor is None:
+                    raise RuntimeError("JS loader patching is not enabled")
+                jobs = {}
+                for local_path in candidates:
+                    temp_path = self.asset_store.new_temp_path()
+                    future = self._js_executor.submit(patch_nextjs_loader_timed, str(capture_dir / local_path),
+                                                      str(temp_path), url_mapping_js)
+                    jobs[local_path] = (future, temp_path)
+                
+                for local_path, (future, temp_path) in jobs.items():
                     try:
-                        # Read the JavaScript file
-                        with open(js_file_path, 'r', encoding='utf-8') as f:
-                            js_content = f.read()
+                        matched, worker_cpu = future.result()
+                        if timings is not None:
+                            timings.add_cpu('patch_js', worker_cpu)
+                        if matched is None:
+                            continue
                         
-                        # Check if this file contains the Next.js Image loader pattern
-                        # Look for the specific loader function signature
-                        if ('e.path+"?url="+encodeURIComponent(n)+"&w="+r+"&q="' in js_content or
-                            'return e.path+"?url="+encodeURIComponent(n)+"&w="+r+"&q="+(i||75)' in js_content):
-                            
-                            print(f"Found Next.js Image loader in {asset['local_path']}")
-                            
-                            # Create the replacement loader function
-                            url_mapping_js = json.dumps(url_mapping)
-                            replacement_function = f'''function n(t){{
-                                const imageMapping = {url_mapping_js};
-                                const originalSrc = t.src;
-                                
-                                // Return local path if we have a mapping
-                                if (imageMapping[originalSrc]) {{
-                                    console.log('🎯 Using local asset:', originalSrc, '->', imageMapping[originalSrc]);
-                                    return imageMapping[originalSrc];
-                                }}
-                                
-                                // For any other URLs, return as-is (don't create /_next/image URLs)
-                                return originalSrc;
-                            }}'''
-                            
-                            # Replace the original loader function
-                            # Pattern: function n(t){let{config:e,src:n,width:r,quality:i}=t;return e.path+"?url="+encodeURIComponent(n)+"&w="+r+"&q="+(i||75)}
-                            import re
-                            pattern = r'function n\(t\)\{let\{config:e,src:n,width:r,quality:i\}=t;return e\.path\+"\?url="\+encodeURIComponent\(n\)\+"\&w="\+r\+"\&q="\+\(i\|\|75\)\}'
-                            
-                            if re.search(pattern, js_content):
-                                modified_content = re.sub(pattern, replacement_function, js_content)
-                                
-                                # Write the modified content back
-                                with open(js_file_path, 'w', encoding='utf-8') as f:
-                                    f.write(modified_content)
-                                
-                                modified_files += 1
-                                print(f"✅ Modified Next.js loader in {asset['local_path']}")
-                            else:
-                                # Try alternative pattern matching
-                                alt_pattern = r'return e\.path\+"\?url="\+encodeURIComponent\(n\)\+"\&w="\+r\+"\&q="\+\(i\|\|75\)'
-                                if re.search(alt_pattern, js_content):
-                                    # Replace just the return statement
-                                    replacement_return = f'''const imageMapping = {url_mapping_js};
-                                    const originalSrc = n;
-                                    if (imageMapping[originalSrc]) {{
-                                        console.log('🎯 Using local asset:', originalSrc, '->', imageMapping[originalSrc]);
-                                        return imageMapping[originalSrc];
-                                    }}
-                                    return originalSrc'''
-                                    
-                                    modified_content = re.sub(alt_pattern, replacement_return, js_content)
-                                    
-                                    with open(js_file_path, 'w', encoding='utf-8') as f:
-                                        f.write(modified_content)
-                                    
-                                    modified_files += 1
-                                    print(f"✅ Modified Next.js loader (alt pattern) in {asset['local_path']}")
-                                
+                        # Store the patched script as its own blob; the original
+                        # is freed unless the HTTP cache or another capture links it
+                        js_file_path = capture_dir / local_path
+                        content_hash = self._replace_with_temp_file(js_file_path, temp_path,
+                                                                    js_files[local_path][0].content_hash)
+                        for asset in js_files[local_path]:
+                            asset.content_hash = content_hash
+                            asset.size = js_file_path.stat().st_size
+                        
+                        modified_paths.append(local_path)
+                        suffix = " (alt pattern)" if matched == 'return' else ""
+                        print(f"✅ Modified Next.js loader{suffix} in {local_path}")
                     except Exception as e:
-                        print(f"Warning: Failed to modify JS file {asset['local_path']}: {e}")
+                        print(f"Warning: Failed to modify JS file {local_path}: {e}")
+                        if temp_path.exists():
+                            os.unlink(temp_path)
             
-            if modified_files > 0:
-                print(f"Modified Next.js loader in {modified_files} JavaScript files with {len(url_mapping)} URL mappings")
+            if modified_paths:
+                print(f"Modified Next.js loader in {len(modified_paths)} JavaScript files with {len(url_mapping)} URL mappings")
             else:
                 print("No JavaScript files with Next.js Image loader found to modify")
                 
         except Exception as e:
             print(f"Warning: Error modifying Next.js loader in JS files: {e}")
-
-    def _rewrite_html(self, soup, assets, capture_dir):
-        """Rewrite HTML to use local paths"""
-        
-        # Simple approach: Static rewriting + minimal Next.js image loader override
-        # This preserves all JavaScript functionality while fixing only image loading
-        
-        # Create URL mapping for static rewriting
-        url_mapping = self.create_url_mapping(assets)
-        
-        # Do static image rewriting (this works and doesn't interfere with React)
-        self._rewrite_images_statically(soup, assets, url_mapping)
-        
-        # Add minimal Next.js image loader override (surgical fix)
-        self._inject_minimal_nextjs_override(soup, assets)
         
-        # Update CSS links
-        for asset in assets['css']:
-            if asset.get('local_path') and asset.get('element') is not None:
-                try:
-                    asset['element']['href'] = asset['local_path']
-                except Exception as e:
-                    print(f"Warning: Failed to update CSS element: {e}")
-        
-        # Update JS scripts
-        for asset in assets['js']:
-            if asset.get('local_path') and asset.get('element') is not None:
-                try:
-                    asset['element']['src'] = asset['local_path']
-                except Exception as e:
-                    print(f"Warning: Failed to update JS element: {e}")
+        return modified_paths
+
+    def _rewrite_targets(self, assets, elements):
+        """Group asset records by element, with the places each must be rewritten
         
-        # Update videos
-        for asset in assets['videos']:
-            if asset.get('local_path') and asset.get('element') is not None:
-                try:
-                    attribute = asset.get('attribute', 'src')
-                    asset['element'][attribute] = asset['local_path']
-                except Exception as e:
-                    print(f"Warning: Failed to update video element: {e}")
+        A target is an attribute name, 'style' for inline style attributes,
+        or None for the text of a <style> element.
+        """
+        targets = {}
+        for asset_list in assets.values():
+            for asset in asset_list:
+                element = elements.get(asset.element_id)
+                if element is None or not asset.local_path:
+                    continue
+                
+                entry = targets.setdefault(asset.element_id, (element, set()))
+                entry[1].add(asset.attribute)
+        return targets.values()
+    
+    def _rewrite_srcset(self, srcset, local_url):
+        """Rewrite each candidate of a srcset, dropping ones without a local copy"""
+        candidates = []
+        for item in srcset.split(','):
+            parts = item.strip().split()
+            if not parts:
+                continue
+            local_path = local_url(parts[0])
+            if local_path:
+                candidates.append(' '.join([local_path] + parts[1:]))
+        # Leave the attribute alone if nothing was downloaded
+        return ', '.join(candidates) if candidates else srcset
+    
+    def _rewrite_css_text(self, css_text, local_url):
+        """Rewrite url() references in a CSS fragment in one pass"""
+        return rewrite_css_urls(css_text, find_css_urls(css_text), lambda reference: local_url(reference.url))
+    
+    def _rewrite_html(self, document, assets, elements, capture_dir, url_index):
+        """Rewrite HTML to use local paths
         
-        # Update audio
-        for asset in assets['audio']:
-            if asset.get('local_path') and asset.get('element') is not None:
-                try:
-                    attribute = asset.get('attribute', 'src')
-                    asset['element'][attribute] = asset['local_path']
-                except Exception as e:
-                    print(f"Warning: Failed to update audio element: {e}")
+        Looks every reference up in the capture's URL index and visits each
+        referencing element once, so the cost is linear in the number of
+        references.
+        """
+        local_url = url_index.lookup
         
-        # Update fonts
-        for asset in assets['fonts']:
-            if asset.get('local_path') and asset.get('element') is not None:
+        rewritten = 0
+        for element, targets in self._rewrite_targets(assets, elements):
+            for target in targets:
                 try:
-                    if asset.get('is_css_font'):
-                        # Update font references in CSS
-                        css_content = asset['element'].string
+                    if target is None:
+                        css_content = document.text(element)
                         if css_content:
-                            new_css = re.sub(
-                                re.escape(asset['original_url']),
-                                asset['local_path'],
-                                css_content
-                            )
-                            asset['element'].string = new_css
+                            document.set_text(element, self._rewrite_css_text(css_content, local_url))
+                    elif target == 'style':
+                        document.set(element, 'style',
+                                     self._rewrite_css_text(document.get(element, 'style') or '', local_url))
+                    elif target == 'srcset':
+                        document.set(element, 'srcset',
+                                     self._rewrite_srcset(document.get(element, 'srcset') or '', local_url))
                     else:
-                        attribute = asset.get('attribute', 'href')
-                        asset['element'][attribute] = asset['local_path']
+                        local_path = local_url(document.get(element, target))
+                        if local_path:
+                            document.set(element, target, local_path)
                 except Exception as e:
-                    print(f"Warning: Failed to update font element: {e}")
+                    print(f"Warning: Failed to update {target or 'CSS'} on <{document.tag_name(element)}>: {e}")
+            rewritten += 1
         
-        # Update documents
-        for asset in assets['documents']:
-            if asset.get('local_path') and asset.get('element') is not None:
-                try:
-                    attribute = asset.get('attribute', 'href')
-                    asset['element'][attribute] = asset['local_path']
-                except Exception as e:
-                    print(f"Warning: Failed to update document element: {e}")
+        print(f"Rewrote asset references on {rewritten} elements")
         
-        print("Simplified approach: Static rewriting + minimal Next.js override completed")
+        # Add minimal Next.js image loader override (surgical fix)
+        self._inject_minimal_nextjs_override(document, url_index)
         
         # Save HTML
         html_path = capture_dir / "index.html"
         with open(html_path, 'w', encoding='utf-8') as f:
-            f.write(str(soup))
+            f.write(document.serialize())
     
-    def _rebuild_srcset(self, element, assets, url_mapping):
-        """Rebuild srcset attribute completely using local paths"""
-        current_srcset = element.get('srcset', '')
-        if not current_srcset:
-            return
+    def _write_asset_manifest(self, capture_dir, assets):
+        """Record which blob backs each downloaded asset in the capture"""
+        manifest = {}
+        for asset_list in assets.values():
+            for asset in asset_list:
+                if asset.local_path and asset.content_hash:
+                    manifest[asset.local_path] = asset.content_hash
         
-        # Parse current srcset to preserve descriptors (1x, 2x, width descriptors)
-        srcset_items = []
-        for item in current_srcset.split(','):
-            item = item.strip()
-            if not item:
-                continue
-            
-            parts = item.split()
-            if not parts:
-                continue
-            
-            original_url = parts[0]
-            descriptor = ' '.join(parts[1:]) if len(parts) > 1 else ''
-            
-            # Find matching local path using URL mapping
-            local_path = None
-            
-            # Try direct match first
-            if original_url in url_mapping:
-                local_path = url_mapping[original_url]
-            else:
-                # Try normalized version
-                normalized_url = self.normalize_url_for_matching(original_url)
-                if normalized_url in url_mapping:
-                    local_path = url_mapping[normalized_url]
-                else:
-                    # Try to find by matching against asset original URLs
-                    for asset in assets:
-                        if (asset['original_url'] == original_url or 
-                            self.normalize_url_for_matching(asset['original_url']) == normalized_url):
-                            local_path = asset['local_path']
-                            break
-            
-            if local_path:
-                if descriptor:
-                    srcset_items.append(f"{local_path} {descriptor}")
-                else:
-                    srcset_items.append(local_path)
-        
-        # Set the rebuilt srcset
-        if srcset_items:
-            element['srcset'] = ', '.join(srcset_items)
-    
-    def _rebuild_background_style(self, element, assets, url_mapping):
-        """Rebuild background-image style property"""
-        style = element.get('style', '')
-        for asset in assets:
-            if asset.get('is_background'):
-                # Replace background image URL in style
-                new_style = re.sub(
-                    r'background-image:\s*url\(["\']?[^"\']+["\']?\)',
-                    f'background-image: url("{asset["local_path"]}")',
-                    style
-                )
-                element['style'] = new_style
-                break
+        with open(capture_dir / "asset-manifest.json", 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
     
-    def _rebuild_css_images(self, element, assets, url_mapping):
-        """Rebuild CSS image references"""
-        for asset in assets:
-            if asset.get('is_css_image'):
-                css_content = element.string
-                if css_content:
-                    # Use both original and normalized URL for replacement
-                    original_url = asset['original_url']
-                    normalized_url = self.normalize_url_for_matching(original_url)
-                    
-                    new_css = css_content
-                    new_css = re.sub(re.escape(original_url), asset['local_path'], new_css)
-                    new_css = re.sub(re.escape(normalized_url), asset['local_path'], new_css)
-                    
-                    element.string = new_css
-            
-    def get_all_captures(self):
-        """Get list of all captures"""
-        captures = []
-        if not self.base_dir.exists():
-            return captures
-            
-        for folder in self.base_dir.iterdir():
-            if folder.is_dir():
-                metadata_path = folder / "metadata.json"
-                if metadata_path.exists():
-                    try:
-                        with open(metadata_path, 'r') as f:
-                            metadata = json.load(f)
-                        captures.append(metadata)
-                    except:
-                        pass
-        
-        # Sort by capture time (newest first)
-        captures.sort(key=lambda x: x.get('capture_time', ''), reverse=True)
-        return captures
-        
-    def create_zip(self, folder_name):
-        """Create ZIP file of capture"""
+    def _write_asset_records(self, capture_dir, assets):
+        """Persist every asset record of the capture, including failed and skipped ones"""
+        records = [asset.to_dict() for asset_list in assets.values() for asset in asset_list]
+        with open(capture_dir / "asset-records.json", 'w') as f:
+            json.dump(records, f, indent=2)
+    
+    def _replace_asset_file(self, file_path, content, old_digest=None):
+        """Store new content for an asset as its own blob and return the digest
+        
+        old_digest is the blob the file linked to before; it is freed if
+        nothing else references it any more.
+        """
+        # Assets are hard links into the blob store, so writing in place would
+        # change the content for every capture sharing the blob
+        temp_path = self.asset_store.new_temp_path()
+        try:
+            with open(temp_path, 'w', encoding='utf-8', errors='surrogateescape') as f:
+                f.write(content)
+        except Exception:
+            temp_path.unlink(missing_ok=True)
+            raise
+        return self._replace_with_temp_file(file_path, temp_path, old_digest)
+    
+    def _replace_with_temp_file(self, file_path, temp_path, old_digest=None):
+        """Store a temp file as the new content of an asset and return the digest
+        
+        The new blob is linked next to the asset and renamed over it, so the
+        capture keeps the old file if storing fails. old_digest is freed
+        afterwards if nothing else references it.
+        """
+        staged_path = file_path.with_name(f".{file_path.name}.{temp_path.name}")
+        try:
+            digest = self.asset_store.store(temp_path, staged_path)
+            os.replace(staged_path, file_path)
+            # Renaming onto another link to the same blob leaves both in place
+            staged_path.unlink(missing_ok=True)
+        except Exception:
+            temp_path.unlink(missing_ok=True)
+            staged_path.unlink(missing_ok=True)
+            raise
+        if old_digest and old_digest != digest:
+            self.asset_store.release([old_digest])
+        return digest
+    
+    def delete_capture(self, folder_name):
+        """Delete a capture and free blobs no other capture references"""
         capture_dir = self.base_dir / folder_name
-        zip_path = capture_dir.with_suffix('.zip')
+        # Never treat the blob store (or anything outside base_dir) as a capture
+        if folder_name.startswith('.') or not capture_dir.is_dir():
+            return False
         
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for file_path in capture_dir.rglob('*'):
-                if file_path.is_file():
-                    arcname = file_path.relative_to(capture_dir)
-                    zipf.write(file_path, arcname)
-                    
-        return zip_path
+        digests = []
+        manifest_path = capture_dir / "asset-manifest.json"
+        if manifest_path.exists():
+            try:
+                with open(manifest_path, 'r') as f:
+                    digests = list(json.load(f).values())
+            except Exception as e:
+                print(f"Warning: Failed to read asset manifest for {folder_name}: {e}")
+        
+        shutil.rmtree(capture_dir)
+        self.catalog.remove(folder_name)
+        self.asset_store.release(digests)
+        return True
+    
+    def get_all_captures(self, domain=None, since=None, until=None, status='completed', limit=None, offset=0):
+        """Get list of captures from the catalog (newest first)"""
+        return self.catalog.query(domain=domain, since=since, until=until, status=status,
+                                  limit=limit, offset=offset)
+    
+    def count_captures(self, domain=None, since=None, until=None, status='completed'):
+        """Count captures in the catalog matching the filters"""
+        return self.catalog.count(domain=domain, since=since, until=until, status=status)
+    
+    def get_latest_capture(self):
+        """Get the most recent completed capture, or None"""
+        captures = self.get_all_captures(limit=1)
+        return captures[0] if captures else None
+        
+    def export_zip(self, folder_name):
+        """ZIP export of a capture, without temp files next to the capture
+        
+        Returns (archive, chunks): an open cached archive file, or an
+        iterator generating the archive on the fly, which is cached as it
+        is streamed when the zip cache is enabled.
+        """
+        # The analysis package is part of the export
+        capture_dir = self.ensure_analysis_package(folder_name).parent
+        
+        if self.zip_cache is None:
+            return None, iter_zip(capture_dir)
+        
+        key = capture_content_hash(capture_dir)
+        archive = self.zip_cache.open(key)
+        if archive is not None:
+            return archive, None
+        return None, self.zip_cache.store_while_streaming(key, iter_zip(capture_dir))
 
 
 if __name__ == "__main__":
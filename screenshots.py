@@ -0,0 +1,141 @@
+import io
+import struct
+import zlib
+from PIL import Image, ImageChops
+
+
+# Returns the full page size for planning screenshot tiles
+PAGE_SIZE_SCRIPT = """
+() => ({
+    width: Math.max(document.documentElement.scrollWidth, window.innerWidth),
+    height: Math.max(document.documentElement.scrollHeight, document.body ? document.body.scrollHeight : 0)
+})
+"""
+
+# Pillow format name, file extension, mimetype and the tallest screenshot
+# saved in each format. PNGs are written a tile at a time; JPEG and WebP
+# need the whole page in memory (about 94 MB at 1920x16383), so they are
+# capped at the WebP limit.
+SCREENSHOT_FORMATS = {
+    'png': ('PNG', '.png', 'image/png', 65500),
+    'jpeg': ('JPEG', '.jpg', 'image/jpeg', 16383),
+    'webp': ('WEBP', '.webp', 'image/webp', 16383),
+}
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+THUMBNAIL_NAME = "thumbnail.jpg"
+
+
+def screenshot_clips(width, height, fmt='png', max_height=None, tile_height=8000):
+    """Clip rectangles covering the page top to bottom, tile_height pixels at a time
+
+    Tall pages are captured in tiles to stay within the browser's texture
+    limits. The page is cut off at max_height and at the tallest image the
+    output format supports. Returns (clips, truncated).
+    """
+    limit = SCREENSHOT_FORMATS[fmt][3]
+    if max_height:
+        limit = min(limit, max_height)
+    truncated = height > limit
+    height = min(height, limit)
+
+    clips = []
+    for top in range(0, max(height, 1), tile_height):
+        clips.append({'x': 0, 'y': top, 'width': width, 'height': min(tile_height, height - top) or 1})
+    return clips, truncated
+
+
+def save_screenshot(tiles, capture_dir, fmt='png', quality=80, thumbnail_width=480):
+    """Stitch PNG tiles into the capture's screenshot and write its thumbnail
+
+    Returns the screenshot metadata: file name, format, size and thumbnail.
+    """
+    pillow_format, extension, _, _ = SCREENSHOT_FORMATS[fmt]
+    # Only the PNG headers are read here; tiles are decoded one at a time below
+    sizes = [Image.open(io.BytesIO(tile)).size for tile in tiles]
+    width = max(tile_width for tile_width, _ in sizes)
+    height = sum(tile_height for _, tile_height in sizes)
+
+    filename = f"screenshot{extension}"
+    if fmt == 'png' and len(tiles) == 1:
+        # The browser's PNG is written as is
+        (capture_dir / filename).write_bytes(tiles[0])
+    elif fmt == 'png':
+        write_png_tiles(tiles, capture_dir / filename, width, height)
+    else:
+        image = Image.new('RGB', (width, height), 'white')
+        top = 0
+        for tile in tiles:
+            with Image.open(io.BytesIO(tile)) as tile_image:
+                image.paste(tile_image, (0, top))
+                top += tile_image.height
+        if fmt == 'jpeg':
+            options = {'quality': quality, 'optimize': True, 'progressive': True}
+        else:
+            options = {'quality': quality, 'method': 4}
+        image.save(capture_dir / filename, pillow_format, **options)
+
+    # The thumbnail only shows the top of the page
+    with Image.open(io.BytesIO(tiles[0])) as first_tile:
+        save_thumbnail(first_tile, capture_dir / THUMBNAIL_NAME, thumbnail_width)
+
+    return {
+        'file': filename,
+        'format': fmt,
+        'width': width,
+        'height': height,
+        'tiles': len(tiles),
+        'thumbnail': THUMBNAIL_NAME
+    }
+
+
+def write_png_tiles(tiles, path, width, height, compress_level=6, band_height=512):
+    """Write PNG tiles stacked top to bottom as one RGB PNG
+
+    Tiles are decoded one at a time and their rows filtered and streamed
+    through a single zlib stream band_height rows at a time, so memory use
+    is bounded by one decoded tile rather than the whole page. Narrower
+    tiles are padded with white on the right.
+    """
+    compressor = zlib.compressobj(compress_level)
+    stride = width * 3
+    # The row above the first one counts as black for the Up filter
+    row_above = Image.new('RGB', (width, 1))
+    with open(path, 'wb') as f:
+        f.write(PNG_SIGNATURE)
+        f.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        for tile in tiles:
+            with Image.open(io.BytesIO(tile)) as tile_image:
+                image = Image.new('RGB', (width, tile_image.height), 'white')
+                image.paste(tile_image, (0, 0))
+            for top in range(0, image.height, band_height):
+                band = image.crop((0, top, width, min(top + band_height, image.height)))
+                # Up filter: each row minus the row above it, which compresses
+                # page screenshots far better than unfiltered rows
+                above = Image.new('RGB', band.size)
+                above.paste(row_above, (0, 0))
+                above.paste(band.crop((0, 0, width, band.height - 1)), (0, 1))
+                row_above = band.crop((0, band.height - 1, width, band.height))
+                raw = ImageChops.subtract_modulo(band, above).tobytes()
+                # Each row starts with its filter type, 2 for Up
+                rows = b''.join(b'\x02' + raw[offset:offset + stride] for offset in range(0, len(raw), stride))
+                data = compressor.compress(rows)
+                if data:
+                    f.write(_png_chunk(b'IDAT', data))
+        f.write(_png_chunk(b'IDAT', compressor.flush()))
+        f.write(_png_chunk(b'IEND', b''))
+
+
+def _png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def save_thumbnail(image, path, width=480):
+    """Save a JPEG thumbnail of the top of a page screenshot in a 16:10 frame"""
+    crop_height = min(image.height, image.width * 10 // 16)
+    thumbnail = image.crop((0, 0, image.width, crop_height))
+    if thumbnail.mode != 'RGB':
+        thumbnail = thumbnail.convert('RGB')
+    thumbnail.thumbnail((width, width * 10 // 16), Image.LANCZOS)
+    thumbnail.save(path, 'JPEG', quality=80, optimize=True)
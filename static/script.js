@@ -1,6 +1,6 @@
 // Global variables
 let currentThreadId = null;
-let progressInterval = null;
+let progressSource = null;
 
 // DOM elements
 const urlInput = document.getElementById('urlInput');
@@ -71,8 +71,8 @@ async function startCapture() {
         
         currentThreadId = data.thread_id;
         
-        // Start polling for progress
-        startProgressPolling();
+        // Follow progress as the server pushes it
+        startProgressStream();
         
     } catch (error) {
         console.error('Error starting capture:', error);
@@ -120,52 +120,54 @@ function hideProgress() {
     progressFill.style.width = '0%';
 }
 
-// Start polling for progress updates
-function startProgressPolling() {
-    if (progressInterval) {
-        clearInterval(progressInterval);
-    }
+// Subscribe to progress updates for the current capture
+function startProgressStream() {
+    stopProgressStream();
+    
+    const threadId = currentThreadId;
+    progressSource = new EventSource(`/api/progress/${threadId}/stream`);
     
-    progressInterval = setInterval(async () => {
-        if (!currentThreadId) return;
+    progressSource.addEventListener('progress', (event) => {
+        const progress = JSON.parse(event.data);
+        updateProgress(progress);
         
-        try {
-            const response = await fetch(`/api/progress/${currentThreadId}`);
-            const progress = await response.json();
-            
-            updateProgress(progress);
+        if (progress.status === 'completed' || progress.status === 'error' || progress.status === 'cancelled') {
+            stopProgressStream();
+            currentThreadId = null;
+            setLoadingState(false);
             
-            if (progress.status === 'completed' || progress.status === 'error') {
-                stopProgressPolling();
-                setLoadingState(false);
-                
-                if (progress.status === 'completed') {
-                    hideProgress();
-                    showSuccess();
-                    loadCaptures(); // Refresh captures list
-                } else {
-                    hideProgress();
-                    alert('Capture failed: ' + progress.message);
-                }
+            if (progress.status === 'completed') {
+                hideProgress();
+                showSuccess();
+                loadCaptures(); // Refresh captures list
+            } else if (progress.status === 'cancelled') {
+                hideProgress();
+            } else {
+                hideProgress();
+                alert('Capture failed: ' + progress.message);
             }
-            
-        } catch (error) {
-            console.error('Error polling progress:', error);
-            stopProgressPolling();
+        }
+    });
+    
+    progressSource.onerror = () => {
+        // The browser reconnects on its own unless the server refused the stream
+        if (progressSource && progressSource.readyState === EventSource.CLOSED) {
+            console.error('Progress stream closed');
+            stopProgressStream();
+            currentThreadId = null;
             setLoadingState(false);
             hideProgress();
-            alert('Error checking progress: ' + error.message);
+            alert('Error checking progress: connection lost');
         }
-    }, 1000); // Poll every second
+    };
 }
 
-// Stop progress polling
-function stopProgressPolling() {
-    if (progressInterval) {
-        clearInterval(progressInterval);
-        progressInterval = null;
+// Stop following progress updates
+function stopProgressStream() {
+    if (progressSource) {
+        progressSource.close();
+        progressSource = null;
     }
-    currentThreadId = null;
 }
 
 // Update progress display
@@ -174,17 +176,8 @@ function updateProgress(progress) {
         progressText.textContent = progress.message;
     }
     
-    // Update progress bar based on status
-    let percentage = 10;
-    if (progress.message) {
-        if (progress.message.includes('Loading')) percentage = 20;
-        else if (progress.message.includes('Extracting')) percentage = 30;
-        else if (progress.message.includes('Discovering')) percentage = 40;
-        else if (progress.message.includes('Downloading')) percentage = 70;
-        else if (progress.message.includes('Rewriting')) percentage = 90;
-        else if (progress.message.includes('completed')) percentage = 100;
-    }
-    
+    // The server estimates how far along the capture is
+    const percentage = Math.max(progress.percent || 0, 10);
     progressFill.style.width = percentage + '%';
 }
 
@@ -224,6 +217,7 @@ function updateCapturesList(captures) {
     
     capturesList.innerHTML = captures.map(capture => `
         <div class="capture-item" data-folder="${capture.folder_name}">
+            <img class="capture-thumbnail" src="/thumbnail/${capture.folder_name}" alt="" loading="lazy" width="480" height="300" onerror="this.remove()">
             <div class="capture-info">
                 <div class="capture-url">${capture.original_url}</div>
                 <div class="capture-time">${formatDateTime(capture.capture_time)}</div>
@@ -418,7 +412,5 @@ document.addEventListener('click', function(e) {
 
 // Handle window beforeunload
 window.addEventListener('beforeunload', function() {
-    if (progressInterval) {
-        clearInterval(progressInterval);
-    }
+    stopProgressStream();
 });
\ No newline at end of file
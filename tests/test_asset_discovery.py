@@ -0,0 +1,149 @@
+from pathlib import Path
+
+import pytest
+
+from asset_records import ElementTable
+from html_document import parse_html
+from page_cloner import WebsiteCloner
+
+
+BASE_URL = 'https://example.com/page/'
+
+BUNDLED_CAPTURE = Path(__file__).parent.parent / "captured_sites" / "slideshots.com_2025_07_19_23_09_28" / "index.html"
+
+INLINE_CSS_PAGE = """<html><head>
+<style>@import url(theme.css); @import "print sheet.css"; body{background:url(img/a\\)b.png)}</style>
+</head><body><div style="background:url('img/c d.png')"></div></body></html>"""
+
+
+@pytest.fixture
+def cloner(tmp_path):
+    cloner = WebsiteCloner(base_dir=str(tmp_path / "captures"))
+    yield cloner
+    cloner.close()
+
+
+def discover(cloner, html, engine='soup'):
+    document = parse_html(html, engine)
+    assets = cloner._new_asset_lists()
+    elements = ElementTable()
+    asset_index = cloner._discover_assets(document, BASE_URL, assets, elements)
+    return document, assets, elements, asset_index
+
+
+def rewrite(cloner, tmp_path, document, assets, elements):
+    """Give every asset a local path, rewrite the page and return the saved HTML"""
+    for asset_list in assets.values():
+        for asset in asset_list:
+            asset.local_path = f"assets/{asset.kind}/{asset.url.rsplit('/', 1)[1]}"
+    url_index = cloner._build_url_index(assets, BASE_URL)
+    cloner._rewrite_html(document, assets, elements, tmp_path, url_index)
+    return (tmp_path / "index.html").read_text()
+
+
+@pytest.mark.parametrize('engine', ['soup', 'lxml'])
+def test_inline_style_imports_are_stylesheets(cloner, engine):
+    _, assets, _, _ = discover(cloner, INLINE_CSS_PAGE, engine)
+    assert [asset.url for asset in assets['css']] == ['https://example.com/page/theme.css',
+                                                      'https://example.com/page/print sheet.css']
+    assert [asset.url for asset in assets['images']] == ['https://example.com/page/img/c d.png',
+                                                         'https://example.com/page/img/a)b.png']
+
+
+@pytest.mark.parametrize('engine', ['soup', 'lxml'])
+def test_inline_css_is_rewritten_to_quoted_local_urls(cloner, tmp_path, engine):
+    html = rewrite(cloner, tmp_path, *discover(cloner, INLINE_CSS_PAGE, engine)[:3])
+    assert ('@import url("assets/css/theme.css"); @import "assets/css/print sheet.css"; '
+            'body{background:url("assets/images/a)b.png")}') in html
+    assert "url('assets/images/c d.png')" in html
+
+
+DUPLICATES_PAGE = """<html><head><link rel="stylesheet" href="/page/site.css"></head><body>
+<img src="img/a.png"><img src="https://example.com/page/img/a.png#top" data-src="img/a.png">
+<link rel="stylesheet" href="site.css"><img src="img/b.png?w=2&h=1"><img src="img/b.png?h=1&w=2">
+</body></html>"""
+
+
+def test_references_to_one_url_share_an_index_entry(cloner):
+    _, _, _, asset_index = discover(cloner, DUPLICATES_PAGE)
+    assert {url: len(references) for url, references in asset_index.items()} == {
+        'https://example.com/page/site.css': 2,
+        'https://example.com/page/img/a.png': 3,
+        'https://example.com/page/img/b.png?h=1&w=2': 2,
+    }
+
+
+
+def fake_fetch(cloner, fetched):
+    """Stand-in for _fetch_asset that stores the URL as the body and records the fetch"""
+    def fetch(url, filepath, budget=None):
+        fetched.append(url)
+        temp_path = cloner.asset_store.new_temp_path()
+        temp_path.write_bytes(url.encode())
+        return cloner.asset_store.store(temp_path, filepath), len(url), False
+    return fetch
+
+
+def test_duplicates_are_downloaded_once(cloner, monkeypatch):
+    _, assets, _, asset_index = discover(cloner, DUPLICATES_PAGE)
+    fetched = []
+    monkeypatch.setattr(cloner, '_fetch_asset', fake_fetch(cloner, fetched))
+    capture_dir = cloner.create_capture_folder(BASE_URL)
+    stats = cloner._download_assets(assets, capture_dir, asset_index=asset_index)
+
+    # The first spelling of each URL is the one fetched
+    assert sorted(fetched) == sorted(references[0][1].url for references in asset_index.values())
+    assert (stats['completed'], stats['failed']) == (3, 0)
+    for references in asset_index.values():
+        assert len({asset.local_path for _, asset in references}) == 1
+        assert (capture_dir / references[0][1].local_path).exists()
+
+
+REWRITE_PAGE = """<html><head><link rel="stylesheet" href="site.css"></head><body>
+<img src="img/a.png" data-src="img/b.png" srcset="img/a.png 1x, img/c.png 2x">
+<img src="img/a.png"><div style="background:url(img/b.png)"></div><img src="img/missing.png">
+</body></html>"""
+
+
+@pytest.mark.parametrize('engine', ['soup', 'lxml'])
+def test_each_element_is_rewritten_once_with_all_its_targets(cloner, tmp_path, engine):
+    document, assets, elements, _ = discover(cloner, REWRITE_PAGE, engine)
+    for asset in assets['images']:
+        if 'missing' not in asset.url:
+            asset.local_path = f"assets/images/{asset.url.rsplit('/', 1)[1]}"
+    assets['css'][0].local_path = 'assets/css/site.css'
+
+    targets = sorted(sorted(attributes) for _, attributes in cloner._rewrite_targets(assets, elements))
+    assert targets == [['data-src', 'src', 'srcset'], ['href'], ['src'], ['style']]
+
+    cloner._rewrite_html(document, assets, elements, tmp_path, cloner._build_url_index(assets, BASE_URL))
+    html = (tmp_path / "index.html").read_text()
+    assert 'href="assets/css/site.css"' in html
+    assert html.count('src="assets/images/a.png"') == 2
+    assert 'data-src="assets/images/b.png"' in html
+    assert 'srcset="assets/images/a.png 1x, assets/images/c.png 2x"' in html
+    assert 'url("assets/images/b.png")' in html
+    # References without a local copy stay remote
+    assert 'src="img/missing.png"' in html
+
+
+def discovered(assets):
+    return [(kind, asset.url, asset.original_url, asset.attribute)
+            for kind, asset_list in assets.items() for asset in asset_list]
+
+
+@pytest.mark.skipif(not BUNDLED_CAPTURE.exists(), reason='bundled capture not present')
+def test_engines_agree_on_the_bundled_capture(cloner, tmp_path):
+    html = BUNDLED_CAPTURE.read_text(encoding='utf-8')
+    results = {}
+    for engine in ('soup', 'lxml'):
+        document, assets, elements, asset_index = discover(cloner, html, engine)
+        output_dir = tmp_path / engine
+        output_dir.mkdir()
+        rewritten = rewrite(cloner, output_dir, document, assets, elements)
+        # Compare what the rewritten pages reference, not their serialization
+        results[engine] = (discovered(assets), list(asset_index), discovered(discover(cloner, rewritten)[1]))
+
+    assert results['soup'] == results['lxml']
+    assert results['soup'][0]
+    assert all(original_url.startswith('assets/') for _, _, original_url, _ in results['soup'][2])
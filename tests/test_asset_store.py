@@ -0,0 +1,55 @@
+import pytest
+
+from asset_store import AssetStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AssetStore(tmp_path / "store")
+
+
+def put(store, content, dest_path):
+    temp_path = store.new_temp_path()
+    temp_path.write_bytes(content)
+    return store.store(temp_path, dest_path)
+
+
+def test_identical_content_shares_one_blob(store, tmp_path):
+    first = put(store, b'body', tmp_path / "a.css")
+    second = put(store, b'body', tmp_path / "b.css")
+
+    assert first == second == store.hash_file(tmp_path / "a.css")
+    assert store.ref_count(first) == 2
+    assert (tmp_path / "a.css").stat().st_ino == (tmp_path / "b.css").stat().st_ino
+    assert list(store.tmp_dir.iterdir()) == []
+
+
+def test_release_keeps_referenced_blobs(store, tmp_path):
+    digest = put(store, b'body', tmp_path / "a.css")
+    assert store.release([digest]) == 0
+    assert store.blob_path(digest).exists()
+
+
+def test_release_frees_a_blob_once_its_last_link_is_gone(store, tmp_path):
+    digest = put(store, b'body', tmp_path / "a.css")
+    assert store.link(digest, tmp_path / "b.css")
+    assert store.ref_count(digest) == 2
+
+    (tmp_path / "a.css").unlink()
+    assert store.release([digest]) == 0
+    (tmp_path / "b.css").unlink()
+    assert store.release([digest, digest]) == len(b'body')
+
+    assert not store.blob_path(digest).exists()
+    assert store.ref_count(digest) == 0
+    assert not store.link(digest, tmp_path / "c.css")
+
+
+def test_collect_garbage_frees_only_unreferenced_blobs(store, tmp_path):
+    kept = put(store, b'kept', tmp_path / "kept.css")
+    dropped = put(store, b'dropped', tmp_path / "dropped.css")
+    (tmp_path / "dropped.css").unlink()
+
+    assert store.collect_garbage() == len(b'dropped')
+    assert store.blob_path(kept).exists()
+    assert not store.blob_path(dropped).exists()
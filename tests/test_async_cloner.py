@@ -0,0 +1,65 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from async_cloner import AsyncWebsiteCloner
+from page_cloner import DownloadStats
+
+
+class HangingContext:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def new_page(self):
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            self.pool.cancelled = True
+            raise
+
+
+class HangingPool:
+    """AsyncBrowserPool stand-in whose pages never load"""
+
+    cancelled = False
+
+    @asynccontextmanager
+    async def context(self):
+        yield HangingContext(self)
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def cloner(tmp_path):
+    cloner = AsyncWebsiteCloner(base_dir=str(tmp_path), browser_timeout=0.2)
+    yield cloner
+    cloner.close()
+
+
+def test_hung_page_times_out(cloner):
+    cloner.browser_pool = pool = HangingPool()
+
+    with pytest.raises(TimeoutError):
+        cloner.capture_page('https://example.com/')
+
+    assert pool.cancelled
+    assert cloner.catalog.count(status='error') == 1
+
+
+def test_download_stats_count_outcomes():
+    stats = DownloadStats(4)
+    for _ in range(4):
+        stats.start()
+    assert stats.snapshot()['in_flight'] == 4
+
+    stats.finish('downloaded', 100, source='from_browser')
+    stats.finish('downloaded', 50, truncated=True)
+    stats.finish('skipped')
+    snapshot = stats.finish('failed')
+
+    assert snapshot['in_flight'] == 0
+    assert stats.summary() == {'completed': 4, 'failed': 2, 'skipped': 1, 'truncated': 1, 'bytes': 150,
+                               'from_browser': 1, 'prefetched': 0, 'reused': 0}
@@ -0,0 +1,71 @@
+from contextlib import contextmanager
+
+import pytest
+
+import browser_pool
+from browser_pool import BrowserPool
+
+
+class FakeBrowser:
+    def is_connected(self):
+        return True
+
+    def new_context(self):
+        return FakeContext()
+
+    def close(self):
+        pass
+
+
+class FakeContext:
+    def close(self):
+        pass
+
+
+def fake_playwright(launches):
+    """sync_playwright stand-in whose n-th start launches with launches[n]"""
+    starts = []
+
+    @contextmanager
+    def sync_playwright():
+        launch = launches[min(len(starts), len(launches) - 1)]
+        starts.append(launch)
+        chromium = type('Chromium', (), {'launch': staticmethod(launch)})
+        yield type('Playwright', (), {'chromium': chromium})
+
+    return sync_playwright, starts
+
+
+def failing_launch(headless):
+    raise RuntimeError("driver gone")
+
+
+def test_failed_launch_restarts_playwright(monkeypatch):
+    sync_playwright, starts = fake_playwright([failing_launch, lambda headless: FakeBrowser()])
+    monkeypatch.setattr(browser_pool, 'sync_playwright', sync_playwright)
+    pool = BrowserPool(max_contexts=1)
+    try:
+        with pytest.raises(RuntimeError, match="driver gone"):
+            pool.run(lambda context: 'first')
+        assert pool.run(lambda context: 'second') == 'second'
+        assert pool.run(lambda context: 'third') == 'third'
+    finally:
+        pool.close()
+    assert len(starts) == 2
+
+
+def test_task_errors_keep_the_browser(monkeypatch):
+    sync_playwright, starts = fake_playwright([lambda headless: FakeBrowser()])
+    monkeypatch.setattr(browser_pool, 'sync_playwright', sync_playwright)
+    pool = BrowserPool(max_contexts=1)
+
+    def broken_capture(context):
+        raise ValueError("page crashed")
+
+    try:
+        with pytest.raises(ValueError):
+            pool.run(broken_capture)
+        assert pool.run(lambda context: 'ok') == 'ok'
+    finally:
+        pool.close()
+    assert len(starts) == 1
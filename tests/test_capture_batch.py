@@ -0,0 +1,90 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from capture_batch import CaptureBatch, parse_url_list
+
+
+def test_parses_one_url_per_line():
+    text = """
+    # staging sites
+    https://a.example.com/
+
+    https://b.example.com/page
+    https://a.example.com/
+    """
+    assert parse_url_list(text) == ['https://a.example.com/', 'https://b.example.com/page']
+
+
+def test_parses_json_list_and_object():
+    assert parse_url_list('["https://a.com", " https://b.com ", "https://a.com"]') == ['https://a.com', 'https://b.com']
+    assert parse_url_list('{"urls": ["https://a.com"]}') == ['https://a.com']
+
+
+def test_invalid_json_raises():
+    with pytest.raises(ValueError):
+        parse_url_list('["https://a.com"')
+
+
+def new_batch(tmp_path, urls, **options):
+    return CaptureBatch(SimpleNamespace(base_dir=tmp_path), urls, **options)
+
+
+def finish(batch, entry):
+    """What a batch worker does once a capture ends"""
+    with batch._condition:
+        batch._active[entry['domain']] -= 1
+        batch._condition.notify_all()
+
+
+def test_invalid_urls_are_never_scheduled(tmp_path):
+    batch = new_batch(tmp_path, ['ftp://a.com/', 'not a url', 'https://a.com/'], domain_delay=0)
+    assert [entry['status'] for entry in batch.entries] == ['error', 'error', 'pending']
+    assert batch._next_entry()['url'] == 'https://a.com/'
+
+
+def test_busy_domains_are_skipped(tmp_path):
+    batch = new_batch(tmp_path, ['https://a.com/1', 'https://a.com/2', 'https://b.com/1'],
+                      per_domain=1, domain_delay=0)
+    first = batch._next_entry()
+    second = batch._next_entry()
+    assert (first['url'], second['url']) == ('https://a.com/1', 'https://b.com/1')
+    assert first['status'] == second['status'] == 'running'
+
+    finish(batch, first)
+    assert batch._next_entry()['url'] == 'https://a.com/2'
+    assert batch._next_entry() is None
+
+
+def test_www_prefix_counts_as_the_same_domain(tmp_path):
+    batch = new_batch(tmp_path, ['https://www.a.com/1', 'https://a.com/2', 'https://b.com/1'],
+                      per_domain=1, domain_delay=0)
+    batch._next_entry()
+    assert batch._next_entry()['url'] == 'https://b.com/1'
+
+
+def test_captures_of_one_domain_are_spaced_out(tmp_path):
+    batch = new_batch(tmp_path, ['https://a.com/1', 'https://a.com/2'], per_domain=2, domain_delay=0.2)
+    start = time.monotonic()
+    batch._next_entry()
+    batch._next_entry()
+    assert time.monotonic() - start >= 0.2
+
+
+def test_waits_for_a_busy_domain_to_free_up(tmp_path):
+    batch = new_batch(tmp_path, ['https://a.com/1', 'https://a.com/2'], per_domain=1, domain_delay=0)
+    first = batch._next_entry()
+    timer = threading.Timer(0.1, finish, (batch, first))
+    timer.start()
+    start = time.monotonic()
+    assert batch._next_entry()['url'] == 'https://a.com/2'
+    assert time.monotonic() - start >= 0.1
+
+
+def test_cancel_drops_pending_entries(tmp_path):
+    batch = new_batch(tmp_path, ['https://a.com/1', 'https://b.com/1'], domain_delay=0)
+    batch.cancel()
+    assert batch._next_entry() is None
+    assert [entry['status'] for entry in batch.entries] == ['cancelled', 'cancelled']
@@ -0,0 +1,114 @@
+import json
+import socket
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from capture_catalog import CaptureCatalog
+
+
+def capture(folder_name, url, capture_time):
+    return {'folder_name': folder_name, 'original_url': url, 'capture_time': capture_time}
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = CaptureCatalog(tmp_path / "catalog.sqlite3")
+    catalog.upsert(capture('a_1', 'https://www.a.com/', '2025-01-01T00:00:00'))
+    catalog.upsert(capture('a_2', 'https://a.com/pricing', '2025-03-01T00:00:00'))
+    catalog.upsert(capture('b_1', 'https://b.com/', '2025-02-01T00:00:00'), status='error')
+    return catalog
+
+
+def names(captures):
+    return [metadata['folder_name'] for metadata in captures]
+
+
+def test_query_is_newest_first(catalog):
+    assert names(catalog.query()) == ['a_2', 'b_1', 'a_1']
+
+
+def test_filters(catalog):
+    assert names(catalog.query(domain='www.a.com')) == ['a_2', 'a_1']
+    assert names(catalog.query(status='error')) == ['b_1']
+    assert names(catalog.query(since='2025-02-01', until='2025-02-28')) == ['b_1']
+    assert catalog.count(domain='a.com') == 2
+    assert catalog.count(status='completed') == 2
+
+
+def test_pagination(catalog):
+    assert names(catalog.query(limit=2)) == ['a_2', 'b_1']
+    assert names(catalog.query(limit=2, offset=2)) == ['a_1']
+    assert catalog.query(limit=2, offset=4) == []
+
+
+def test_sync_imports_new_folders_and_drops_vanished_ones(catalog, tmp_path):
+    base_dir = tmp_path / "captures"
+    (base_dir / "a_1").mkdir(parents=True)
+    (base_dir / "c_1").mkdir()
+    (base_dir / "c_1" / "metadata.json").write_text(json.dumps({
+        'original_url': 'https://c.com/', 'capture_time': '2025-04-01T00:00:00'
+    }))
+    (base_dir / ".blobs").mkdir()
+    (base_dir / "empty").mkdir()
+
+    catalog.sync_with_disk(base_dir)
+
+    assert names(catalog.query()) == ['c_1', 'a_1']
+    assert catalog.query(domain='c.com')[0]['folder_name'] == 'c_1'
+
+
+def in_progress_catalog(tmp_path, owner):
+    base_dir = tmp_path / "captures"
+    (base_dir / "a_1").mkdir(parents=True)
+    catalog = CaptureCatalog(tmp_path / "catalog.sqlite3")
+    catalog.upsert(capture('a_1', 'https://a.com/', '2025-01-01T00:00:00'), status='in_progress')
+    if owner is not True:
+        catalog._db.execute("UPDATE captures SET owner = ?", (owner,))
+        catalog._db.commit()
+    return catalog, base_dir
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_sync_marks_captures_of_dead_processes_as_errors(tmp_path):
+    catalog, base_dir = in_progress_catalog(tmp_path, f"{socket.gethostname()}:{dead_pid()}")
+    catalog.sync_with_disk(base_dir)
+    assert catalog.count(status='error') == 1
+
+
+def test_sync_marks_captures_without_owner_as_errors(tmp_path):
+    catalog, base_dir = in_progress_catalog(tmp_path, None)
+    catalog.sync_with_disk(base_dir)
+    assert catalog.count(status='error') == 1
+
+
+def test_sync_leaves_live_captures_alone(tmp_path):
+    # Owned by this process, like a batch CLI capture seen from the app
+    catalog, base_dir = in_progress_catalog(tmp_path, True)
+    catalog.sync_with_disk(base_dir)
+    assert catalog.count(status='in_progress') == 1
+
+
+def test_sync_leaves_other_hosts_alone(tmp_path):
+    catalog, base_dir = in_progress_catalog(tmp_path, "elsewhere.example:1")
+    catalog.sync_with_disk(base_dir)
+    assert catalog.count(status='in_progress') == 1
+
+
+def test_older_catalogs_gain_the_owner_column(tmp_path):
+    db = sqlite3.connect(str(tmp_path / "catalog.sqlite3"))
+    db.execute("CREATE TABLE captures (folder_name TEXT PRIMARY KEY, domain TEXT, original_url TEXT, "
+               "capture_time TEXT, status TEXT NOT NULL, metadata TEXT NOT NULL)")
+    db.commit()
+    db.close()
+
+    catalog = CaptureCatalog(tmp_path / "catalog.sqlite3")
+    catalog.upsert(capture('a_1', 'https://a.com/', '2025-01-01T00:00:00'), status='in_progress')
+    assert catalog.count(status='in_progress') == 1
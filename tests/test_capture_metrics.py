@@ -0,0 +1,48 @@
+from capture_metrics import CaptureMetrics
+
+
+def render(metrics, gauges=None):
+    return metrics.render(gauges).splitlines()
+
+
+def test_renders_stage_summaries():
+    metrics = CaptureMetrics()
+    for seconds in (1.0, 2.0, 3.0, 4.0):
+        metrics.record({'download': {'start': 0.5, 'seconds': seconds, 'bytes': 1000}})
+
+    lines = render(metrics)
+    assert '# TYPE website_cloner_capture_stage_seconds summary' in lines
+    assert 'website_cloner_capture_stage_seconds{stage="download",quantile="0.5"} 2.0' in lines
+    assert 'website_cloner_capture_stage_seconds{stage="download",quantile="0.99"} 4.0' in lines
+    assert 'website_cloner_capture_stage_seconds_sum{stage="download"} 10.0' in lines
+    assert 'website_cloner_capture_stage_seconds_count{stage="download"} 4' in lines
+    assert 'website_cloner_capture_stage_bytes_sum{stage="download"} 4000' in lines
+    # Fields that are not metrics, like the start offset, are left out
+    assert not any('start' in line for line in lines if not line.startswith('#'))
+
+
+def test_quantiles_cover_the_window_and_totals_everything():
+    metrics = CaptureMetrics(window=2)
+    for seconds in (100.0, 1.0, 2.0):
+        metrics.record({'parse': {'seconds': seconds}})
+
+    lines = render(metrics)
+    assert 'website_cloner_capture_stage_seconds{stage="parse",quantile="0.99"} 2.0' in lines
+    assert 'website_cloner_capture_stage_seconds_sum{stage="parse"} 103.0' in lines
+    assert 'website_cloner_capture_stage_seconds_count{stage="parse"} 3' in lines
+
+
+def test_renders_gauges():
+    lines = render(CaptureMetrics(), {
+        'capture_queue_jobs': ("Captures in the queue", {'running': 1, 'queued': 3}),
+        'progress_streams': ("Open progress streams", 2),
+    })
+    assert lines == [
+        '# HELP website_cloner_capture_queue_jobs Captures in the queue',
+        '# TYPE website_cloner_capture_queue_jobs gauge',
+        'website_cloner_capture_queue_jobs{state="queued"} 3',
+        'website_cloner_capture_queue_jobs{state="running"} 1',
+        '# HELP website_cloner_progress_streams Open progress streams',
+        '# TYPE website_cloner_progress_streams gauge',
+        'website_cloner_progress_streams 2',
+    ]
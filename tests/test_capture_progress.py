@@ -0,0 +1,63 @@
+from capture_progress import ProgressBroker
+
+
+def test_subscriber_only_gets_the_latest_update_per_job():
+    broker = ProgressBroker()
+    subscription = broker.subscribe('job')
+    for percent in (10, 20, 30):
+        broker.publish('job', 'in_progress', f'{percent}%', percent=percent)
+
+    updates = subscription.wait(0)
+    assert [(job_id, progress['percent']) for job_id, progress in updates] == [('job', 30)]
+    assert subscription.wait(0) == []
+
+
+def test_all_jobs_subscriber_keeps_one_update_per_job():
+    broker = ProgressBroker()
+    subscription = broker.subscribe()
+    broker.publish('a', 'in_progress', 'a1')
+    broker.publish('b', 'in_progress', 'b1')
+    broker.publish('a', 'completed', 'a2')
+
+    updates = dict(subscription.wait(0))
+    assert {job_id: progress['message'] for job_id, progress in updates.items()} == {'a': 'a2', 'b': 'b1'}
+
+
+def test_new_subscriber_starts_from_the_current_state():
+    broker = ProgressBroker()
+    broker.publish('job', 'in_progress', 'halfway', percent=50)
+    updates = broker.subscribe('job').wait(0)
+    assert updates[0][1]['percent'] == 50
+
+
+def test_job_subscriber_ignores_other_jobs():
+    broker = ProgressBroker()
+    subscription = broker.subscribe('job')
+    broker.publish('other', 'in_progress', 'elsewhere')
+    assert subscription.wait(0.01) == []
+
+
+def test_if_status_guards_against_stale_updates():
+    broker = ProgressBroker()
+    broker.publish('job', 'queued', 'waiting')
+    broker.publish('job', 'in_progress', 'running')
+    assert broker.publish('job', 'queued', 'position 2', if_status='queued') is None
+    assert broker.get('job')['status'] == 'in_progress'
+
+
+def test_closed_subscription_is_unsubscribed():
+    broker = ProgressBroker()
+    subscription = broker.subscribe('job')
+    all_jobs = broker.subscribe()
+    assert broker.subscriber_count() == 2
+    subscription.close()
+    all_jobs.close()
+    assert broker.subscriber_count() == 0
+
+
+def test_evict_drops_only_old_finished_jobs():
+    broker = ProgressBroker(max_age=0)
+    broker.publish('done', 'completed', 'ok')
+    broker.publish('running', 'in_progress', 'busy')
+    assert broker.evict() == 1
+    assert set(broker.jobs()) == {'running'}
@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+from capture_queue import CaptureQueue, QueueFullError
+
+
+class Jobs:
+    """Job runner that blocks each job until the test releases it"""
+
+    def __init__(self):
+        self.started = {}
+        self.release = threading.Event()
+        self.cancelled = []
+        self.finished = threading.Event()
+
+    def run(self, job_id, payload, cancel_event):
+        self.started[job_id] = payload
+        while not self.release.wait(0.01):
+            if cancel_event.is_set():
+                self.cancelled.append(job_id)
+                break
+        self.finished.set()
+
+
+def wait_until_running(queue, count=1):
+    for _ in range(500):
+        if queue.stats()['running'] == count:
+            return
+        time.sleep(0.01)
+    raise AssertionError('job never started')
+
+
+@pytest.fixture
+def jobs():
+    jobs = Jobs()
+    yield jobs
+    jobs.release.set()
+
+
+def test_full_queue_rejects_new_jobs(jobs):
+    queue = CaptureQueue(jobs.run, workers=1, max_depth=2)
+    queue.submit('running', 1)
+    wait_until_running(queue)
+    queue.submit('a', 2)
+    queue.submit('b', 3)
+
+    with pytest.raises(QueueFullError):
+        queue.submit('c', 4)
+    assert queue.stats() == {'queued': 2, 'running': 1}
+    assert (queue.position('a'), queue.position('b'), queue.position('running')) == (1, 2, None)
+
+    # Cancelling a waiting job makes room again
+    assert queue.cancel('a') == 'queued'
+    queue.submit('c', 4)
+    assert queue.position('c') == 2
+
+
+def test_cancelled_queued_job_never_runs(jobs):
+    queue = CaptureQueue(jobs.run, workers=1, max_depth=5)
+    queue.submit('running', 1)
+    wait_until_running(queue)
+    queue.submit('a', 2)
+    queue.submit('b', 3)
+
+    assert queue.cancel('a') == 'queued'
+    jobs.release.set()
+    for _ in range(500):
+        if 'b' in jobs.started:
+            break
+        time.sleep(0.01)
+    assert list(jobs.started) == ['running', 'b']
+
+
+def test_cancelling_a_running_job_sets_its_event(jobs):
+    queue = CaptureQueue(jobs.run, workers=1)
+    queue.submit('running', 1)
+    wait_until_running(queue)
+
+    assert queue.cancel('running') == 'running'
+    assert jobs.finished.wait(5)
+    assert jobs.cancelled == ['running']
+    wait_until_running(queue, 0)
+    assert queue.cancel('running') is None
+    assert queue.cancel('unknown') is None
+
+
+def test_failing_job_does_not_stop_its_worker():
+    ran = []
+    done = threading.Event()
+
+    def run(job_id, payload, cancel_event):
+        ran.append(job_id)
+        if job_id == 'bad':
+            raise RuntimeError('boom')
+        done.set()
+
+    queue = CaptureQueue(run, workers=1)
+    queue.submit('bad', None)
+    queue.submit('good', None)
+    assert done.wait(5)
+    assert ran == ['bad', 'good']
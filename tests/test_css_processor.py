@@ -0,0 +1,89 @@
+from css_processor import find_css_urls, rewrite_css_urls
+
+
+def urls(css):
+    return [(reference.url, reference.is_import) for reference in find_css_urls(css)]
+
+
+def test_finds_quoted_and_unquoted_urls():
+    css = "a{background:url(img/a.png)} b{background:url('b.png')} c{background:url( \"c.png\" )}"
+    assert urls(css) == [('img/a.png', False), ('b.png', False), ('c.png', False)]
+
+
+def test_unquoted_url_is_trimmed():
+    assert urls("a{background:url(  a.png  )}") == [('a.png', False)]
+
+
+def test_finds_imports():
+    css = '@import "base.css"; @import url(theme.css) screen; @IMPORT \'print.css\';'
+    assert urls(css) == [('base.css', True), ('theme.css', True), ('print.css', True)]
+
+
+def test_url_function_is_case_insensitive():
+    assert urls("a{background:URL(a.png)}") == [('a.png', False)]
+
+
+def test_skips_comments_and_strings():
+    css = '/* url(commented.png) */ a{content:"url(not-a-url.png)"} b{background:url(real.png)}'
+    assert urls(css) == [('real.png', False)]
+
+
+def test_ignores_identifiers_ending_in_url():
+    assert urls("a{--my-url(x): 1; background:url(a.png)}") == [('a.png', False)]
+
+
+def test_references_delimit_the_url_text():
+    css = "a{background:url('a.png')}"
+    reference = find_css_urls(css)[0]
+    assert css[reference.start:reference.end] == 'a.png'
+
+
+def test_unterminated_url_runs_to_the_end():
+    assert urls("a{background:url(a.png") == [('a.png', False)]
+
+
+def test_rewrite_keeps_quotes_and_surrounding_css():
+    css = "@import 'base.css'; a{background:url(\"img/a.png\") no-repeat}"
+    references = find_css_urls(css)
+    rewritten = rewrite_css_urls(css, references, lambda reference: 'local/' + reference.url)
+    assert rewritten == "@import 'local/base.css'; a{background:url(\"local/img/a.png\") no-repeat}"
+
+
+def test_rewrite_leaves_references_without_replacement():
+    css = "a{background:url(a.png)} b{background:url(b.png)}"
+    references = find_css_urls(css)
+    rewritten = rewrite_css_urls(css, references, lambda reference: 'x.png' if reference.url == 'b.png' else None)
+    assert rewritten == "a{background:url(a.png)} b{background:url(\"x.png\")}"
+
+
+def test_rewrite_without_references_returns_the_css():
+    assert rewrite_css_urls("a{color:red}", [], lambda reference: 'x') == "a{color:red}"
+
+
+def test_unquoted_url_honours_escapes():
+    assert urls(r"a{background:url(a\)b.png)} b{background:url(c\ d.png)}") == [('a)b.png', False), ('c d.png', False)]
+
+
+def test_escapes_are_resolved():
+    assert urls(r"a{background:url(\61 .png)} b{background:url('b\'c.png')}") == [('a.png', False), ("b'c.png", False)]
+
+
+def test_escaped_paren_does_not_end_the_token():
+    css = r"a{background:url(a\).png)} b{background:url(b.png)}"
+    references = find_css_urls(css)
+    assert [reference.url for reference in references] == ['a).png', 'b.png']
+    assert css[references[0].start:references[0].end] == r"a\).png"
+
+
+def test_rewrite_quotes_unquoted_urls():
+    css = "a{background:url(a.png)} @import url(b.css);"
+    rewritten = rewrite_css_urls(css, find_css_urls(css), lambda reference: 'assets/my file (1).png')
+    assert rewritten == 'a{background:url("assets/my file (1).png")} @import url("assets/my file (1).png");'
+    assert urls(rewritten) == [('assets/my file (1).png', False), ('assets/my file (1).png', True)]
+
+
+def test_rewrite_escapes_the_quote_in_use():
+    css = "a{background:url('a.png')}"
+    rewritten = rewrite_css_urls(css, find_css_urls(css), lambda reference: "it's.png")
+    assert rewritten == "a{background:url('it\\'s.png')}"
+    assert urls(rewritten) == [("it's.png", False)]
@@ -0,0 +1,107 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from page_cloner import AssetTooLargeError, DownloadBudget, WebsiteCloner
+
+
+def test_grants_up_to_the_limit():
+    budget = DownloadBudget(100)
+    assert budget.reserve(60) == 60
+    assert budget.reserve(60) == 40
+    assert budget.reserve(10) == 0
+    assert budget.used == 100
+
+
+def test_release_returns_bytes():
+    budget = DownloadBudget(100)
+    budget.reserve(100)
+    budget.release(30)
+    assert budget.reserve(50) == 30
+
+
+def test_without_limit_everything_is_granted():
+    budget = DownloadBudget(None)
+    assert budget.reserve(10 ** 12) == 10 ** 12
+
+
+def test_concurrent_reservations_never_exceed_the_limit():
+    budget = DownloadBudget(10000)
+    granted = []
+    lock = threading.Lock()
+
+    def reserve():
+        for _ in range(100):
+            amount = budget.reserve(7)
+            with lock:
+                granted.append(amount)
+
+    threads = [threading.Thread(target=reserve) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(granted) == budget.used == 10000
+
+
+class FakeResponse:
+    """Streams chunks of 10 bytes, failing after `fail_after` of them if set"""
+
+    def __init__(self, chunks, fail_after=None):
+        self.chunks = chunks
+        self.fail_after = fail_after
+
+    def iter_content(self, chunk_size):
+        for i in range(self.chunks):
+            if i == self.fail_after:
+                raise ConnectionError("connection reset")
+            yield b'x' * 10
+
+
+@pytest.fixture
+def cloner(tmp_path):
+    cloner = WebsiteCloner(base_dir=str(tmp_path), max_asset_bytes=50)
+    yield cloner
+    cloner.close()
+
+
+def test_stored_body_keeps_its_reservation(cloner, tmp_path):
+    budget = DownloadBudget(1000)
+    digest, size, truncated = cloner._stream_to_store(FakeResponse(3), tmp_path / "a.bin", budget)
+    assert (size, truncated) == (30, False)
+    assert budget.used == 30
+
+
+def test_dropped_connection_releases_the_reservation(cloner, tmp_path):
+    budget = DownloadBudget(1000)
+    with pytest.raises(ConnectionError):
+        cloner._stream_to_store(FakeResponse(5, fail_after=3), tmp_path / "a.bin", budget)
+    assert budget.used == 0
+    assert not (tmp_path / "a.bin").exists()
+
+
+def test_oversized_body_releases_the_reservation(cloner, tmp_path):
+    budget = DownloadBudget(1000)
+    with pytest.raises(AssetTooLargeError):
+        cloner._stream_to_store(FakeResponse(8), tmp_path / "a.bin", budget)
+    assert budget.used == 0
+
+
+def test_truncated_body_keeps_what_it_stored(cloner, tmp_path):
+    cloner.oversize_policy = 'truncate'
+    budget = DownloadBudget(1000)
+    digest, size, truncated = cloner._stream_to_store(FakeResponse(8), tmp_path / "a.bin", budget)
+    assert (size, truncated) == (50, True)
+    assert budget.used == 50
+
+
+def test_vanished_prefetch_releases_the_reservation(cloner, tmp_path):
+    budget = DownloadBudget(1000)
+    budget.reserve(30)
+    future = Future()
+    future.set_result(('0' * 64, 30, False))
+
+    result = cloner._link_prefetched((future, cloner.asset_store.new_temp_path()), tmp_path / "a.bin", budget)
+    assert result == (None, 0, False)
+    assert budget.used == 0
@@ -0,0 +1,103 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+import http_cache
+from asset_store import AssetStore
+from http_cache import HttpCache
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AssetStore(tmp_path / "store")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Strictly increasing time so least-recently-used order is deterministic"""
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(http_cache.time, 'time', lambda: next(ticks))
+
+
+def new_cache(tmp_path, store, max_bytes=100):
+    return HttpCache(tmp_path / "cache", store, max_bytes=max_bytes)
+
+
+def response(**headers):
+    return SimpleNamespace(headers=headers)
+
+
+def put(store, content, dest_path):
+    temp_path = store.new_temp_path()
+    temp_path.write_bytes(content)
+    return store.store(temp_path, dest_path)
+
+
+def test_update_and_lookup_keep_validators(tmp_path, store):
+    cache = new_cache(tmp_path, store)
+    digest = put(store, b'body', tmp_path / "a.css")
+    cache.update('https://a.com/a.css', response(ETag='"v1"', **{'Last-Modified': 'yesterday'}), digest, 4)
+
+    entry = cache.lookup('https://a.com/a.css')
+    assert entry == {'etag': '"v1"', 'last_modified': 'yesterday', 'digest': digest, 'size': 4}
+    assert cache.conditional_headers(entry) == {'If-None-Match': '"v1"', 'If-Modified-Since': 'yesterday'}
+    assert store.ref_count(digest) == 2
+
+
+def test_responses_without_validators_are_not_cached(tmp_path, store):
+    cache = new_cache(tmp_path, store)
+    digest = put(store, b'body', tmp_path / "a.css")
+    cache.update('https://a.com/a.css', response(), digest, 4)
+    cache.update('https://a.com/b.css', response(ETag='"v1"', **{'Cache-Control': 'no-store'}), digest, 4)
+
+    assert cache.lookup('https://a.com/a.css') is None
+    assert cache.lookup('https://a.com/b.css') is None
+    assert store.ref_count(digest) == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, store, clock):
+    cache = new_cache(tmp_path, store, max_bytes=100)
+    digests = {}
+    for name in ('a', 'b'):
+        digests[name] = put(store, name.encode() * 40, tmp_path / f"{name}.css")
+        cache.update(f'https://a.com/{name}.css', response(ETag=name), digests[name], 40)
+    cache.touch('https://a.com/a.css')
+
+    digests['c'] = put(store, b'c' * 40, tmp_path / "c.css")
+    cache.update('https://a.com/c.css', response(ETag='c'), digests['c'], 40)
+
+    assert cache.lookup('https://a.com/b.css') is None
+    assert cache.lookup('https://a.com/a.css') is not None
+    assert cache.lookup('https://a.com/c.css') is not None
+    # The evicted body is still linked by its capture until that goes too
+    assert store.ref_count(digests['b']) == 1
+    (tmp_path / "b.css").unlink()
+    assert store.collect_garbage() == 40
+
+
+def test_evicting_the_last_reference_frees_the_blob(tmp_path, store, clock):
+    cache = new_cache(tmp_path, store, max_bytes=50)
+    first = put(store, b'1' * 40, tmp_path / "first.css")
+    cache.update('https://a.com/first.css', response(ETag='1'), first, 40)
+    (tmp_path / "first.css").unlink()
+    assert store.ref_count(first) == 1
+
+    second = put(store, b'2' * 40, tmp_path / "second.css")
+    cache.update('https://a.com/second.css', response(ETag='2'), second, 40)
+
+    assert not store.blob_path(first).exists()
+    assert not (cache.bodies_dir / first).exists()
+
+
+def test_shared_body_is_kept_while_any_entry_uses_it(tmp_path, store):
+    cache = new_cache(tmp_path, store)
+    digest = put(store, b'body', tmp_path / "a.css")
+    cache.update('https://a.com/a.css', response(ETag='a'), digest, 4)
+    cache.update('https://b.com/a.css', response(ETag='a'), digest, 4)
+    (tmp_path / "a.css").unlink()
+
+    cache.invalidate('https://a.com/a.css')
+    assert store.blob_path(digest).exists()
+    cache.invalidate('https://b.com/a.css')
+    assert not store.blob_path(digest).exists()
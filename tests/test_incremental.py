@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from page_cloner import WebsiteCloner
+
+
+URL = 'https://www.example.com/'
+
+
+def make_capture(base_dir, folder_name, capture_time, records=True):
+    capture_dir = base_dir / folder_name
+    capture_dir.mkdir()
+    (capture_dir / "metadata.json").write_text(json.dumps({
+        'original_url': URL, 'capture_time': capture_time, 'folder_name': folder_name
+    }))
+    if records:
+        (capture_dir / "asset-records.json").write_text('[]')
+
+
+@pytest.fixture
+def new_cloner(tmp_path):
+    cloners = []
+
+    def new_cloner():
+        cloners.append(WebsiteCloner(base_dir=str(tmp_path)))
+        return cloners[-1]
+
+    yield new_cloner
+    for cloner in cloners:
+        cloner.close()
+
+
+def test_baseline_skips_captures_without_asset_records(tmp_path, new_cloner):
+    make_capture(tmp_path, 'example.com_old', '2025-01-01T00:00:00')
+    make_capture(tmp_path, 'example.com_new', '2025-02-01T00:00:00', records=False)
+    cloner = new_cloner()
+
+    assert cloner.find_baseline(URL) == 'example.com_old'
+
+
+def test_no_baseline_when_no_capture_has_asset_records(tmp_path, new_cloner):
+    make_capture(tmp_path, 'example.com_new', '2025-02-01T00:00:00', records=False)
+    cloner = new_cloner()
+
+    assert cloner.find_baseline(URL) is None
+    with pytest.raises(FileNotFoundError):
+        cloner._load_baseline('example.com_new')
+
+
+def test_baseline_must_be_a_capture_folder(tmp_path, new_cloner):
+    make_capture(tmp_path, 'example.com_old', '2025-01-01T00:00:00')
+    cloner = new_cloner()
+
+    assert cloner.is_baseline('example.com_old')
+    assert not cloner.is_baseline('.blobs')
+    assert not cloner.is_baseline('../example.com_old')
+    assert not cloner.is_baseline('example.com_old/assets')
@@ -0,0 +1,108 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from js_processor import contains_loader, patch_nextjs_loader
+from page_cloner import WebsiteCloner
+
+
+LOADER = ('function n(t){let{config:e,src:n,width:r,quality:i}=t;'
+          'return e.path+"?url="+encodeURIComponent(n)+"&w="+r+"&q="+(i||75)}')
+OTHER_LOADER = ('function a(t){let{config:e,src:n,width:r,quality:i}=t;'
+                'return e.path+"?url="+encodeURIComponent(n)+"&w="+r+"&q="+(i||75)}')
+MAPPING = {'https://example.com/a.png': 'assets/images/a.png', 'https://example.com/b\\c.png': 'assets/images/b.png'}
+
+
+def test_contains_loader(tmp_path):
+    (tmp_path / "loader.js").write_text('var x=1;' + LOADER)
+    (tmp_path / "plain.js").write_text('var x=1;')
+    (tmp_path / "empty.js").write_text('')
+
+    assert contains_loader(tmp_path / "loader.js")
+    assert not contains_loader(tmp_path / "plain.js")
+    assert not contains_loader(tmp_path / "empty.js")
+
+
+def test_patches_the_loader_function(tmp_path):
+    (tmp_path / "chunk.js").write_text('a();' + LOADER + ';b();')
+
+    matched = patch_nextjs_loader(tmp_path / "chunk.js", tmp_path / "out.js", json.dumps(MAPPING))
+
+    assert matched == 'function'
+    patched = (tmp_path / "out.js").read_text()
+    assert patched.startswith('a();function n(t){') and patched.endswith(';b();')
+    assert 'encodeURIComponent' not in patched
+    # The mapping is embedded verbatim, backslash escapes included
+    assert json.dumps(MAPPING) in patched
+
+
+def test_patches_just_the_return_of_other_loader_shapes(tmp_path):
+    (tmp_path / "chunk.js").write_text(OTHER_LOADER)
+
+    matched = patch_nextjs_loader(tmp_path / "chunk.js", tmp_path / "out.js", json.dumps(MAPPING))
+
+    assert matched == 'return'
+    patched = (tmp_path / "out.js").read_text()
+    assert patched.startswith('function a(t){let{config:e,src:n,width:r,quality:i}=t;const imageMapping')
+    assert 'encodeURIComponent' not in patched
+
+
+def test_leaves_files_without_the_loader_alone(tmp_path):
+    (tmp_path / "chunk.js").write_text('var x=1;')
+
+    assert patch_nextjs_loader(tmp_path / "chunk.js", tmp_path / "out.js", '{}') is None
+    assert not (tmp_path / "out.js").exists()
+
+
+@pytest.fixture
+def cloner(tmp_path):
+    cloner = WebsiteCloner(base_dir=str(tmp_path / "captures"), patch_js_loaders=True, js_workers=1)
+    yield cloner
+    cloner.close()
+
+
+def stored_chunk(cloner, tmp_path, content):
+    """A capture with one downloaded JS chunk linked from the blob store"""
+    capture_dir = tmp_path / "captures" / "capture"
+    (capture_dir / "assets" / "js").mkdir(parents=True)
+    temp_path = cloner.asset_store.new_temp_path()
+    temp_path.write_text(content)
+    digest = cloner.asset_store.store(temp_path, capture_dir / "assets" / "js" / "chunk.js")
+    asset = SimpleNamespace(local_path='assets/js/chunk.js', content_hash=digest, size=len(content))
+    return capture_dir, {'js': [asset]}, asset
+
+
+def test_patched_chunk_replaces_the_original_blob(cloner, tmp_path):
+    capture_dir, assets, asset = stored_chunk(cloner, tmp_path, LOADER)
+    old_digest = asset.content_hash
+    url_index = SimpleNamespace(client_mapping=lambda: MAPPING)
+
+    modified = cloner._modify_nextjs_loader_in_js_files(assets, capture_dir, url_index)
+
+    chunk_path = capture_dir / "assets" / "js" / "chunk.js"
+    assert modified == ['assets/js/chunk.js']
+    assert asset.content_hash != old_digest
+    assert asset.content_hash == cloner.asset_store.hash_file(chunk_path)
+    assert asset.size == chunk_path.stat().st_size
+    assert not cloner.asset_store.blob_path(old_digest).exists()
+    assert sorted(path.name for path in chunk_path.parent.iterdir()) == ['chunk.js']
+
+
+def test_failed_store_keeps_the_original_chunk(cloner, tmp_path, monkeypatch):
+    capture_dir, assets, asset = stored_chunk(cloner, tmp_path, LOADER)
+    old_digest = asset.content_hash
+    url_index = SimpleNamespace(client_mapping=lambda: MAPPING)
+
+    def full_disk(temp_path, dest_path, digest=None):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(cloner.asset_store, 'store', full_disk)
+    modified = cloner._modify_nextjs_loader_in_js_files(assets, capture_dir, url_index)
+
+    chunk_path = capture_dir / "assets" / "js" / "chunk.js"
+    assert modified == []
+    assert asset.content_hash == old_digest
+    assert chunk_path.read_text() == LOADER
+    assert cloner.asset_store.blob_path(old_digest).exists()
+    assert list(cloner.asset_store.tmp_dir.iterdir()) == []
@@ -0,0 +1,32 @@
+from screenshots import SCREENSHOT_FORMATS, screenshot_clips
+
+
+def test_tall_pages_are_split_into_tiles():
+    clips, truncated = screenshot_clips(1280, 20000, tile_height=8000)
+    assert not truncated
+    assert [(clip['y'], clip['height']) for clip in clips] == [(0, 8000), (8000, 8000), (16000, 4000)]
+    assert all(clip['x'] == 0 and clip['width'] == 1280 for clip in clips)
+
+
+def test_short_page_is_one_clip():
+    clips, truncated = screenshot_clips(1280, 900)
+    assert clips == [{'x': 0, 'y': 0, 'width': 1280, 'height': 900}]
+    assert not truncated
+
+
+def test_empty_page_still_gets_a_clip():
+    clips, _ = screenshot_clips(1280, 0)
+    assert clips == [{'x': 0, 'y': 0, 'width': 1280, 'height': 1}]
+
+
+def test_max_height_cuts_the_page_off():
+    clips, truncated = screenshot_clips(1280, 20000, max_height=10000, tile_height=8000)
+    assert truncated
+    assert sum(clip['height'] for clip in clips) == 10000
+
+
+def test_format_limit_cuts_the_page_off():
+    limit = SCREENSHOT_FORMATS['webp'][3]
+    clips, truncated = screenshot_clips(1280, 40000, fmt='webp', max_height=50000)
+    assert truncated
+    assert sum(clip['height'] for clip in clips) == limit
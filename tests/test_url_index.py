@@ -0,0 +1,40 @@
+from url_index import canonicalize_url, unwrap_nextjs_image_url
+
+
+BASE = 'https://Example.com/blog/post.html'
+
+
+def test_resolves_relative_urls():
+    assert canonicalize_url('../img/a.png', BASE) == 'https://example.com/img/a.png'
+    assert canonicalize_url('//cdn.example.com/a.png', BASE) == 'https://cdn.example.com/a.png'
+
+
+def test_lowercases_scheme_and_host_only():
+    assert canonicalize_url('HTTPS://CDN.Example.COM/Img/A.png', BASE) == 'https://cdn.example.com/Img/A.png'
+
+
+def test_sorts_query_and_drops_fragment():
+    assert canonicalize_url('/a.png?w=2&a=1#top', BASE) == 'https://example.com/a.png?a=1&w=2'
+
+
+def test_decodes_html_entities():
+    assert canonicalize_url('/a.png?a=1&amp;b=2', BASE) == 'https://example.com/a.png?a=1&b=2'
+
+
+def test_empty_path_becomes_root():
+    assert canonicalize_url('https://example.com', BASE) == 'https://example.com/'
+
+
+def test_unwraps_nextjs_image_urls():
+    url = '/_next/image?url=%2Fimages%2Fhero.jpg&w=1080&q=75'
+    assert unwrap_nextjs_image_url(url) == '/images/hero.jpg'
+    assert canonicalize_url(url, BASE) == 'https://example.com/images/hero.jpg'
+
+
+def test_spellings_of_one_asset_share_a_canonical_url():
+    spellings = [
+        'https://example.com/a.png?b=2&a=1',
+        '/a.png?a=1&b=2#x',
+        ' https://EXAMPLE.com/a.png?a=1&amp;b=2 ',
+    ]
+    assert len({canonicalize_url(url, BASE) for url in spellings}) == 1
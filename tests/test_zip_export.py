@@ -0,0 +1,45 @@
+import io
+import zipfile
+
+from zip_export import iter_zip
+
+
+def make_capture(tmp_path):
+    capture_dir = tmp_path / "capture"
+    (capture_dir / "assets" / "images").mkdir(parents=True)
+    (capture_dir / "index.html").write_text("<html>" + "hello " * 5000 + "</html>")
+    (capture_dir / "assets" / "images" / "a.png").write_bytes(bytes(range(256)) * 100)
+    (capture_dir / "metadata.json").write_text('{"ok": true}')
+    return capture_dir
+
+
+def test_archive_holds_every_file(tmp_path):
+    capture_dir = make_capture(tmp_path)
+    data = b''.join(iter_zip(capture_dir))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert sorted(archive.namelist()) == ['assets/images/a.png', 'index.html', 'metadata.json']
+        for name in archive.namelist():
+            assert archive.read(name) == (capture_dir / name).read_bytes()
+
+
+def test_compressed_media_is_stored(tmp_path):
+    capture_dir = make_capture(tmp_path)
+    with zipfile.ZipFile(io.BytesIO(b''.join(iter_zip(capture_dir)))) as archive:
+        assert archive.getinfo('assets/images/a.png').compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo('index.html').compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_archive_is_streamed_in_chunks(tmp_path):
+    capture_dir = make_capture(tmp_path)
+    chunks = list(iter_zip(capture_dir, chunk_size=4096))
+    assert len(chunks) > 2
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+        assert archive.testzip() is None
+
+
+def test_empty_capture_is_a_valid_archive(tmp_path):
+    (tmp_path / "empty").mkdir()
+    with zipfile.ZipFile(io.BytesIO(b''.join(iter_zip(tmp_path / "empty")))) as archive:
+        assert archive.namelist() == []
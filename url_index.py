@@ -0,0 +1,88 @@
+import html
+from urllib.parse import urljoin, urlparse, urlunparse, urlencode, parse_qs, parse_qsl, unquote
+
+
+def unwrap_nextjs_image_url(url):
+    """Extract the real image URL from a Next.js /_next/image?url=... URL"""
+    try:
+        if '/_next/image?' in url:
+            query_params = parse_qs(urlparse(url).query)
+            if 'url' in query_params:
+                return unquote(query_params['url'][0])
+        return url
+    except Exception:
+        return url
+
+
+def canonicalize_url(url, base_url):
+    """The single canonical form used to match asset URLs.
+
+    Decodes HTML entities, unwraps Next.js image optimisation URLs,
+    resolves against base_url, lowercases scheme and host, sorts query
+    parameters and drops the fragment.
+    """
+    url = html.unescape(url.strip())
+    url = unwrap_nextjs_image_url(url)
+    parsed = urlparse(urljoin(base_url, url))
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    return urlunparse((parsed.scheme.lower(), parsed.netloc.lower(), parsed.path or '/',
+                       parsed.params, query, ''))
+
+
+class UrlIndex:
+    """Canonical URL -> local path lookup, built once per capture.
+
+    Every rewrite and script injection path queries the same index, so a
+    URL matches consistently no matter how the page spelled it.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self._local_paths = {}
+        self._client_urls = {}
+        self._client_aliases = {}
+
+    def add(self, url, local_path, client_visible=False, alias=None):
+        """Register a downloaded asset
+
+        client_visible exposes it to injected scripts, which also match
+        alias - the reference exactly as the page wrote it.
+        """
+        key = canonicalize_url(url, self.base_url)
+        self._local_paths.setdefault(key, local_path)
+        if client_visible:
+            self._client_urls.setdefault(key, local_path)
+            if alias:
+                alias = unwrap_nextjs_image_url(html.unescape(alias))
+                self._client_aliases.setdefault(alias, local_path)
+
+    def lookup(self, url, base_url=None):
+        """Local path for a URL as written in the page (or a stylesheet), or None"""
+        if not url or url.startswith('data:'):
+            return None
+        return self._local_paths.get(canonicalize_url(url, base_url or self.base_url))
+
+    def __len__(self):
+        return len(self._local_paths)
+
+    def client_mapping(self):
+        """Mapping for injected scripts, keyed by the URLs the browser will see
+
+        Same-origin assets are keyed by both their absolute URL and their
+        path, and Next.js internal URLs are left out so the scripts don't
+        interfere with the framework's own loading.
+        """
+        base = urlparse(self.base_url)
+        mapping = {}
+        for key, local_path in self._client_urls.items():
+            parsed = urlparse(key)
+            path = parsed.path + (f"?{parsed.query}" if parsed.query else '')
+            if path.startswith('/_next/'):
+                continue
+            mapping[key] = local_path
+            if parsed.netloc == base.netloc.lower():
+                mapping[path] = local_path
+        for alias, local_path in self._client_aliases.items():
+            if not alias.startswith('/_next/'):
+                mapping.setdefault(alias, local_path)
+        return mapping
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+import zipfile
+from pathlib import Path
+
+
+CHUNK_SIZE = 64 * 1024
+
+# Formats that are already compressed; deflating them again only costs CPU
+STORED_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.ico',
+    '.mp4', '.webm', '.mov', '.avi', '.mp3', '.m4a', '.ogg', '.flac',
+    '.woff', '.woff2', '.zip', '.gz', '.br'
+}
+
+
+class _ChunkSink:
+    """Write-only file object collecting archive bytes until the generator yields them
+
+    It has no tell() or seek(), so zipfile writes sizes in data
+    descriptors after each entry instead of seeking back.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """Return and clear the bytes written so far"""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def _capture_files(capture_dir):
+    """Files of a capture in archive order with their archive names"""
+    for file_path in sorted(capture_dir.rglob('*')):
+        if file_path.is_file():
+            yield file_path, file_path.relative_to(capture_dir).as_posix()
+
+
+def iter_zip(capture_dir, chunk_size=CHUNK_SIZE):
+    """Generate a ZIP archive of a capture folder chunk by chunk
+
+    Nothing is written to disk, and the first bytes are available as soon
+    as the first file has been read. Already-compressed media is stored
+    rather than deflated.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w') as archive:
+        for file_path, arcname in _capture_files(Path(capture_dir)):
+            info = zipfile.ZipInfo.from_file(file_path, arcname, strict_timestamps=False)
+            if file_path.suffix.lower() in STORED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+
+            with open(file_path, 'rb') as source, archive.open(info, 'w') as entry:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    entry.write(chunk)
+                    if sink.size >= chunk_size:
+                        yield sink.take()
+
+    # Remaining entry data and the central directory
+    yield sink.take()
+
+
+def capture_content_hash(capture_dir):
+    """Hash of a capture's file names and contents
+
+    Assets are identified by their blob digests from asset-manifest.json;
+    only the remaining files are read and hashed.
+    """
+    capture_dir = Path(capture_dir)
+    manifest = {}
+    manifest_path = capture_dir / "asset-manifest.json"
+    if manifest_path.exists():
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    hasher = hashlib.sha256()
+    for file_path, arcname in _capture_files(capture_dir):
+        digest = manifest.get(arcname)
+        if digest is None:
+            file_hasher = hashlib.sha256()
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    file_hasher.update(chunk)
+            digest = file_hasher.hexdigest()
+        hasher.update(f"{arcname}\0{digest}\n".encode('utf-8'))
+    return hasher.hexdigest()
+
+
+class ZipCache:
+    """Finished capture archives keyed by capture content hash.
+
+    An archive is cached while it is streamed to the first client and only
+    becomes visible once complete, so concurrent downloads never see a
+    partial file. Least recently used archives are evicted beyond
+    max_bytes.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        # Temp files of downloads interrupted by a restart
+        for temp_path in self.root.glob('*.tmp'):
+            temp_path.unlink()
+
+    def open(self, key):
+        """Open the cached archive for key, or return None"""
+        path = self.root / f"{key}.zip"
+        try:
+            archive = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return archive
+
+    def store_while_streaming(self, key, chunks):
+        """Pass chunks through, saving them as the archive for key once all were sent"""
+        temp_path = self.root / f"{key}.{uuid.uuid4().hex}.tmp"
+        complete = False
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            if complete:
+                os.replace(temp_path, self.root / f"{key}.zip")
+                self._evict()
+            elif temp_path.exists():
+                temp_path.unlink()
+
+    def _evict(self):
+        """Remove least recently used archives until the cache fits in max_bytes"""
+        with self._lock:
+            archives = []
+            for path in self.root.glob('*.zip'):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                archives.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in archives)
+            for _, size, path in sorted(archives):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size